@@ -0,0 +1,115 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Detection of the services affected by the changes since a git revision.
+
+Changed files are mapped to the service owning the deepest directory
+containing them with a trie of path components, so the cost is proportional
+to the depth of the files instead of the number of services.
+"""
+
+import logging
+import os
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from ..config.model import UntropyConfigurationError, UntropySettings
+
+logger = logging.getLogger("untropy")
+
+OWNER = ""
+"Key of the owner in a trie node, never a path component"
+
+TrieNode = Dict[str, Any]
+"Children of a path prefix by path component, and its owner under OWNER"
+
+
+class PathTrie:
+    """Map paths to the owner of their longest registered prefix."""
+
+    def __init__(self):
+        self.root: TrieNode = {}
+
+    @staticmethod
+    def components(path: str) -> List[str]:
+        return [component for component in path.replace(os.sep, "/").split("/") if component not in ("", ".")]
+
+    def insert(self, path: str, owner: str):
+        node = self.root
+        for component in self.components(path):
+            node = node.setdefault(component, {})
+        node[OWNER] = owner
+
+    def owner(self, path: str) -> Optional[str]:
+        node = self.root
+        owner = node.get(OWNER)
+        for component in self.components(path):
+            child: Optional[TrieNode] = node.get(component)
+            if child is None:
+                break
+            node = child
+            owner = node.get(OWNER, owner)
+        return owner
+
+
+def git(cwd: Path, *args: str) -> str:
+    try:
+        return subprocess.run(["git", *args], cwd=cwd, capture_output=True, check=True, text=True).stdout
+    except subprocess.CalledProcessError as error:
+        raise UntropyConfigurationError(f"git {' '.join(args)} failed: {error.stderr.strip()}")
+
+
+def changed_files(base: str, cwd: Path) -> List[str]:
+    """Return the files changed since base, committed or not, relative to the repository root."""
+    return [line for line in git(cwd, "diff", "--name-only", base, "--").splitlines() if line]
+
+
+def dependents_closure(settings: UntropySettings, services: Iterable[str]) -> Set[str]:
+    """Return services and all the services depending on them, transitively."""
+    dependents: Dict[str, List[str]] = {}
+    for name, service in settings.services.items():
+        for dependency in service.depends_on:
+            dependents.setdefault(dependency, []).append(name)
+
+    result = set(services)
+    pending = list(result)
+    while pending:
+        for dependent in dependents.get(pending.pop(), []):
+            if dependent not in result:
+                result.add(dependent)
+                pending.append(dependent)
+    return result
+
+
+def affected_services(settings: UntropySettings, base: str) -> Set[str]:
+    """Return the services owning the files changed since base and their dependents.
+
+    A change of the project configuration file affects all the services.
+    """
+    home = settings.home.resolve()
+    repository = Path(git(home, "rev-parse", "--show-toplevel").strip()).resolve()
+    trie = PathTrie()
+    for name, service in settings.services.items():
+        trie.insert(os.path.relpath((home / service.path).resolve(), repository), name)
+    configuration = os.path.relpath(home / settings.settings_filename, repository).replace(os.sep, "/")
+
+    owners = set()
+    for path in changed_files(base, home):
+        if path == configuration:
+            logger.debug(f"{path} changed, all services are affected")
+            return set(settings.services)
+        owner = trie.owner(path)
+        if owner is not None:
+            owners.add(owner)
+    return dependents_closure(settings, owners)
@@ -0,0 +1,195 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Concurrent publishing of Python packages to a registry.
+
+Files are uploaded by a pool of threads sharing one keep-alive HTTP session
+(`requests` connection pool sized for the threads). The simple index of each
+project is read once to skip the files whose sha256 digest is already
+published. Requests failing with a connection error or a 429/5xx status are
+retried with an exponential backoff.
+"""
+
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Literal, NamedTuple, Optional, Set
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+from twine.package import PackageFile
+from urllib3.util.retry import Retry
+
+from ..config.model import RegistrySettings
+from ..utils import metrics, trace
+from ..utils.progress import Progress
+
+logger = logging.getLogger("untropy")
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+INDEX_LINK_REGEX = re.compile(r'href="[^"#]*?(?P<file>[^/"#]+)#sha256=(?P<digest>[0-9a-fA-F]{64})"')
+
+PACKAGE_PATTERNS = ("*.whl", "*.tar.gz", "*.zip")
+
+PublishStatus = Literal["uploaded", "skipped", "failed"]
+
+
+class PublishResult(NamedTuple):
+    path: Path
+    status: PublishStatus
+    size: int
+    "Size in bytes"
+    duration: float
+    "Duration in seconds"
+    message: str = ""
+
+
+def normalized_name(name: str) -> str:
+    """Return the PEP 503 normalized project name."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def package_files(directory: Path) -> List[Path]:
+    """Return the package files (wheels and source distributions) of directory."""
+    return sorted({path for pattern in PACKAGE_PATTERNS for path in directory.glob(pattern)})
+
+
+class Publisher:
+    """Upload packages to registry.
+
+    Args:
+        registry: Registry settings.
+        jobs: Number of concurrent uploads, the registry one by default.
+    """
+
+    def __init__(self, registry: RegistrySettings, jobs: Optional[int] = None):
+        self.registry = registry
+        self.jobs = jobs or registry.jobs
+        retry = Retry(
+            total=registry.retries,
+            backoff_factor=0.5,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,  # the upload is idempotent, an existing file is rejected
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.jobs, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if registry.username is not None:
+            password = registry.password.get_secret_value() if registry.password is not None else ""
+            self.session.auth = (registry.username, password)
+        self._digests: Dict[str, "Future[Set[str]]"] = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "Publisher":
+        return self
+
+    def __exit__(self, *args):
+        self.session.close()
+
+    def published_digests(self, name: str) -> Set[str]:
+        """Return the sha256 digests of the files of the project name in the index, read once.
+
+        The index of each project is read by the first caller, the other ones
+        waiting for its result; the projects are read concurrently.
+        """
+        name = normalized_name(name)
+        with self._lock:
+            future = self._digests.get(name)
+            reader = future is None
+            if future is None:
+                future = self._digests[name] = Future()
+        if reader:
+            try:
+                future.set_result(self._read_digests(name))
+            except BaseException as error:
+                with self._lock:
+                    del self._digests[name]  # read again by the next caller
+                future.set_exception(error)
+        return future.result()
+
+    def _read_digests(self, name: str) -> Set[str]:
+        url = urljoin(self.registry.simple_index_url.rstrip("/") + "/", f"{name}/")
+        response = self.session.get(url, timeout=30)
+        if response.status_code == 404:
+            return set()
+        response.raise_for_status()
+        return {match["digest"].lower() for match in INDEX_LINK_REGEX.finditer(response.text)}
+
+    def upload(self, path: Path) -> PublishResult:
+        """Upload path unless it is already published."""
+        start = time.perf_counter()
+        size = path.stat().st_size
+
+        def result(status: PublishStatus, message: str = "") -> PublishResult:
+            metrics.increment("untropy_publish_files_total", result=status)
+            return PublishResult(path, status, size, time.perf_counter() - start, message)
+
+        try:
+            with trace.span("upload", file=path.name):
+                package = PackageFile.from_filename(str(path), None)
+                if not package.metadata.name:
+                    return result("failed", "no project name in the package metadata")
+                if package.sha2_digest in self.published_digests(package.metadata.name):
+                    return result("skipped", "already published")
+                data = {key: value for key, value in package.metadata_dictionary().items() if value is not None}
+                data.update({":action": "file_upload", "protocol_version": "1"})
+                with path.open("rb") as content:
+                    response = self.session.post(
+                        self.registry.url,
+                        data=data,
+                        files={"content": (path.name, content, "application/octet-stream")},
+                        timeout=300,
+                    )
+        except (requests.RequestException, OSError, ValueError) as error:
+            return result("failed", str(error))
+        if response.status_code in (400, 409) and "exist" in response.text.lower():
+            return result("skipped", "already published")
+        if not response.ok:
+            return result("failed", f"{response.status_code} {response.reason}")
+        return result("uploaded")
+
+    def publish(
+        self,
+        paths: Iterable[Path],
+        progress: Optional[Progress] = None,
+        on_result: Optional[Callable[[PublishResult], None]] = None,
+    ) -> List[PublishResult]:
+        """Upload paths concurrently and return their results in the same order.
+
+        Args:
+            paths: Package files.
+            progress: Displays the files being uploaded.
+            on_result: Called with the result of each file when its upload completes.
+        """
+
+        def upload(path: Path) -> PublishResult:
+            if progress is not None:
+                progress.update(path.name, "uploading")
+            try:
+                result = self.upload(path)
+            finally:
+                if progress is not None:
+                    progress.finish(path.name)
+            if on_result is not None:
+                on_result(result)
+            return result
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return list(executor.map(upload, paths))
@@ -0,0 +1,293 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Parallel scheduling of the CI stages of several services.
+
+Each (service, stage) pair is a task. A task waits for the previous stage of
+its service and for the same stage of the services it depends on, so a
+service can deploy while another one is still packaging.
+"""
+
+import logging
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Literal,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+import click
+
+from ..config.model import CIStage, UntropyConfigurationError, UntropySettings
+from ..utils import metrics, trace
+from ..utils.progress import Progress
+from ..utils.redact import redacted_lines
+from .stage_cache import StageCache
+
+logger = logging.getLogger("untropy")
+
+Task = Tuple[str, CIStage]
+"(service, stage)"
+
+StageStatus = Literal["success", "failed", "skipped", "empty", "cached"]
+
+
+class StageResult(NamedTuple):
+    service: str
+    stage: CIStage
+    status: StageStatus
+    duration: float
+    "Duration in seconds"
+    returncode: int = 0
+
+
+def service_graph(settings: UntropySettings, services: Sequence[str]) -> Dict[str, List[str]]:
+    """Return the dependencies of services restricted to services.
+
+    Raises UntropyConfigurationError on unknown services.
+    """
+    graph = {}
+    for service in services:
+        if service not in settings.services:
+            raise UntropyConfigurationError(f"Unknown service: {service}")
+        dependencies = settings.services[service].depends_on
+        unknown = [dependency for dependency in dependencies if dependency not in settings.services]
+        if unknown:
+            raise UntropyConfigurationError(f"Service {service} depends on unknown services: {', '.join(unknown)}")
+        graph[service] = [dependency for dependency in dependencies if dependency in services]
+    return graph
+
+
+class StageScheduler:
+    """Run the stages of services as a DAG in a pool of workers.
+
+    Args:
+        settings: Project settings defining the services.
+        services: Services to run the stages of.
+        stages: Stages to run, in order.
+        jobs: Maximum number of concurrent stages.
+        fail_fast: Stop scheduling new stages after the first failure.
+            Otherwise, only the stages depending on a failed one are skipped.
+        cache: Cache of the results of the stages declaring their inputs.
+    """
+
+    def __init__(
+        self,
+        settings: UntropySettings,
+        services: Sequence[str],
+        stages: Sequence[CIStage],
+        jobs: int = 4,
+        fail_fast: bool = True,
+        cache: Optional[StageCache] = None,
+    ):
+        self.settings = settings
+        self.cache = cache
+        self.stages = list(stages)
+        self.jobs = jobs
+        self.fail_fast = fail_fast
+        self.lock = threading.Lock()
+        self.progress: Optional[Progress] = None
+        self.dependencies: Dict[Task, List[Task]] = {}
+        graph = service_graph(settings, services)
+        for service, service_dependencies in graph.items():
+            for index, stage in enumerate(self.stages):
+                task_dependencies = [(dependency, stage) for dependency in service_dependencies]
+                if index > 0:
+                    task_dependencies.append((service, self.stages[index - 1]))
+                self.dependencies[(service, stage)] = task_dependencies
+        self.order = self.topological_order()
+
+    def topological_order(self) -> List[Task]:
+        """Return the tasks in a dependency order, raise UntropyConfigurationError on cycles."""
+        remaining = {task: len(dependencies) for task, dependencies in self.dependencies.items()}
+        dependents = self.dependents()
+        ready = sorted(task for task, count in remaining.items() if count == 0)
+        order = []
+        while ready:
+            task = ready.pop(0)
+            order.append(task)
+            for dependent in dependents[task]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    ready.append(dependent)
+        if len(order) != len(self.dependencies):
+            cycle = sorted({service for service, _ in self.dependencies if (service, self.stages[0]) not in order})
+            raise UntropyConfigurationError(f"Circular dependency between services: {', '.join(cycle)}")
+        return order
+
+    def dependents(self) -> Dict[Task, List[Task]]:
+        result: Dict[Task, List[Task]] = {task: [] for task in self.dependencies}
+        for task, dependencies in sorted(self.dependencies.items()):
+            for dependency in dependencies:
+                result[dependency].append(task)
+        return result
+
+    def echo(self, task: Task, line: str):
+        prefix = click.style(f"[{task[0]}:{task[1]}] ", fg="cyan", bold=True)
+        if self.progress is not None:
+            self.progress.echo(prefix + line, nl=False)
+            return
+        with self.lock:
+            click.echo(prefix + line, nl=False)
+
+    def run_task(self, task: Task) -> StageResult:
+        """Run task, a failed result if it raises (stage cache, file system, ...) so only its dependents are skipped."""
+        start = time.perf_counter()
+        try:
+            return self._run_task(task, start)
+        except Exception as error:
+            logger.debug(f"Stage {task[0]}:{task[1]} raised", exc_info=True)
+            self.echo(task, f"{type(error).__name__}: {error}\n")
+            return StageResult(task[0], task[1], "failed", time.perf_counter() - start, 1)
+
+    def _run_task(self, task: Task, start: float) -> StageResult:
+        service, stage = task
+        service_settings = self.settings.services[service]
+        command = service_settings.stage_command(stage)
+        if command is None:
+            return StageResult(service, stage, "empty", 0.0)
+
+        environment = dict(os.environ)
+        environment.update(self.settings.shell_environment)
+        environment["UNTROPY_SERVICE"] = service
+        environment["UNTROPY_STAGE"] = stage
+        cwd = self.settings.home / service_settings.path
+
+        cache_settings = service_settings.cache.get(stage)
+        key = None
+        if self.cache is not None and cache_settings is not None:
+            key = self.cache.key(command, cwd, cache_settings, environment)
+            log = self.cache.restore(key, cwd, cache_settings)
+            metrics.increment("untropy_cache_requests_total", cache="stages", result="miss" if log is None else "hit")
+            if log is not None:
+                logger.debug(f"Stage cache hit for {service}:{stage}: {key}")
+                for line in log.splitlines(keepends=True):
+                    self.echo(task, line)
+                return StageResult(service, stage, "cached", time.perf_counter() - start)
+
+        output: List[str] = []
+        returncode = self.execute(task, command, cwd, environment, output)
+        duration = time.perf_counter() - start
+        if self.cache is not None and cache_settings is not None and key is not None and returncode == 0:
+            self.cache.save(key, cwd, cache_settings, "".join(output), duration)
+        return StageResult(service, stage, "success" if returncode == 0 else "failed", duration, returncode)
+
+    def execute(
+        self,
+        task: Task,
+        command: str,
+        cwd: "os.PathLike[str]",
+        environment: Dict[str, str],
+        output: Optional[List[str]] = None,
+    ) -> int:
+        """Run the shell command of task, prefixing its redacted output lines and appending them to output."""
+        if self.progress is not None:
+            self.progress.update(":".join(task), "starting")
+        try:
+            with trace.span("subprocess", command=command, service=task[0], stage=task[1]):
+                return self._execute(task, command, cwd, environment, output)
+        finally:
+            if self.progress is not None:
+                self.progress.finish(":".join(task))
+
+    def _execute(
+        self,
+        task: Task,
+        command: str,
+        cwd: "os.PathLike[str]",
+        environment: Dict[str, str],
+        output: Optional[List[str]],
+    ) -> int:
+        try:
+            process = subprocess.Popen(
+                command,
+                shell=True,
+                cwd=cwd,
+                env=environment,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+            )
+        except OSError as error:
+            self.echo(task, f"{error}\n")
+            return 127
+        with process:
+            assert process.stdout is not None
+            for raw in redacted_lines(self.settings.redactor, process.stdout):
+                line = raw.decode(errors="replace")
+                self.echo(task, line)
+                if self.progress is not None:
+                    self.progress.update(":".join(task), line.strip())
+                if output is not None:
+                    output.append(line)
+        return process.returncode
+
+    def run(
+        self,
+        on_result: Optional[Callable[[StageResult], None]] = None,
+        progress: Optional[Progress] = None,
+    ) -> List[StageResult]:
+        """Run all the tasks and return their results in dependency order.
+
+        Args:
+            on_result: Called with the result of each task when it completes.
+            progress: Displays the running tasks and their last output line.
+        """
+        self.progress = progress
+        results: Dict[Task, StageResult] = {}
+        remaining = {task: len(dependencies) for task, dependencies in self.dependencies.items()}
+        dependents = self.dependents()
+        blocked: Set[Task] = set()
+        stopped = False
+
+        def completed(result: StageResult):
+            task = (result.service, result.stage)
+            results[task] = result
+            if on_result is not None:
+                on_result(result)
+            for dependent in dependents[task]:
+                if result.status in ("failed", "skipped"):
+                    blocked.add(dependent)
+                remaining[dependent] -= 1
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            running: Dict["Future[StageResult]", Task] = {}
+            while True:
+                for task in self.order:
+                    if task in results or task in running.values() or remaining[task] > 0:
+                        continue
+                    if stopped or task in blocked:
+                        completed(StageResult(task[0], task[1], "skipped", 0.0))
+                    else:
+                        running[executor.submit(self.run_task, task)] = task
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+                    result = future.result()
+                    completed(result)
+                    if result.status == "failed" and self.fail_fast:
+                        stopped = True
+
+        return [results[task] for task in self.order]
@@ -0,0 +1,230 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Cache of the results of CI stages.
+
+The key of a stage hashes its command, the content of its input files, the
+environment variables and the tool versions it declares. Input files are
+hashed by a pool of threads and their digests are remembered with their
+stamps, so unchanged files are not read again. An entry holds the outputs
+and the log of the stage and is stored by a backend.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Set
+
+from ..config.model import StageCacheSettings, UntropySettings
+from ..utils.files import atomic_write_text, file_stamp
+
+logger = logging.getLogger("untropy")
+
+CACHE_FORMAT = 1
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class StageCacheBackend(ABC):
+    """Storage of the stage cache entries.
+
+    An entry is a directory with a `metadata.json` file, the `log` of the
+    stage and its `outputs` tree.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Path]:
+        """Return the directory of the entry key, None on a miss."""
+
+    @abstractmethod
+    def put(self, key: str, directory: Path):
+        """Store the directory as the entry key."""
+
+
+class LocalDirectoryBackend(StageCacheBackend):
+    """Entries stored under a directory, which can be on a volume shared by several runners.
+
+    Entries are written in a temporary directory and renamed, so a reader never
+    sees a partial entry and concurrent writers of the same key keep the first one.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def entry_path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def get(self, key: str) -> Optional[Path]:
+        entry = self.entry_path(key)
+        return entry if (entry / "metadata.json").exists() else None
+
+    def put(self, key: str, directory: Path):
+        entry = self.entry_path(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        temporary = entry.parent / f".{key}.{uuid.uuid4().hex}"
+        shutil.copytree(directory, temporary, symlinks=True)
+        try:
+            os.rename(temporary, entry)
+        except OSError:  # already stored by another runner
+            shutil.rmtree(temporary, ignore_errors=True)
+
+
+class FileHasher:
+    """Hash files, reusing the digests of the files whose stamp didn't change.
+
+    Args:
+        path: File storing the digests between runs.
+        jobs: Number of threads hashing files.
+    """
+
+    def __init__(self, path: Path, jobs: int = 8):
+        self.path = path
+        self.jobs = jobs
+        try:
+            self.digests: Dict[str, List[Any]] = json.loads(path.read_text())
+        except (OSError, ValueError):
+            self.digests = {}
+        self.changed = False
+        self.lock = threading.Lock()
+
+    def hash(self, path: Path) -> str:
+        stamp = file_stamp(path)
+        known = self.digests.get(str(path))
+        if stamp is not None and known is not None and tuple(known[:2]) == stamp:
+            return known[2]
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        if stamp is not None:
+            with self.lock:
+                self.digests[str(path)] = [*stamp, digest]
+                self.changed = True
+        return digest
+
+    def hash_files(self, paths: List[Path]) -> List[str]:
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return list(executor.map(self.hash, paths))
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            content = json.dumps(self.digests, separators=(",", ":"))
+            self.changed = False
+        try:
+            atomic_write_text(self.path, content)
+        except OSError as error:
+            logger.debug(f"Unable to save the file digests: {error}")
+
+
+def input_files(directory: Path, patterns: List[str]) -> List[Path]:
+    files: Set[Path] = set()
+    for pattern in patterns:
+        files.update(path for path in directory.glob(pattern) if path.is_file())
+    return sorted(files)
+
+
+def tool_version(command: str, cwd: Path, environment: Mapping[str, str]) -> str:
+    process = subprocess.run(
+        command, shell=True, cwd=cwd, env=dict(environment), capture_output=True, text=True, stdin=subprocess.DEVNULL
+    )
+    return f"{process.returncode}:{process.stdout.strip()}"
+
+
+class StageCache:
+    """Results of CI stages, looked up by the hash of their inputs.
+
+    Args:
+        backend: Storage of the entries.
+        hasher: Hasher of the input files.
+    """
+
+    def __init__(self, backend: StageCacheBackend, hasher: FileHasher):
+        self.backend = backend
+        self.hasher = hasher
+
+    def key(
+        self,
+        command: str,
+        directory: Path,
+        cache_settings: StageCacheSettings,
+        environment: Mapping[str, str],
+    ) -> str:
+        """Return the key of the stage running command in directory."""
+        sha256 = hashlib.sha256(f"{CACHE_FORMAT}\0{command}\0".encode())
+        for name in sorted(cache_settings.environment):
+            sha256.update(f"env:{name}={environment.get(name, '')}\0".encode())
+        for tool in cache_settings.tools:
+            sha256.update(f"tool:{tool}={tool_version(tool, directory, environment)}\0".encode())
+        files = input_files(directory, cache_settings.inputs)
+        for path, digest in zip(files, self.hasher.hash_files(files)):
+            sha256.update(f"file:{path.relative_to(directory).as_posix()}={digest}\0".encode())
+        self.hasher.save()
+        return sha256.hexdigest()
+
+    def restore(self, key: str, directory: Path, cache_settings: StageCacheSettings) -> Optional[str]:
+        """Restore the outputs of the entry key in directory and return its log, None on a miss."""
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        for output in cache_settings.outputs:
+            source = entry / "outputs" / output
+            if not source.exists():  # missing when the stage ran, the existing output is kept
+                continue
+            destination = directory / output
+            if destination.is_dir() and not destination.is_symlink():
+                shutil.rmtree(destination)
+            elif destination.exists() or destination.is_symlink():
+                destination.unlink()
+            if source.is_dir():
+                shutil.copytree(source, destination, symlinks=True)
+            else:
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(source, destination)
+        return (entry / "log").read_text(errors="replace")
+
+    def save(self, key: str, directory: Path, cache_settings: StageCacheSettings, log: str, duration: float):
+        """Store the outputs of the stage run in directory and its log as the entry key."""
+        with tempfile.TemporaryDirectory() as temporary:
+            entry = Path(temporary)
+            for output in cache_settings.outputs:
+                source = directory / output
+                destination = entry / "outputs" / output
+                if source.is_dir():
+                    shutil.copytree(source, destination, symlinks=True)
+                elif source.exists():
+                    destination.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.copy2(source, destination)
+                else:
+                    logger.warning(f"Output {output} of {directory} is missing, it won't be restored")
+            (entry / "log").write_text(log)
+            (entry / "metadata.json").write_text(json.dumps({"format": CACHE_FORMAT, "duration": duration}))
+            self.backend.put(key, entry)
+
+
+def stage_cache(settings: UntropySettings) -> StageCache:
+    """Return the stage cache of the project, stored in the stages directory of the settings."""
+    key = hashlib.sha1(str(settings.home.resolve()).encode()).hexdigest()
+    hasher = FileHasher(settings.workspace / "cache" / "digests" / f"{key}.json")
+    return StageCache(LocalDirectoryBackend(settings.stages_directory), hasher)
@@ -12,16 +12,65 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .alias import alias, home
+"""Command line interface.
+
+The command modules are imported on demand: the startup manifest records the
+module of each command, so a run only imports the module of its command.
+"""
+
+import importlib
+from typing import Any, Dict, List
+
+from ..utils import trace
 from .cli import cli
-from .cookie import cookie
-from .env import env
+
+COMMAND_MODULES: Dict[str, List[str]] = {
+    "alias": ["alias", "home"],
+    "cache": ["cache"],
+    "check": ["check"],
+    "ci": ["ci"],
+    "completion": ["completion"],
+    "cookie": ["cookie", "cookie_upgrade"],
+    "env": ["env"],
+    "exec": ["exec_command"],
+    "hook": ["hook"],
+    "projects": ["projects"],
+    "publish": ["publish"],
+}
+"Commands exported by each command module"
+
+
+def load_command_module(name: str):
+    """Import the command module name, registering its commands in cli, and export them."""
+    module = importlib.import_module(f"{__name__}.{name}")
+    for attribute in COMMAND_MODULES[name]:
+        globals()[attribute] = getattr(module, attribute)
+
+
+def __getattr__(name: str) -> Any:
+    for module, attributes in COMMAND_MODULES.items():
+        if name in attributes:
+            load_command_module(module)
+            return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+trace.record("import", trace.IMPORT_START)
 
 __all__ = [
     "alias",
+    "cache",
+    "check",
+    "ci",
     "cli",
+    "completion",
     "cookie",
+    "cookie_upgrade",
     "env",
+    "exec_command",
     "home",
+    "hook",
+    "projects",
+    "publish",
     "ssh",
 ]
@@ -0,0 +1,93 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pathlib import Path
+from typing import Optional
+from urllib.error import URLError
+
+import click
+
+from ..config.model import UntropySettings
+from ..utils.artifacts import ArtifactStore
+from ..utils.log import fail, log
+from .cli import cli, pass_untropy_settings
+
+
+def artifact_store(settings: UntropySettings) -> ArtifactStore:
+    return ArtifactStore(settings.artifacts_directory, settings.cache.max_size)
+
+
+def human_size(size: float) -> str:
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024:
+            break
+        size /= 1024
+    return f"{size:.1f}{unit}"
+
+
+@cli.group("cache", invoke_without_command=True)
+@pass_untropy_settings
+@click.pass_context
+def cache(context: click.Context, settings: UntropySettings):
+    """Manage the artifact cache shared by the wrapped tools.
+
+    Without command, displays the cache statistics.
+    """
+    if context.invoked_subcommand is None:
+        store = artifact_store(settings)
+        stats = store.stats()
+        click.echo(f"Directory: {store.root}")
+        click.echo(f"Artifacts: {stats.blobs}")
+        click.echo(f"Disk usage: {human_size(stats.size)} / {human_size(store.max_size)}")
+        click.echo(f"Hits: {stats.hits}, misses: {stats.misses}, hit rate: {stats.hit_rate:.1%}")
+        click.echo(f"Evictions: {stats.evictions}")
+
+
+@cache.command("fetch")
+@click.option("-o", "--output", type=click.Path(dir_okay=False, path_type=Path), help="Materialize the artifact here")
+@click.option("--sha256", type=str, help="Expected sha256 digest of the artifact")
+@click.option("--refresh", is_flag=True, help="Download the artifact even if its URL is cached")
+@click.argument("url")
+@pass_untropy_settings
+def fetch(settings: UntropySettings, output: Optional[Path], sha256: Optional[str], refresh: bool, url: str):
+    """Fetch URL through the cache.
+
+    Prints the path of the cached artifact, or materializes it with -o:
+
+    > untropy cache fetch -o .terraform/providers/provider.zip https://...
+    """
+    store = artifact_store(settings)
+    try:
+        digest = store.fetch(url, sha256, refresh, destination=output)
+    except (URLError, ValueError) as error:
+        fail(f"Unable to fetch {url}: {error}")
+    if output is None:
+        click.echo(store.blob_path(digest))
+
+
+@cache.command("gc")
+@click.option("--max-size", type=click.IntRange(min=0), help="Target size in bytes [default: cache maximum size]")
+@pass_untropy_settings
+def gc(settings: UntropySettings, max_size: Optional[int]):
+    """Evict the least recently used artifacts."""
+    store = artifact_store(settings)
+    store.collect(max_size)
+    log(f"Artifact cache size: {human_size(store.stats().size)}")
+
+
+@cache.command("clear")
+@pass_untropy_settings
+def clear(settings: UntropySettings):
+    """Remove all the artifacts."""
+    artifact_store(settings).collect(0)
@@ -0,0 +1,94 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+from pathlib import Path
+from typing import List, Literal, Optional
+
+import click
+
+from ..config.check import ProjectCheck, check_projects
+from ..config.index import CONFIGURATION_FILE_NAME, ProjectIndex
+from ..config.load import load_projects_settings
+from ..config.model import UntropySettings
+from ..utils.log import log
+from .cli import cli
+from .env import to_json
+
+
+def print_report(root: Path, results: List[ProjectCheck]):
+    for result in results:
+        name = os.path.relpath(result.path, root)
+        click.secho("✔ " if result.ok else "✘ ", fg="green" if result.ok else "red", bold=True, nl=False)
+        click.echo(f"{name} ", nl=False)
+        click.secho(f"({result.duration * 1000:.0f}ms)", dim=True)
+        for error in result.errors:
+            click.echo(f"    {error}")
+
+
+@cli.command("check")
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    help="Number of concurrent processes [default: number of CPUs]",
+)
+@click.option("--format", type=click.Choice(["text", "json"]), default="text", help="Output format", show_default=True)
+@click.argument("root", type=click.Path(exists=True, file_okay=False, path_type=Path), default=".")
+@click.pass_context
+def check(
+    context: click.Context,
+    jobs: Optional[int],
+    format: Literal["text", "json"],
+    root: Path,
+):
+    """Validate all the project configurations under ROOT.
+
+    Projects are found with the project index (see `untropy projects`).
+
+    Exits with an error if any configuration is invalid:
+
+    > untropy check -j 8 .
+
+    The configuration of the current directory may be invalid, only its
+    `[projects]` settings are used.
+    """
+    start = time.perf_counter()
+    settings = context.find_object(UntropySettings)
+    index = ProjectIndex(root, settings.projects if settings is not None else load_projects_settings(Path(".")))
+    root = index.root
+    results = check_projects([project.path / CONFIGURATION_FILE_NAME for project in index.update()], jobs)
+    failed = [result for result in results if not result.ok]
+    duration = time.perf_counter() - start
+
+    if format == "json":
+        click.echo(
+            to_json(
+                {
+                    "projects": [result._asdict() for result in results],
+                    "failed": len(failed),
+                    "duration": duration,
+                }
+            )
+        )
+    else:
+        print_report(root, results)
+        log(
+            f"{len(results)} project(s) checked, {len(failed)} failed in {duration:.2f}s",
+            error=bool(failed),
+        )
+
+    if failed:
+        context.exit(1)
@@ -0,0 +1,139 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from typing import List, Optional, Tuple, get_args
+
+import click
+
+from ..ci.affected import affected_services
+from ..ci.scheduler import StageResult, StageScheduler
+from ..ci.stage_cache import stage_cache
+from ..config.model import (
+    COMMAND_STAGES,
+    CICommand,
+    UntropyConfigurationError,
+    UntropySettings,
+)
+from ..utils.log import fail, log
+from ..utils.progress import Progress
+from .cli import cli, pass_untropy_settings
+
+STATUS_STYLES = {
+    "success": ("✔", "green"),
+    "failed": ("✘", "red"),
+    "skipped": ("-", "yellow"),
+    "empty": ("·", None),
+    "cached": ("↺", "blue"),
+}
+
+
+def format_result(result: StageResult) -> str:
+    symbol, color = STATUS_STYLES[result.status]
+    return (
+        click.style(f"{symbol} ", fg=color, bold=True)
+        + f"{result.service}:{result.stage} {result.status} "
+        + click.style(f"({result.duration:.2f}s)", dim=True)
+    )
+
+
+def print_timings(results: List[StageResult], duration: float):
+    click.echo()
+    width = max((len(f"{result.service}:{result.stage}") for result in results), default=0)
+    for result in results:
+        name = f"{result.service}:{result.stage}"
+        click.echo(f"{name:<{width}}  {result.status:<8} {result.duration:8.2f}s")
+    click.echo(f"{'total':<{width}}  {'':<8} {duration:8.2f}s")
+
+
+@cli.command("ci")
+@click.option("-s", "--service", "services", multiple=True, help="Service to run the stages of (repeat)")
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Maximum number of concurrent stages",
+)
+@click.option("--fail-fast/--no-fail-fast", default=True, show_default=True, help="Stop at the first failure")
+@click.option(
+    "--since",
+    type=str,
+    envvar="UNTROPY_CI_SINCE",
+    help="Only run the services affected by the changes since this git revision",
+)
+@click.option("--cache/--no-cache", default=True, show_default=True, help="Reuse the results of unchanged stages")
+@click.option("-n", "--dry-run", is_flag=True, help="Only display the stages in order")
+@click.argument("command", type=click.Choice(get_args(CICommand)), required=False)
+@pass_untropy_settings
+@click.pass_context
+def ci(
+    context: click.Context,
+    settings: UntropySettings,
+    services: Tuple[str, ...],
+    jobs: int,
+    fail_fast: bool,
+    since: Optional[str],
+    cache: bool,
+    dry_run: bool,
+    command: Optional[CICommand],
+):
+    """Run the CI stages of COMMAND on the project services.
+
+    COMMAND and the service default to the ones of the CI_COMMIT_TAG
+    (<command>/<service>/<env>). Without service, all the services run, or
+    with --since only the ones owning files changed since a git revision and
+    the services depending on them. Stages of a service wait for the same
+    stages of the services it depends on:
+
+    > untropy ci alldeploy -j 8 --since origin/main
+
+    Stages declaring their inputs in `[services.<name>.cache.<stage>]` are
+    skipped when their inputs didn't change, their outputs and log being
+    restored from the stage cache.
+    """
+    command = command or settings.ci_settings.command
+    stages = COMMAND_STAGES[command]
+    if not stages:
+        fail("A CI command needs to be specified")
+
+    try:
+        if services:
+            selected = list(services)
+        elif settings.ci_settings.service:
+            selected = [settings.ci_settings.service]
+        elif since is not None:
+            selected = sorted(affected_services(settings, since))
+            log(f"Services affected since {since}: {', '.join(selected) or 'none'}")
+        else:
+            selected = sorted(settings.services)
+        scheduler = StageScheduler(
+            settings, selected, stages, jobs, fail_fast, stage_cache(settings) if cache else None
+        )
+    except UntropyConfigurationError as e:
+        fail(f"Error: {e}")
+
+    if dry_run:
+        for service, stage in scheduler.order:
+            click.echo(f"{service}:{stage}")
+        return
+
+    log(f"Running {' → '.join(stages)} on {len(selected)} service(s)...")
+    start = time.perf_counter()
+    with Progress() as progress:
+        results = scheduler.run(lambda result: progress.echo(format_result(result)), progress)
+    print_timings(results, time.perf_counter() - start)
+    if any(result.status == "failed" for result in results):
+        context.exit(1)
@@ -14,20 +14,26 @@
 
 import logging
 import os
-import re
+import time
 import typing
-from importlib.metadata import version
 from logging.config import dictConfig
 from pathlib import Path
 
 import click
-import toml
 
 from ..config import UntropySettings, load_configuration, load_configuration_file
+from ..config.snapshot import SNAPSHOT_ENV, load_snapshot
+from ..utils import metrics, toml_backend, trace
+from ..utils.completion import record_completion
+from ..utils.cookies import cookie_names
 from ..utils.log import fail, log
 from ..utils.log_setup import setup_logging
+from ..utils.manifest import record_commands, startup_manifest
+from ..utils.redact import install_log_filter
 
+_logging_start = time.perf_counter_ns()
 setup_logging()
+trace.record("setup_logging", _logging_start)
 
 logger = logging.getLogger("untropy")
 
@@ -35,24 +41,134 @@ SILENT_HANDLERS = ["transitions.core", "urllib3.connectionpool", "openstack"]
 
 pass_untropy_settings = click.make_pass_decorator(UntropySettings)
 
+LENIENT_COMMANDS = {"check"}
+"Commands reading the configuration files by themselves, run even if the current one is invalid"
+
+
+def command_environment(settings: UntropySettings) -> typing.Dict[str, str]:
+    """Return the complete environment of a wrapped command."""
+    environment = dict(os.environ)
+    environment.update(settings.shell_environment)
+    return environment
+
 
 def force_environment(settings: UntropySettings):
     """Force environment variables from settings."""
     log("Forcing environment variables...")
-    for name, value in settings.shell_environment.items():
-        if logger.isEnabledFor(logging.DEBUG):
+    environment = settings.shell_environment
+    if logger.isEnabledFor(logging.DEBUG):
+        for name, value in environment.items():
             logger.debug(f"{name}={value}")
-        os.putenv(name, value)
-        os.environ[name] = str(value)
+    os.environ.update(environment)  # os.environ calls putenv itself
 
     if logger.isEnabledFor(logging.DEBUG):
         logger.debug(f"Force reloading inventory on {settings.env}")
 
 
-untropy_version = re.compile(r"\.dev\d+$").sub("", version("untropy"))
+def update_completion(context: click.Context, settings: UntropySettings):
+    """Record the commands, the cookies and the environments of the project for the completion scripts."""
+    try:
+        cookies_dir = startup_manifest().cookies_dir
+        cookies = cookie_names(cookies_dir) if cookies_dir.is_dir() else []
+        project = settings.home if (settings.home / settings.settings_filename).exists() else None
+        commands = context.command.list_commands(context)  # type: ignore
+        record_completion(commands, cookies, project, settings.environment_names)
+    except OSError as error:
+        logger.debug(f"Unable to update the completion cache: {error}")
+
+
+untropy_version = startup_manifest().version
+
+
+class TracedCommand(click.Command):
+    """Command recording a span of its invocation."""
+
+    def invoke(self, ctx: click.Context) -> typing.Any:
+        with trace.span(ctx.command_path):
+            return super().invoke(ctx)
+
+
+def record_command(ctx: click.Context, status: int, duration: float):
+    """Record the metrics of the command invoked by the root context ctx."""
+    command = ctx.invoked_subcommand or ctx.info_name or "untropy"
+    env = ctx.obj.env if isinstance(ctx.obj, UntropySettings) else ""
+    metrics.increment("untropy_commands_total", command=command, env=env, status=str(status))
+    metrics.observe("untropy_command_duration_seconds", duration, command=command, env=env)
+
+
+class UntropyGroup(click.Group):
+    """Group recording spans of its invocation and of its commands, and the command metrics."""
+
+    command_class = TracedCommand
+    group_class = type
+
+    def invoke(self, ctx: click.Context) -> typing.Any:
+        if ctx.parent is not None or not metrics.enabled():
+            with trace.span(ctx.command_path):
+                return super().invoke(ctx)
 
+        start = time.perf_counter()
+        status = 1
+        try:
+            with trace.span(ctx.command_path):
+                result = super().invoke(ctx)
+            status = 0
+            return result
+        except click.exceptions.Exit as exit:
+            status = exit.exit_code
+            raise
+        except click.ClickException as error:
+            status = error.exit_code
+            raise
+        except SystemExit as exit:
+            status = exit.code if isinstance(exit.code, int) else 1
+            raise
+        finally:
+            record_command(ctx, status, time.perf_counter() - start)
 
-@click.group("untropy")
+
+class LazyGroup(UntropyGroup):
+    """Root group importing the module of a command when it is used, from the command table of the manifest."""
+
+    group_class = UntropyGroup  # type: ignore  # the subgroups load their commands eagerly
+
+    def command_table(self) -> typing.Dict[str, str]:
+        commands = startup_manifest().commands
+        if not commands:
+            commands = self.load_commands()
+        return commands
+
+    def load_commands(self) -> typing.Dict[str, str]:
+        """Import all the command modules and record the module of each command in the manifest."""
+        from . import COMMAND_MODULES, load_command_module
+
+        for module in COMMAND_MODULES:
+            load_command_module(module)
+        commands = {name: command.callback.__module__.rpartition(".")[2] for name, command in self.commands.items()}
+        record_commands(commands)
+        return commands
+
+    def list_commands(self, ctx: click.Context) -> typing.List[str]:
+        return sorted(set(self.commands) | set(self.command_table()))
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> typing.Optional[click.Command]:
+        if cmd_name not in self.commands:
+            module = self.command_table().get(cmd_name)
+            if module is not None:
+                from . import load_command_module
+
+                load_command_module(module)
+            else:  # unknown or not in the command table yet
+                self.load_commands()
+        return super().get_command(ctx, cmd_name)
+
+
+def enable_trace(context: click.Context, parameter: click.Parameter, value: typing.Optional[Path]):
+    if value is not None:
+        trace.enable(value)
+
+
+@click.group("untropy", cls=LazyGroup)
 @click.version_option(untropy_version)
 @click.option("-v", "--verbose", count=True, help="Increase verbosity (repeat)")
 @click.option(
@@ -68,6 +184,21 @@ untropy_version = re.compile(r"\.dev\d+$").sub("", version("untropy"))
     help="Project configuration file",
 )
 @click.option("-f", "--force-env", is_flag=True, help="Force the environment variables")
+@click.option(
+    "--config-snapshot",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    envvar=SNAPSHOT_ENV,
+    help="Use the settings frozen by `untropy env --freeze`, without reading the configuration files",
+)
+@click.option(
+    "--trace",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    envvar="UNTROPY_TRACE",
+    is_eager=True,
+    expose_value=False,
+    callback=enable_trace,
+    help="Write a Chrome trace of the command to this file (Perfetto, chrome://tracing)",
+)
 @click.pass_context
 def cli(
     context: click.Context,
@@ -75,6 +206,7 @@ def cli(
     log_config: typing.Optional[typing.IO[typing.Text]],
     config: typing.Optional[typing.IO[typing.Text]],
     force_env: bool,
+    config_snapshot: typing.Optional[Path],
 ):
     """Untropy - One development tool to rule them all."""
     if verbose > 0:
@@ -94,7 +226,7 @@ def cli(
             handler.setLevel(max(handler.level - (verbose * 10), logging.DEBUG))
 
     if log_config:
-        log_additional_config = toml.load(log_config)
+        log_additional_config = toml_backend.load(log_config)
         if "incremental" not in log_additional_config:  # Specify false to replace whole configuration
             log_additional_config["incremental"] = True
         log_additional_config["version"] = 1
@@ -106,14 +238,22 @@ def cli(
         current_logger.propagate = False
 
     try:
-        if config is not None:
-            settings = load_configuration_file(config, Path(config.name).resolve())
-        else:
-            settings = load_configuration()
+        with trace.span("load_configuration"):
+            if config_snapshot is not None:
+                settings = load_snapshot(config_snapshot)
+            elif config is not None:
+                settings = load_configuration_file(config, Path(config.name).resolve())
+            else:
+                settings = load_configuration()
     except Exception as e:
-        fail(str(e))
+        if context.invoked_subcommand not in LENIENT_COMMANDS:
+            fail(str(e))
+        logger.debug(f"Invalid configuration ignored by {context.invoked_subcommand}: {e}")
+        return
 
     if force_env:
         force_environment(settings)
 
+    install_log_filter(lambda: settings.redactor)
+    update_completion(context, settings)
     context.obj = settings
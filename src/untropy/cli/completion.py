@@ -0,0 +1,39 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import click
+from click.shell_completion import get_completion_class
+
+from ..utils.completion import cached_completion_script
+from .cli import cli
+
+
+@cli.command("completion")
+@click.argument("shell", type=click.Choice(["bash", "zsh", "fish"]))
+def completion(shell: str):
+    """Print the completion script of SHELL.
+
+    Subcommands, cookies and environments are completed from a cache updated
+    by each untropy invocation. Enable completion with:
+
+    > eval "$(untropy completion bash)"  # in ~/.bashrc
+
+    > eval "$(untropy completion zsh)"  # in ~/.zshrc
+
+    > untropy completion fish | source  # in ~/.config/fish/config.fish
+    """
+    completion_class = get_completion_class(shell)
+    assert completion_class is not None
+    click.echo(completion_class(cli, {}, "untropy", "_UNTROPY_COMPLETE").source())
+    click.echo(cached_completion_script(shell))
@@ -12,38 +12,34 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import site
-import sys
+import os
 from pathlib import Path
+from typing import List, Tuple
 
 import click
-from cookiecutter.main import cookiecutter
 
 from ..config.model import UntropySettings
-from ..utils.log import fail
+from ..utils import cookies
+from ..utils.cookie_upgrade import (
+    REPORT_NAME,
+    UpgradeResult,
+    find_projects,
+    upgrade_projects,
+)
+from ..utils.log import fail, log
+from ..utils.manifest import startup_manifest
+from .cache import artifact_store
 from .cli import cli, pass_untropy_settings
 
-COOKIES_DIR_NAME = "cookies"
+LOCAL_COOKIES_DIR = startup_manifest().cookies_dir
 
-COOKIES_DIR_PATH_ELEMENTS = (
-    "share",
-    "untropy",
-    "cookies",
-)
 
-COOKIES_DIR_POSSIBLE_PATHS = (
-    Path(__file__).parents[3].joinpath(COOKIES_DIR_NAME),  # development
-    Path(sys.prefix).joinpath(*COOKIES_DIR_PATH_ELEMENTS),  # standard (venv or base)
-    Path(site.getuserbase()).joinpath(*COOKIES_DIR_PATH_ELEMENTS),  # user installation (pip --user)
-)
+def cookie_names():
+    return cookies.cookie_names(LOCAL_COOKIES_DIR)
 
-LOCAL_COOKIES_DIR = next((path for path in COOKIES_DIR_POSSIBLE_PATHS if path.exists()), COOKIES_DIR_POSSIBLE_PATHS[1])
 
-
-def cookie_names():
-    return sorted(
-        set([str(item.name) for item in LOCAL_COOKIES_DIR.iterdir() if item.is_dir() and not item.name[0] in "_."])
-    )
+def complete_cookies(context: click.Context, parameter: click.Parameter, incomplete: str) -> List[str]:
+    return [name for name in cookie_names() if name.startswith(incomplete)]
 
 
 @cli.command("cookie")
@@ -57,7 +53,7 @@ def cookie_names():
 )
 @click.option("-r", "--replay", is_flag=True, help="Replay the last generation")
 @click.option("-o", "--overwrite", is_flag=True, help="Overwrite existing files")
-@click.argument("cookie", required=False, default="")
+@click.argument("cookie", required=False, default="", shell_complete=complete_cookies)
 @pass_untropy_settings
 def cookie(settings: UntropySettings, list: bool, output_dir: str, replay: bool, overwrite: bool, cookie: str):
     """Install specified COOKIE."""
@@ -67,11 +63,56 @@ def cookie(settings: UntropySettings, list: bool, output_dir: str, replay: bool,
         if not cookie:
             fail("A cookie needs to be specified")
 
-        cookiecutter(
-            str(LOCAL_COOKIES_DIR),
-            directory=cookie,
-            output_dir=output_dir,
-            extra_context=settings.cookiecutter if not replay else None,
-            replay=replay,
-            overwrite_if_exists=overwrite,
+        store = artifact_store(settings)
+        cookies.generate_cookie(
+            LOCAL_COOKIES_DIR, cookie, output_dir, settings.cookiecutter, replay, overwrite, store=store
         )
+
+
+UPGRADE_STYLES = {
+    "upgraded": ("✔", "green"),
+    "up-to-date": ("·", None),
+    "conflicts": ("⚠", "yellow"),
+    "failed": ("✘", "red"),
+}
+
+
+def print_upgrade(result: UpgradeResult):
+    symbol, color = UPGRADE_STYLES[result.status]
+    click.secho(f"{symbol} ", fg=color, bold=True, nl=False)
+    details = f"{len(result.changed)} file(s) changed" if result.status in ("upgraded", "conflicts") else ""
+    if result.conflicts:
+        details += f", conflicts in {', '.join(result.conflicts)} (see {REPORT_NAME})"
+    click.echo(f"{result.project} {result.status} {details or result.message}".rstrip())
+
+
+@cli.command("cookie-upgrade")
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+    show_default="number of CPUs",
+    help="Maximum number of projects upgraded concurrently",
+)
+@click.argument("paths", nargs=-1, type=click.Path(exists=True, file_okay=False, path_type=Path))
+@pass_untropy_settings
+@click.pass_context
+def cookie_upgrade(context: click.Context, settings: UntropySettings, jobs: int, paths: Tuple[Path, ...]):
+    """Upgrade the projects generated from cookies to their current template.
+
+    PATHS (the current directory by default) and their subdirectories are
+    searched for projects generated by `untropy cookie`. The changes of
+    their template since their generation are merged into them, the
+    conflicts being marked in the files and listed in a report:
+
+    > untropy cookie-upgrade -j 8 services/
+    """
+    projects = find_projects(paths or [Path(".")], settings.projects.prune)
+    if not projects:
+        fail("No generated project found")
+
+    log(f"Upgrading {len(projects)} project(s)...")
+    results = upgrade_projects(projects, LOCAL_COOKIES_DIR, artifact_store(settings), jobs, print_upgrade)
+    if any(result.status in ("conflicts", "failed") for result in results):
+        context.exit(1)
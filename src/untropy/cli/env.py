@@ -15,18 +15,20 @@
 import json
 import logging
 import re
-from pathlib import PosixPath, WindowsPath
-from typing import Any, Literal, Mapping, Optional, Union
+from pathlib import Path, PosixPath, WindowsPath
+from typing import Any, List, Literal, Mapping, Optional, Tuple, Union
 
 import click
 import yaml
 from pydantic.json import pydantic_encoder
 
+from ..config import load_configuration
 from ..config.model import (
     SHELL_ENVIRONMENT_NAMES,
     UntropyConfigurationError,
     UntropySettings,
 )
+from ..config.snapshot import write_snapshot
 from ..utils.log import fail, log
 from .cli import cli, pass_untropy_settings
 
@@ -55,6 +57,15 @@ yaml.Dumper.add_representer(PosixPath, represent_posixpath)
 yaml.Dumper.add_representer(WindowsPath, represent_posixpath)
 
 
+def complete_environments(context: click.Context, parameter: click.Parameter, incomplete: str) -> List[str]:
+    """Complete environment names when the completion cache has none (the group callback isn't run)."""
+    try:
+        names = load_configuration().environment_names
+    except Exception:
+        return []
+    return [name for name in names if name.startswith(incomplete)]
+
+
 def print_names(settings: UntropySettings):
     for env in settings.environment_names:
         if env == settings.env:
@@ -80,7 +91,10 @@ def save_environment(settings: UntropySettings):
     path.write_text(content)
 
 
-def set_environment(settings: UntropySettings, environment: Optional[str], save: bool = False) -> bool:
+def set_environment(
+    settings: UntropySettings, environment: Optional[str], save: bool = False
+) -> Optional[UntropySettings]:
+    """Return the settings of environment (the current one if None), or None if it doesn't exist."""
     names = settings.environment_names
 
     if (current_env := environment or settings.env) not in names:
@@ -89,14 +103,13 @@ def set_environment(settings: UntropySettings, environment: Optional[str], save:
             error=True,
         )
         print_names(settings)
-        return False
+        return None
 
-    if environment is not None:
-        settings.env = environment
-        if save:
-            save_environment(settings)
+    settings = settings.for_environment(current_env)
+    if environment is not None and save:
+        save_environment(settings)
 
-    return True
+    return settings
 
 
 def clear_env(settings: UntropySettings):
@@ -135,7 +148,19 @@ def eval_command(settings: UntropySettings, clear: bool) -> str:
 @click.option("-c", "--clear", is_flag=True, help="Clear environment")
 @click.option("--show", is_flag=True, help="Show environment")
 @click.option("--format", type=click.Choice(["yaml", "json"]), default="yaml", help="Output format", show_default=True)
-@click.argument("environment", type=str, required=False)
+@click.option(
+    "--freeze",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    help="Write a snapshot of the settings to this file, see --config-snapshot",
+)
+@click.option(
+    "--freeze-env",
+    "freeze_envs",
+    multiple=True,
+    shell_complete=complete_environments,
+    help="Other environment to add to the snapshot (repeat)",
+)
+@click.argument("environment", type=str, required=False, shell_complete=complete_environments)
 @pass_untropy_settings
 def env(
     settings: UntropySettings,
@@ -144,6 +169,8 @@ def env(
     clear: bool,
     show: bool,
     format: Literal["yaml", "json"],
+    freeze: Optional[Path],
+    freeze_envs: Tuple[str, ...],
     environment: Optional[str],
 ):
     """Set or retrieve the environment.
@@ -159,6 +186,13 @@ def env(
     Use -s to save it as the default. To unset environment variables, type:
 
     > eval $(untropy env -c)
+
+    To resolve the settings once in a CI pipeline and reuse them in the next
+    jobs, type:
+
+    > untropy env api_prod --freeze settings.snapshot --freeze-env api_test
+
+    > UNTROPY_SNAPSHOT=settings.snapshot untropy ci deploy
     """
     if list:
         print_names(settings)
@@ -170,14 +204,24 @@ def env(
 # {eval_command(settings, clear)}\
 """
         )
+    elif freeze is not None:
+        if (selected := set_environment(settings, environment)) is None:
+            return 1
+        try:
+            write_snapshot(freeze, selected, freeze_envs)
+        except UntropyConfigurationError as e:
+            fail(f"Error: {e}")
+        log(f"Settings of {', '.join(dict.fromkeys([selected.env, *freeze_envs]))} frozen in {freeze}")
     elif show:
-        if not set_environment(settings, environment):
+        if (selected := set_environment(settings, environment)) is None:
             return 1
+        settings = selected
         click.echo_via_pager(yaml.dump(settings.internal_vars) if format == "yaml" else to_json(settings.internal_vars))
     else:
         try:
-            if not set_environment(settings, environment, save):
+            if (selected := set_environment(settings, environment, save)) is None:
                 return 1
+            settings = selected
 
             set_env(settings)
             click.echo(
@@ -0,0 +1,194 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, BinaryIO, List, Optional, Sequence, Tuple
+
+import click
+
+from ..config.model import UntropySettings
+from ..utils import trace
+from ..utils.log import fail
+from ..utils.redact import redacted_lines
+from .cli import cli, command_environment, pass_untropy_settings
+from .env import complete_environments, set_environment
+
+logger = logging.getLogger("untropy")
+
+DEFAULT_JOBS = 4
+
+
+def environment_settings(settings: UntropySettings, environment: str) -> Optional[UntropySettings]:
+    """Return the settings of environment, or None if it doesn't exist."""
+    return set_environment(settings, environment)
+
+
+def run_in_environment(settings: UntropySettings, command: Sequence[str], lock: threading.Lock) -> int:
+    """Run command in the settings environment, prefixing its redacted output lines with the environment name."""
+    prefix = click.style(f"[{settings.env}] ", fg="cyan", bold=True)
+    with trace.span("subprocess", command=" ".join(command), env=settings.env):
+        return _run_in_environment(settings, command, lock, prefix)
+
+
+def _run_in_environment(settings: UntropySettings, command: Sequence[str], lock: threading.Lock, prefix: str) -> int:
+    try:
+        process = subprocess.Popen(
+            command,
+            env=command_environment(settings),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+    except FileNotFoundError:
+        with lock:
+            click.echo(f"{prefix}Command not found: {command[0]}", err=True)
+        return 127
+
+    with process:
+        assert process.stdout is not None
+        for raw in redacted_lines(settings.redactor, process.stdout):
+            with lock:
+                click.echo(prefix + raw.decode(errors="replace"), nl=False)
+    return process.returncode
+
+
+def run_redacted(settings: UntropySettings, command: Sequence[str]) -> int:
+    """Run command with its standard streams redacted, line by line, and return its exit code."""
+
+    def forward(source: IO[bytes], target: BinaryIO):
+        for line in redacted_lines(settings.redactor, source):
+            target.write(line)
+            target.flush()
+
+    try:
+        process = subprocess.Popen(
+            command, env=command_environment(settings), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+    except FileNotFoundError:
+        fail(f"Command not found: {command[0]}")
+    except PermissionError:
+        fail(f"Command not executable: {command[0]}")
+
+    with process, trace.span("subprocess", command=" ".join(command), env=settings.env):
+        assert process.stdout is not None and process.stderr is not None
+        errors = threading.Thread(target=forward, args=(process.stderr, click.get_binary_stream("stderr")), daemon=True)
+        errors.start()
+        forward(process.stdout, click.get_binary_stream("stdout"))
+        errors.join()
+    return process.returncode
+
+
+def run_each(settings: UntropySettings, environments: List[str], command: Sequence[str], jobs: int) -> int:
+    """Run command concurrently in each environment and return the first non zero exit code."""
+    targets = [environment_settings(settings, environment) for environment in environments]
+    if any(target is None for target in targets):
+        return 1
+
+    lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(targets)))) as executor:
+        codes: List[Tuple[str, int]] = list(
+            zip(
+                environments,
+                executor.map(lambda target: run_in_environment(target, command, lock), targets),
+            )
+        )
+
+    for environment, code in codes:
+        if code != 0:
+            logger.debug(f"Command failed with code {code} on {environment}")
+    return next((code for _, code in codes if code != 0), 0)
+
+
+@cli.command("exec", context_settings={"ignore_unknown_options": True, "allow_interspersed_args": False})
+@click.option(
+    "-e",
+    "--env",
+    "environment",
+    type=str,
+    shell_complete=complete_environments,
+    help="Environment to run the command into",
+)
+@click.option("--each", type=str, help="Comma separated environments to run the command into concurrently")
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=DEFAULT_JOBS,
+    show_default=True,
+    help="Maximum number of concurrent commands with --each",
+)
+@click.option(
+    "--redact",
+    is_flag=True,
+    help="Run the command as a child process whose output is redacted (always the case with --each)",
+)
+@click.argument("command", nargs=-1, required=True, type=click.UNPROCESSED)
+@pass_untropy_settings
+@click.pass_context
+def exec_command(
+    context: click.Context,
+    settings: UntropySettings,
+    environment: Optional[str],
+    each: Optional[str],
+    jobs: int,
+    redact: bool,
+    command: Tuple[str, ...],
+):
+    """Execute COMMAND with the environment variables set.
+
+    The environment is computed once and the command replaces the untropy
+    process:
+
+    > untropy exec -e myproject_dev -- terraform plan
+
+    With --redact, the command runs as a child process instead, its output
+    being redacted line by line. It is not a terminal and a prompt without a
+    newline only shows once answered, so keep it for non interactive
+    commands:
+
+    > untropy exec --redact -e myproject_dev -- terraform output
+
+    To run the command on several environments concurrently, type:
+
+    > untropy exec --each myproject_dev,myproject_test -- terraform plan
+    """
+    if each is not None:
+        if environment is not None:
+            fail("--env and --each are mutually exclusive")
+        environments = [name.strip() for name in each.split(",") if name.strip()]
+        context.exit(run_each(settings, environments, command, jobs))
+
+    if environment is not None:
+        if (selected := set_environment(settings, environment)) is None:
+            context.exit(1)
+        settings = selected
+
+    if redact:
+        context.exit(run_redacted(settings, command))
+
+    environment_variables = command_environment(settings)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    trace.flush()  # atexit handlers don't run once the process is replaced
+    try:
+        os.execvpe(command[0], list(command), environment_variables)
+    except FileNotFoundError:
+        fail(f"Command not found: {command[0]}")
+    except PermissionError:
+        fail(f"Command not executable: {command[0]}")
@@ -0,0 +1,262 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Shell hook switching the environment when entering or leaving a project.
+
+On each directory change, the hook walks up to the enclosing `untropy.toml`
+with shell builtins and sources the cached variables of the project. A cache
+file first compares its modification time with the configuration files it
+was generated from and fails unless it is strictly newer, so Python only runs
+(`untropy hook --refresh DIR`) when the cache is missing or stale. Secrets and
+values of providers without TTL are never cached: the cache resolves them on
+each use (`untropy hook --export DIR`).
+"""
+
+import logging
+import os
+import shlex
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import click
+
+from ..config.load import load_project_configuration, merged_settings
+from ..config.model import SHELL_ENVIRONMENT_NAMES, UntropySettings
+from ..utils.files import atomic_write_text, cache_directory
+from .cli import cli, pass_untropy_settings
+
+logger = logging.getLogger("untropy")
+
+CONFIGURATION_FILE_NAME = "untropy.toml"
+
+SHELLS = ["bash", "zsh", "fish"]
+
+
+def hook_directory() -> Path:
+    path = os.getenv("UNTROPY_HOOK_CACHE")
+    return Path(path) if path else cache_directory() / "hook"
+
+
+def hook_cache(directory: Path, suffix: str) -> Path:
+    """Return the cache file of the project directory, named as the hook scripts do."""
+    return hook_directory() / (str(directory).replace("/", "%") + suffix)
+
+
+def fish_quote(value: str) -> str:
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def posix_exports(variables: Dict[str, str]) -> List[str]:
+    return [f"export {name}={shlex.quote(value)}" for name, value in variables.items()]
+
+
+def fish_exports(variables: Dict[str, str]) -> List[str]:
+    return [f"set -gx {name} {fish_quote(value)}" for name, value in variables.items()]
+
+
+def posix_cache(
+    cache: Path,
+    files: List[Path],
+    variables: Dict[str, str],
+    expires: Optional[int] = None,
+    resolved: Optional[Tuple[Path, List[str]]] = None,
+) -> str:
+    stale = " || ".join(f"! {shlex.quote(str(cache))} -nt {shlex.quote(str(file))}" for file in files)
+    if expires is not None:
+        stale += f" || ( $1 != fresh && $(date +%s) -ge {expires} )"
+    lines = [f"[[ {stale} ]] && return 1"]
+    lines += posix_exports(variables)
+    names = list(variables)
+    if resolved is not None:
+        directory, resolved_names = resolved
+        command = f"untropy hook --export {shlex.quote(str(directory))}"
+        lines.append(f"local _untropy_exports; _untropy_exports=$({command}) || return 1")
+        lines.append('eval "$_untropy_exports"')
+        names += resolved_names
+    lines.append(f"_UNTROPY_HOOK_NAMES=({' '.join(names)})")
+    return "\n".join(lines) + "\n"
+
+
+def fish_cache(
+    cache: Path,
+    files: List[Path],
+    variables: Dict[str, str],
+    expires: Optional[int] = None,
+    resolved: Optional[Tuple[Path, List[str]]] = None,
+) -> str:
+    lines = [f"not test {fish_quote(str(cache))} -nt {fish_quote(str(file))}; and return 1" for file in files]
+    if expires is not None:
+        lines.append(f"test \"$argv[1]\" != fresh; and test (date +%s) -ge {expires}; and return 1")
+    lines += fish_exports(variables)
+    names = list(variables)
+    if resolved is not None:
+        directory, resolved_names = resolved
+        lines.append(f"set -l _untropy_exports (untropy hook --export {fish_quote(str(directory))} fish); or return 1")
+        lines.append("printf '%s\\n' $_untropy_exports | source")
+        names += resolved_names
+    lines.append(f"set -g _untropy_hook_names {' '.join(names)}")
+    return "\n".join(lines) + "\n"
+
+
+def hook_cache_expiry(expires: Dict[str, Optional[float]]) -> Optional[int]:
+    """Return when the hook cache of variables provided with expires must be refreshed, None for never."""
+    return min((int(expiry) for expiry in expires.values() if expiry is not None), default=None)
+
+
+def project_environment(directory: Path) -> Tuple[Dict[str, str], Dict[str, Optional[float]], Set[str]]:
+    """Return the variables of the project in directory, their expiry and the names of the uncacheable ones.
+
+    The values of the providers without TTL and the secrets are not written
+    to the hook caches, the caches resolve them on demand.
+    """
+    for name in SHELL_ENVIRONMENT_NAMES | {"UNTROPY_PROJECT", "UNTROPY_TIER"}:
+        os.environ.pop(name, None)  # exported by the previous project
+    settings = load_project_configuration(directory / CONFIGURATION_FILE_NAME)
+    variables, expires = settings.resolved_shell_environment
+    secrets = set(settings.secrets)
+    uncached = {name for name, expiry in expires.items() if expiry is None}
+    uncached |= {name for name, value in variables.items() if value in secrets}
+    return variables, expires, uncached
+
+
+def refresh_hook_cache(directory: Path):
+    """Write the hook caches of the project in directory."""
+    variables, expires, uncached = project_environment(directory)
+    files = merged_settings(directory / CONFIGURATION_FILE_NAME).dependencies + [directory / ".untropy"]
+    cached = {name: value for name, value in variables.items() if name not in uncached}
+    expiry = hook_cache_expiry({name: expires[name] for name in expires if name not in uncached})
+    resolved = (directory, sorted(uncached)) if uncached else None
+    for suffix, render in [(".sh", posix_cache), (".fish", fish_cache)]:
+        cache = hook_cache(directory, suffix)
+        atomic_write_text(cache, render(cache, files, cached, expiry, resolved))
+
+
+def hook_exports(directory: Path, shell: str) -> str:
+    """Return the commands exporting the uncacheable variables of the project in directory."""
+    variables, _, uncached = project_environment(directory)
+    exports = {name: variables[name] for name in sorted(uncached)}
+    return "\n".join(fish_exports(exports) if shell == "fish" else posix_exports(exports))
+
+
+POSIX_HOOK = r"""
+_untropy_hook_dir=%(directory)s
+
+_untropy_hook_clear() {
+    unset %(names)s "${_UNTROPY_HOOK_NAMES[@]}" _UNTROPY_HOOK_NAMES
+}
+
+_untropy_hook() {
+    [[ $PWD == "$_UNTROPY_HOOK_PWD" ]] && return
+    _UNTROPY_HOOK_PWD=$PWD
+    local dir=$PWD
+    while [[ $dir != / && ! -f $dir/%(configuration)s ]]; do
+        dir=${dir%%/*}
+        dir=${dir:-/}
+    done
+    [[ -f $dir/%(configuration)s ]] || dir=""
+    [[ $dir == "$_UNTROPY_HOOK_HOME" ]] && return
+    [[ -n $_UNTROPY_HOOK_HOME ]] && _untropy_hook_clear
+    _UNTROPY_HOOK_HOME=$dir
+    [[ -z $dir ]] && return
+    local cache="$_untropy_hook_dir/${dir//\//%%}.sh"
+    if ! { [[ -f $cache ]] && source "$cache" cached; }; then
+        untropy hook --refresh "$dir" >/dev/null 2>&1 && source "$cache" fresh || _untropy_hook_clear
+    fi
+}
+"""
+
+HOOK_REGISTRATION = {
+    "bash": r"""
+[[ ";$PROMPT_COMMAND;" == *";_untropy_hook;"* ]] || PROMPT_COMMAND="_untropy_hook${PROMPT_COMMAND:+;$PROMPT_COMMAND}"
+_untropy_hook
+""",
+    "zsh": r"""
+autoload -Uz add-zsh-hook
+add-zsh-hook chpwd _untropy_hook
+_untropy_hook
+""",
+}
+
+FISH_HOOK = r"""
+set -g _untropy_hook_dir %(directory)s
+
+function _untropy_hook_clear
+    set -e %(names)s $_untropy_hook_names _untropy_hook_names
+end
+
+function _untropy_hook --on-variable PWD
+    set -l dir $PWD
+    while test "$dir" != /; and not test -f $dir/%(configuration)s
+        set dir (string replace -r '/[^/]*$' '' -- $dir)
+        test -z "$dir"; and set dir /
+    end
+    test -f $dir/%(configuration)s; or set dir ""
+    test "$dir" = "$_untropy_hook_home"; and return
+    test -n "$_untropy_hook_home"; and _untropy_hook_clear
+    set -g _untropy_hook_home $dir
+    test -z "$dir"; and return
+    set -l cache $_untropy_hook_dir/(string replace -a / %% -- $dir).fish
+    if not begin; test -f $cache; and source $cache cached; end
+        untropy hook --refresh $dir >/dev/null 2>&1; and source $cache fresh; or _untropy_hook_clear
+    end
+end
+
+_untropy_hook
+"""
+
+
+def hook_script(shell: str) -> str:
+    names = sorted(SHELL_ENVIRONMENT_NAMES | {"UNTROPY_PROJECT", "UNTROPY_TIER"})
+    if shell == "fish":
+        values = {"directory": fish_quote(str(hook_directory())), "names": " ".join(names)}
+        return FISH_HOOK % {**values, "configuration": CONFIGURATION_FILE_NAME}
+    values = {"directory": shlex.quote(str(hook_directory())), "names": " ".join(names)}
+    return POSIX_HOOK % {**values, "configuration": CONFIGURATION_FILE_NAME} + HOOK_REGISTRATION[shell]
+
+
+@cli.command("hook")
+@click.option(
+    "--refresh",
+    "directory",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    help="Refresh the cached variables of the project in this directory",
+)
+@click.option(
+    "--export",
+    "export_directory",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    help="Print the commands exporting the uncached variables of the project in this directory",
+)
+@click.argument("shell", type=click.Choice(SHELLS), required=False)
+@pass_untropy_settings
+def hook(settings: UntropySettings, directory: Optional[Path], export_directory: Optional[Path], shell: Optional[str]):
+    """Print the shell hook switching the environment on directory change.
+
+    Entering a project exports its variables, with the environment saved by
+    `untropy env -s`, and leaving it clears them. Enable the hook with:
+
+    > eval "$(untropy hook bash)"  # in ~/.bashrc
+
+    > eval "$(untropy hook zsh)"  # in ~/.zshrc
+
+    > untropy hook fish | source  # in ~/.config/fish/config.fish
+    """
+    if directory is not None:
+        refresh_hook_cache(directory)
+        return
+    if shell is None:
+        shell = "fish" if settings.is_fish_shell else "zsh" if settings.is_zsh_shell else "bash"
+    if export_directory is not None:
+        click.echo(hook_exports(export_directory, shell))
+        return
+    click.echo(hook_script(shell))
@@ -0,0 +1,75 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fnmatch
+import os
+from pathlib import Path
+from typing import Literal, Optional
+
+import click
+
+from ..config.index import DEFAULT_JOBS, ProjectIndex
+from ..config.model import UntropySettings
+from .cli import cli, pass_untropy_settings
+from .env import to_json
+
+
+@cli.command("projects")
+@click.option("-e", "--env", "environment", type=str, help="Only projects with an environment matching this pattern")
+@click.option("-n", "--name", type=str, help="Only projects whose path matches this pattern")
+@click.option("--rebuild", is_flag=True, help="Rebuild the index from scratch")
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=DEFAULT_JOBS,
+    show_default=True,
+    help="Number of scanning threads",
+)
+@click.option("--format", type=click.Choice(["text", "json"]), default="text", help="Output format", show_default=True)
+@click.argument("root", type=click.Path(exists=True, file_okay=False, path_type=Path), default=".")
+@pass_untropy_settings
+def projects(
+    settings: UntropySettings,
+    environment: Optional[str],
+    name: Optional[str],
+    rebuild: bool,
+    jobs: int,
+    format: Literal["text", "json"],
+    root: Path,
+):
+    """List the projects under ROOT.
+
+    The project index is updated incrementally. To list the projects having
+    a production environment, type:
+
+    > untropy projects -e '*_prod'
+    """
+    index = ProjectIndex(root, settings.projects, jobs=jobs)
+    selected = []
+    for project in index.update(rebuild):
+        relative = os.path.relpath(project.path, index.root)
+        if name is not None and not fnmatch.fnmatchcase(relative, name):
+            continue
+        if environment is not None and not fnmatch.filter(project.environments, environment):
+            continue
+        selected.append((relative, project))
+
+    if format == "json":
+        projects = [{"path": project.path, "environments": project.environments} for _, project in selected]
+        click.echo(to_json({"projects": projects}))
+    else:
+        for relative, project in selected:
+            click.secho(relative, bold=True, nl=False)
+            click.echo(f" {' '.join(project.environments)}")
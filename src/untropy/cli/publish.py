@@ -0,0 +1,99 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import click
+
+from ..ci.publish import Publisher, PublishResult, package_files
+from ..config.model import UntropySettings
+from ..utils.log import fail, log
+from ..utils.progress import Progress
+from .cli import cli, pass_untropy_settings
+
+STATUS_STYLES = {
+    "uploaded": ("✔", "green"),
+    "skipped": ("-", "yellow"),
+    "failed": ("✘", "red"),
+}
+
+
+def format_result(result: PublishResult) -> str:
+    symbol, color = STATUS_STYLES[result.status]
+    message = f" {result.message}" if result.message else ""
+    return (
+        click.style(f"{symbol} ", fg=color, bold=True)
+        + f"{result.path.name} {result.status}{message} "
+        + click.style(f"({result.size / 1024**2:.2f} MB, {result.duration:.2f}s)", dim=True)
+    )
+
+
+@cli.command("publish")
+@click.argument("files", nargs=-1, type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    help="Maximum number of concurrent uploads, `registry.jobs` by default",
+)
+@click.option("--repository-url", type=str, help="Upload endpoint, `registry.url` by default")
+@click.option(
+    "--index-url",
+    type=str,
+    help="Simple index of the registry, `registry.index_url` or next to the upload endpoint by default",
+)
+@pass_untropy_settings
+@click.pass_context
+def publish(
+    context: click.Context,
+    settings: UntropySettings,
+    files: Tuple[Path, ...],
+    jobs: Optional[int],
+    repository_url: Optional[str],
+    index_url: Optional[str],
+):
+    """Publish Python packages to the registry.
+
+    FILES default to the wheels and source distributions of `dist/`. They
+    are uploaded concurrently over a shared connection pool, the files
+    already published (same sha256) being skipped, so the command can be
+    used as the publish stage of services:
+
+    > untropy publish -j 8 dist/*.whl
+
+    The registry is configured in `[registry]` or with the twine variables
+    (TWINE_REPOSITORY_URL, TWINE_USERNAME and TWINE_PASSWORD).
+    """
+    paths = list(files) or package_files(Path("dist"))
+    if not paths:
+        fail("No package to publish")
+
+    overrides = {"url": repository_url, "index_url": index_url}
+    registry = settings.registry.copy(update={key: value for key, value in overrides.items() if value})
+    log(f"Publishing {len(paths)} file(s) to {registry.url}...")
+    start = time.perf_counter()
+    with Publisher(registry, jobs) as publisher, Progress() as progress:
+        results = publisher.publish(paths, progress, lambda result: progress.echo(format_result(result)))
+    duration = time.perf_counter() - start
+
+    uploaded = sum(result.size for result in results if result.status == "uploaded")
+    counts = {status: sum(1 for result in results if result.status == status) for status in STATUS_STYLES}
+    log(
+        f"{counts['uploaded']} uploaded, {counts['skipped']} skipped, {counts['failed']} failed"
+        f" - {uploaded / 1024**2:.2f} MB in {duration:.2f}s ({uploaded / 1024**2 / max(duration, 1e-6):.2f} MB/s)"
+    )
+    if counts["failed"]:
+        context.exit(1)
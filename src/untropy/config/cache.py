@@ -0,0 +1,73 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Persistent cache of merged configuration files.
+
+Each entry is stored in the workspace and records the stamps of all the files
+that contributed to the merged settings, and of the missing configuration
+files of the directories walked to find them. It is only used if none of them
+changed or was created.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from ..utils.files import atomic_write_text, file_stamp
+
+logger = logging.getLogger("untropy")
+
+CACHE_FORMAT = 2
+
+
+def default_workspace() -> Path:
+    """Return the workspace before the settings are loaded (same default as `UntropySettings.workspace`)."""
+    return Path(os.getenv("UNTROPY_WORKSPACE", "~/.untropy")).expanduser()
+
+
+def settings_cache_path(path: Path) -> Path:
+    key = hashlib.sha1(str(path).encode()).hexdigest()
+    return default_workspace() / "cache" / "settings" / f"{key}.json"
+
+
+def files_stamps(files: Sequence[Path]) -> List[List[Any]]:
+    return [[str(file), *(file_stamp(file) or ())] for file in files]
+
+
+def read_cached_settings(path: Path) -> Optional[Dict[str, Any]]:
+    """Return the cached merged settings of path, their files and probes if all of them are unchanged."""
+    try:
+        entry = json.loads(settings_cache_path(path).read_text())
+    except (OSError, ValueError):
+        return None
+    if entry.get("format") != CACHE_FORMAT:
+        return None
+    for key in ("files", "probes"):
+        if files_stamps([Path(stamp[0]) for stamp in entry[key]]) != entry[key]:
+            return None
+    return entry
+
+
+def write_cached_settings(path: Path, files: Sequence[Path], probes: Sequence[Path], settings: Dict[str, Any]):
+    try:
+        stamps = {"files": files_stamps(files), "probes": files_stamps(probes)}
+        content = json.dumps({"format": CACHE_FORMAT, **stamps, "settings": settings})
+    except (TypeError, ValueError):  # dates are not serializable
+        return
+    try:
+        atomic_write_text(settings_cache_path(path), content)
+    except OSError as error:
+        logger.debug(f"Unable to cache settings of {path}: {error}")
@@ -0,0 +1,69 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Sequence
+
+from pydantic import ValidationError
+
+from .load import load_project_configuration
+from .model import UntropyConfigurationError
+
+
+class ProjectCheck(NamedTuple):
+    path: str
+    "Path of the configuration file"
+    errors: List[str]
+    duration: float
+    "Duration of the check in seconds"
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+
+def validation_errors(error: ValidationError) -> List[str]:
+    return [f"{'.'.join(str(location) for location in item['loc'])}: {item['msg']}" for item in error.errors()]
+
+
+def check_project(path: str) -> ProjectCheck:
+    """Load and validate the configuration file path and the settings of each of its environments."""
+    start = time.perf_counter()
+    errors: List[str] = []
+    try:
+        settings = load_project_configuration(Path(path))
+        settings.untropy_env  # validates the deployment tier
+        for name in settings.environments:
+            try:
+                settings.environment_view(name).untropy_env
+            except (UntropyConfigurationError, ValueError) as error:
+                errors.append(f"environments.{name}: {error}")
+    except ValidationError as error:
+        errors = validation_errors(error)
+    except Exception as error:
+        errors = [str(error) or error.__class__.__name__]
+    return ProjectCheck(path, errors, time.perf_counter() - start)
+
+
+def check_projects(paths: Sequence[Path], jobs: Optional[int] = None) -> List[ProjectCheck]:
+    """Check the configuration files concurrently in jobs processes."""
+    names = [str(path) for path in paths]
+    jobs = min(jobs or os.cpu_count() or 1, len(names))
+    if jobs <= 1:
+        return [check_project(name) for name in names]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(check_project, names, chunksize=max(1, len(names) // (jobs * 4))))
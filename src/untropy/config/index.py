@@ -0,0 +1,241 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Index of the projects under a root directory.
+
+Directories are scanned with `os.scandir` by a pool of threads. The index
+stores, for each directory, its modification time and subdirectories: when a
+directory modification time didn't change, its content is taken from the
+index instead of being listed again. Directories matching the prune patterns
+or ignored by a `.gitignore` file are not scanned.
+"""
+
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from ..utils.files import Stamp, atomic_write_text, file_stamp
+from .cache import default_workspace, files_stamps
+from .load import configuration_environments, merged_settings
+from .model import ProjectsSettings
+
+logger = logging.getLogger("untropy")
+
+INDEX_FORMAT = 1
+
+CONFIGURATION_FILE_NAME = "untropy.toml"
+
+DEFAULT_JOBS = 8
+
+
+class IgnoreRule(NamedTuple):
+    base: str
+    "Directory of the .gitignore file, relative to the root"
+    pattern: str
+    anchored: bool
+    "The pattern applies to the path relative to base instead of the name"
+    negated: bool
+
+
+def parse_gitignore(lines: Sequence[str], base: str) -> List[IgnoreRule]:
+    """Parse the directory related rules of a .gitignore file."""
+    rules = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        negated = line.startswith("!")
+        pattern = line[1:] if negated else line
+        pattern = pattern.rstrip("/")
+        anchored = "/" in pattern
+        rules.append(IgnoreRule(base, pattern.lstrip("/"), anchored, negated))
+    return rules
+
+
+def is_ignored(rules: Sequence[IgnoreRule], relative: str, name: str) -> bool:
+    """Return whether the directory relative (relative to the root) is ignored by rules."""
+    ignored = False
+    for rule in rules:
+        if rule.base:
+            if not relative.startswith(rule.base + "/"):
+                continue
+            candidate = relative[len(rule.base) + 1 :]
+        else:
+            candidate = relative
+        if fnmatch.fnmatchcase(candidate if rule.anchored else name, rule.pattern):
+            ignored = not rule.negated
+    return ignored
+
+
+class DirectoryEntry(NamedTuple):
+    mtime: int
+    subdirectories: List[str]
+    has_configuration: bool
+    gitignore: Optional[List[str]]
+    "Lines of the .gitignore file"
+    gitignore_stamp: Optional[Stamp]
+
+
+Visit = Tuple[str, Optional[DirectoryEntry], List[IgnoreRule]]
+"Relative path, entry and ignore rules of a visited directory"
+
+
+class Project(NamedTuple):
+    path: Path
+    "Directory of the project"
+    environments: List[str]
+
+
+def index_path(root: Path) -> Path:
+    key = hashlib.sha1(str(root).encode()).hexdigest()
+    return default_workspace() / "index" / f"{key}.json"
+
+
+class ProjectIndex:
+    """Persistent index of the projects under root."""
+
+    def __init__(
+        self,
+        root: Path,
+        settings: Optional[ProjectsSettings] = None,
+        path: Optional[Path] = None,
+        jobs: int = DEFAULT_JOBS,
+    ):
+        self.root = root.resolve()
+        self.settings = settings or ProjectsSettings()
+        self.path = path or index_path(self.root)
+        self.jobs = jobs
+        self.directories: Dict[str, DirectoryEntry] = {}
+        self.projects: Dict[str, Dict[str, Any]] = {}
+
+    def load(self):
+        try:
+            content = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return
+        if content.get("format") != INDEX_FORMAT or content.get("root") != str(self.root):
+            return
+        self.directories = {
+            relative: DirectoryEntry(entry[0], entry[1], entry[2], entry[3], tuple(entry[4]) if entry[4] else None)
+            for relative, entry in content["directories"].items()
+        }
+        self.projects = content["projects"]
+
+    def save(self):
+        content = {
+            "format": INDEX_FORMAT,
+            "root": str(self.root),
+            "directories": self.directories,
+            "projects": self.projects,
+        }
+        try:
+            atomic_write_text(self.path, json.dumps(content, separators=(",", ":")))
+        except OSError as error:
+            logger.debug(f"Unable to save the project index: {error}")
+
+    def pruned(self, relative: str, name: str, rules: Sequence[IgnoreRule]) -> bool:
+        if any(fnmatch.fnmatchcase(name, pattern) for pattern in self.settings.prune):
+            return True
+        return self.settings.gitignore and is_ignored(rules, relative, name)
+
+    def scan(self, directory: Path, mtime: int) -> DirectoryEntry:
+        subdirectories = []
+        has_configuration = False
+        gitignore = None
+        gitignore_stamp = None
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.name)
+                    elif entry.name == CONFIGURATION_FILE_NAME:
+                        has_configuration = True
+                    elif entry.name == ".gitignore" and self.settings.gitignore:
+                        gitignore_path = Path(entry.path)
+                        gitignore_stamp = file_stamp(gitignore_path)
+                        gitignore = gitignore_path.read_text(errors="replace").splitlines()
+        except OSError as error:
+            logger.debug(f"Unable to scan {directory}: {error}")
+        return DirectoryEntry(mtime, sorted(subdirectories), has_configuration, gitignore, gitignore_stamp)
+
+    def visit(self, relative: str, rules: List[IgnoreRule], previous: Dict[str, DirectoryEntry]) -> Visit:
+        directory = self.root / relative
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return relative, None, rules
+
+        entry = previous.get(relative)
+        if (
+            entry is None
+            or entry.mtime != mtime
+            or (entry.gitignore_stamp is not None and file_stamp(directory / ".gitignore") != entry.gitignore_stamp)
+        ):
+            entry = self.scan(directory, mtime)
+
+        if entry.gitignore:
+            rules = rules + parse_gitignore(entry.gitignore, relative)
+        return relative, entry, rules
+
+    def traverse(self, previous: Dict[str, DirectoryEntry]) -> Dict[str, DirectoryEntry]:
+        directories: Dict[str, DirectoryEntry] = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            pending: Set["Future[Visit]"] = {executor.submit(self.visit, "", [], previous)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    relative, entry, rules = future.result()
+                    if entry is None:
+                        continue
+                    directories[relative] = entry
+                    for name in entry.subdirectories:
+                        child = f"{relative}/{name}" if relative else name
+                        if not self.pruned(child, name, rules):
+                            pending.add(executor.submit(self.visit, child, rules, previous))
+        return directories
+
+    def project(self, relative: str, previous: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        entry = previous.get(relative)
+        if entry is not None and files_stamps([Path(stamp[0]) for stamp in entry["stamps"]]) == entry["stamps"]:
+            return entry
+
+        path = self.root / relative / CONFIGURATION_FILE_NAME
+        try:
+            environments = configuration_environments(path)
+            files = merged_settings(path).dependencies
+        except Exception as error:
+            logger.debug(f"Unable to read {path}: {error}")
+            environments, files = [], [path]
+        return {"stamps": files_stamps(files), "environments": environments}
+
+    def update(self, rebuild: bool = False) -> List[Project]:
+        """Update the index and return the projects, sorted by path."""
+        if not rebuild:
+            self.load()
+        self.directories = self.traverse(self.directories)
+        previous = self.projects
+        self.projects = {
+            relative: self.project(relative, previous)
+            for relative, entry in sorted(self.directories.items())
+            if entry.has_configuration
+        }
+        self.save()
+        return [
+            Project(self.root / relative if relative else self.root, entry["environments"])
+            for relative, entry in self.projects.items()
+        ]
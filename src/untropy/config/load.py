@@ -15,17 +15,45 @@
 import logging
 import os
 from pathlib import Path
-from typing import IO, Any, MutableMapping, Optional
+from typing import (
+    IO,
+    Any,
+    Dict,
+    List,
+    MutableMapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import click
-import toml
 from dotenv import find_dotenv
 
-from .model import UntropySettings
+from ..utils import toml_backend, trace
+from .cache import files_stamps, read_cached_settings, write_cached_settings
+from .model import ProjectsSettings, UntropySettings, merge_settings
 
 logger = logging.getLogger("untropy")
 
 
+class MergedSettings(NamedTuple):
+    settings: Dict[str, Any]
+    "Merged settings, must not be modified"
+    files: List[Path]
+    "Contributing files, from the farthest ancestor"
+    probes: List[Path]
+    "Missing configuration files between the contributing files, creating one of them changes the merge"
+
+    @property
+    def dependencies(self) -> List[Path]:
+        """Files whose change, creation or removal invalidates the merged settings."""
+        return self.files + self.probes
+
+
+_merged_settings: Dict[Path, Tuple[MergedSettings, List[List[Any]]]] = {}
+
+
 def find_configuration_file(directory: Path, filename: str = "untropy.toml") -> Optional[Path]:
     directory = directory.resolve()
     path = directory / filename
@@ -39,8 +67,79 @@ def find_configuration_file(directory: Path, filename: str = "untropy.toml") ->
         return find_configuration_file(directory.parent, filename)
 
 
+def extended_configuration_file(path: Path, extends: Union[bool, str]) -> Optional[Path]:
+    """Return the file extended by the configuration file path.
+
+    `extends = true` extends the nearest `untropy.toml` in the parent
+    directories, `extends = "../untropy.toml"` extends the given file.
+    """
+    if extends is False:
+        return None
+    elif extends is True:
+        parent = find_configuration_file(path.parent.parent, path.name) if path.parent.parent != path.parent else None
+    else:
+        parent = (path.parent / extends).resolve()
+        if not parent.exists():
+            parent = None
+    if parent is None:
+        raise click.ClickException(f"{path} extends a configuration file ({extends}) that can't be found")
+    return parent
+
+
+def skipped_configuration_files(path: Path, parent: Path) -> List[Path]:
+    """Return the missing configuration files between path and the parent it extends with `extends = true`."""
+    skipped = []
+    directory = path.parent.parent
+    while directory != parent.parent and directory.parent != directory:
+        skipped.append(directory / path.name)
+        directory = directory.parent
+    return skipped
+
+
+def extend_settings(path: Path, settings: Dict[str, Any], chain: Tuple[Path, ...]) -> MergedSettings:
+    extends = settings.pop("extends", False)
+    parent = extended_configuration_file(path, extends)
+    if parent is None:
+        return MergedSettings(settings, [path], [])
+    if parent in chain:
+        raise click.ClickException(f"Configuration files extend each other: {' -> '.join(map(str, chain))}")
+    base = merged_settings(parent, chain)
+    probes = base.probes + (skipped_configuration_files(path, parent) if extends is True else [])
+    return MergedSettings(merge_settings(base.settings, settings), base.files + [path], probes)
+
+
+def merged_settings(path: Path, chain: Tuple[Path, ...] = ()) -> MergedSettings:
+    """Return the settings of the configuration file path merged over the ones it extends.
+
+    The results are memoized in process and, when several files are
+    merged, in the workspace. Both are invalidated when any contributing file
+    changes, or when a configuration file is created in a directory walked
+    to find a parent. The returned dictionary must not be modified.
+    """
+    path = path.resolve()
+    memoized = _merged_settings.get(path)
+    if memoized is not None and files_stamps(memoized[0].dependencies) == memoized[1]:
+        return memoized[0]
+
+    cached = read_cached_settings(path)
+    if cached is not None:
+        files, probes = ([Path(stamp[0]) for stamp in cached[key]] for key in ("files", "probes"))
+        result = MergedSettings(cached["settings"], files, probes)
+    else:
+        result = extend_settings(path, toml_backend.load(path), chain + (path,))
+        if len(result.files) > 1:
+            write_cached_settings(path, result.files, result.probes, result.settings)
+
+    _merged_settings[path] = (result, files_stamps(result.dependencies))
+    return result
+
+
 def load_settings(path: Path, file: Optional[IO[str]] = None) -> MutableMapping[str, Any]:
-    settings_dict = toml.load(file or path)
+    if file is not None:
+        merged = extend_settings(path, toml_backend.load(file), (path,))
+    else:
+        merged = merged_settings(path)
+    settings_dict = dict(merged.settings)
     settings_dict["home"] = str(path.parent)
     settings_dict["settings_filename"] = path.name
     return settings_dict
@@ -66,10 +165,48 @@ def load_configuration(directory: Optional[Path] = None) -> UntropySettings:
         settings_dict = load_settings(path) if path is not None else {}
     except PermissionError:
         raise click.ClickException(f"{path} rights ({oct(os.stat(path).st_mode)[-3:]}) are not enough")
-    settings = UntropySettings(find_dotenv(".untropy", usecwd=True), None, **settings_dict)  # type: ignore
+    return validated_settings(find_dotenv(".untropy", usecwd=True), settings_dict)
+
+
+def validated_settings(
+    env_file: Optional[Union[str, Path]], settings_dict: MutableMapping[str, Any]
+) -> UntropySettings:
+    """Validate settings_dict, with the overrides of the selected environment."""
+    with trace.span("validation"):
+        settings = UntropySettings(env_file, None, **settings_dict)
+    if settings.env in settings.environments:
+        settings = settings.environment_view(settings.env)
     return settings
 
 
+def configuration_environments(path: Path) -> List[str]:
+    """Return the environment names of the configuration file path without validating it."""
+    settings = merged_settings(path).settings
+    env = settings.get("env", UntropySettings.__fields__["env"].default)
+    return [env] + [name for name in settings.get("environments", {}) if name != env]
+
+
+def load_projects_settings(directory: Path) -> ProjectsSettings:
+    """Return the `[projects]` settings of the configuration of directory, the rest of it being ignored.
+
+    Falls back on the default settings if the configuration can't be read, so
+    the projects can be checked from a directory with an invalid configuration.
+    """
+    path = find_configuration_file(directory)
+    try:
+        return ProjectsSettings(**merged_settings(path).settings.get("projects", {})) if path else ProjectsSettings()
+    except Exception as error:
+        logger.warning(f"Default projects settings used, {path} can't be read: {error}")
+        return ProjectsSettings()
+
+
+def load_project_configuration(path: Path) -> UntropySettings:
+    """Load the configuration file path with the `.untropy` file of its directory."""
+    env_file = path.parent / ".untropy"
+    settings_dict = load_settings(path)
+    return validated_settings(env_file if env_file.exists() else None, settings_dict)
+
+
 def load_configuration_file(file: IO[str], path: Path) -> UntropySettings:
     settings_dict = load_settings(path, file)
-    return UntropySettings(find_dotenv(".untropy", usecwd=True), None, **settings_dict)  # type: ignore
+    return validated_settings(find_dotenv(".untropy", usecwd=True), settings_dict)
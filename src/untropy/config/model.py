@@ -13,23 +13,35 @@
 # limitations under the License.
 
 import os
+import time
 from pathlib import Path
 from typing import (
     Any,
+    Callable,
     Dict,
     Iterable,
     List,
     Literal,
     Mapping,
     Optional,
-    Type,
-    TypeVar,
-    cast,
     get_args,
 )
 
-from dotenv import find_dotenv
-from pydantic import BaseSettings, Field, validator
+from dotenv import dotenv_values, find_dotenv
+from pydantic import (
+    BaseModel,
+    BaseSettings,
+    Field,
+    PrivateAttr,
+    SecretStr,
+    ValidationError,
+    root_validator,
+    validator,
+)
+
+from ..utils import trace
+from ..utils.redact import Redactor, secret_values
+from .providers import ResolvedVariables, resolve_variables
 
 # Deployment tier (see https://en.wikipedia.org/wiki/Deployment_environment)
 DeploymentTier = Literal[
@@ -50,6 +62,17 @@ CICommand = Literal[
     "alldeploy",  # Package, publish and deploy
 ]
 
+CIStage = Literal["build", "package", "publish", "deploy"]
+
+COMMAND_STAGES: Dict[str, List[CIStage]] = {
+    "unknown": [],
+    "build": ["build"],
+    "package": ["package"],
+    "publish": ["publish"],
+    "deploy": ["deploy"],
+    "alldeploy": ["package", "publish", "deploy"],
+}
+
 SHELL_ENVIRONMENT_NAMES = {
     "OBJC_DISABLE_INITIALIZE_FORK_SAFETY",
     "UNTROPY_ENV",
@@ -70,7 +93,10 @@ class UntropyConfigurationError(Exception):
 
 class UntropyBaseSettings(BaseSettings):
     def __init__(self, *args, **kwargs):
-        super().__init__(find_dotenv(".untropy", usecwd=True), None, **kwargs)  # type: ignore
+        super().__init__(find_dotenv(".untropy", usecwd=True), None, **kwargs)
+
+    class Config:
+        allow_mutation = False
 
 
 class DomainSettings(UntropyBaseSettings):
@@ -98,13 +124,107 @@ class KeySettings(UntropyBaseSettings):
         env_prefix = "UNTROPY_KEY_"
 
 
-LT = TypeVar("LT")
+class ProjectsSettings(UntropyBaseSettings):
+    """Project index related configuration."""
+
+    prune: List[str] = [
+        ".*",
+        "node_modules",
+        "__pycache__",
+        "venv",
+        "build",
+        "dist",
+    ]
+    "Directory name patterns never scanned for projects, in addition to .gitignore ones"
+    gitignore: bool = True
+    "Honor .gitignore files"
+
+    class Config:
+        env_prefix = "UNTROPY_PROJECTS_"
 
 
-def check_literal(candidate: str, literal: Type[LT]) -> LT:
+class CacheSettings(UntropyBaseSettings):
+    """Artifact cache related configuration."""
+
+    directory: Optional[Path] = None
+    "Directory of the artifact store, `<workspace>/artifacts` by default"
+    max_size: int = 10 * 1024**3
+    "Size in bytes above which the least recently used artifacts are evicted"
+    stages: Optional[Path] = None
+    "Directory of the CI stage results, `<workspace>/stages` by default, may be shared between runners"
+
+    class Config:
+        env_prefix = "UNTROPY_CACHE_"
+
+
+class RegistrySettings(UntropyBaseSettings):
+    """Package registry related configuration, for `untropy publish`."""
+
+    url: str = Field("https://upload.pypi.org/legacy/", env=["UNTROPY_REGISTRY_URL", "TWINE_REPOSITORY_URL"])
+    "Upload endpoint of the registry (legacy upload API, like twine)"
+    index_url: Optional[str] = None
+    "Simple index of the registry, checked for the files already published, derived from url by default"
+    username: Optional[str] = Field(None, env=["UNTROPY_REGISTRY_USERNAME", "TWINE_USERNAME"])
+    password: Optional[SecretStr] = Field(None, env=["UNTROPY_REGISTRY_PASSWORD", "TWINE_PASSWORD"])
+    jobs: int = 4
+    "Number of concurrent uploads"
+    retries: int = 3
+    "Number of retries of the requests failing with a connection error or a 429/5xx status"
+
+    class Config:
+        env_prefix = "UNTROPY_REGISTRY_"
+
+    @property
+    def simple_index_url(self) -> str:
+        """Simple index of the registry, next to the upload endpoint when index_url is not set.
+
+        `https://upload.pypi.org/legacy/` gives `https://pypi.org/simple/`, and
+        `https://host/repository/legacy/` gives `https://host/repository/simple/`.
+        """
+        if self.index_url:
+            return self.index_url
+        url = self.url.rstrip("/")
+        if url.endswith("/legacy"):
+            url = url[: -len("/legacy")]
+        return url.replace("://upload.pypi.org", "://pypi.org", 1) + "/simple/"
+
+
+class ProviderSettings(UntropyBaseSettings):
+    """Variable providers related configuration (see `config.providers`)."""
+
+    ttl: Dict[str, float] = {"file": 0, "cmd": 300, "http": 300, "secret": 0}
+    "Seconds during which the values of each provider are reused (workspace cache, settings, shell hook), 0 to disable"
+    timeout: float = 10
+    "Timeout in seconds of the commands and HTTP requests"
+    jobs: int = 8
+    "Number of values fetched concurrently"
+
+    class Config:
+        env_prefix = "UNTROPY_PROVIDERS_"
+
+
+def check_literal(candidate: str, literal: Any) -> str:
     if candidate not in get_args(literal):
         raise ValueError((f"Bad value for: {candidate}. " f"Possible values: {', '.join(get_args(literal))}"))
-    return cast(LT, candidate)
+    return candidate
+
+
+def check_env_name(env: str) -> str:
+    if "_" not in env or len(env.split("_")) != 2:
+        raise ValueError(f"Environment name [{env}] is not in the form <platform>_<tier>, i.e. devops_dev.")
+    return env
+
+
+def merge_settings(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge override over base, tables are merged recursively and other values replaced."""
+    result = dict(base)
+    for key, value in override.items():
+        current = result.get(key)
+        if isinstance(value, dict) and isinstance(current, dict):
+            result[key] = merge_settings(current, value)
+        else:
+            result[key] = value
+    return result
 
 
 class UntropyEnvironment:
@@ -163,6 +283,48 @@ class UntropyCISettings(BaseSettings):
             extra_vars.append("build_image=yes")
         return extra_vars
 
+    class Config:
+        allow_mutation = False
+
+
+class StageCacheSettings(BaseModel):
+    """Inputs and outputs of a CI stage whose results can be reused."""
+
+    inputs: List[str] = []
+    "Glob patterns of the input files, relative to the service directory"
+    outputs: List[str] = []
+    "Files and directories produced by the stage, relative to the service directory"
+    environment: List[str] = []
+    "Names of the environment variables the stage depends on"
+    tools: List[str] = []
+    "Shell commands printing the versions of the tools used by the stage"
+
+    class Config:
+        extra = "forbid"
+        allow_mutation = False
+
+
+class ServiceSettings(BaseModel):
+    """Service of the project and the shell commands of its CI stages."""
+
+    path: str = "."
+    "Directory of the service, relative to the project home"
+    depends_on: List[str] = []
+    "Services whose stages run before the same stages of this one"
+    build: Optional[str] = None
+    package: Optional[str] = None
+    publish: Optional[str] = None
+    deploy: Optional[str] = None
+    cache: Dict[CIStage, StageCacheSettings] = {}
+    "Stages whose results are reused when their inputs didn't change"
+
+    class Config:
+        extra = "forbid"
+        allow_mutation = False
+
+    def stage_command(self, stage: CIStage) -> Optional[str]:
+        return getattr(self, stage)
+
 
 class UntropySettings(BaseSettings):
     home: Path = Path(".").absolute()
@@ -174,33 +336,126 @@ class UntropySettings(BaseSettings):
 
     domain: DomainSettings = Field(default_factory=DomainSettings)
     credentials: KeySettings = Field(default_factory=KeySettings)
+    projects: ProjectsSettings = Field(default_factory=ProjectsSettings)
     variables: Optional[Dict[str, str]]
     workspace: Path = Path("~/.untropy").expanduser()
+    cache: CacheSettings = Field(default_factory=CacheSettings)
+    registry: RegistrySettings = Field(default_factory=RegistrySettings)
+    providers: ProviderSettings = Field(default_factory=ProviderSettings)
     cookiecutter: Optional[Dict[str, str]]
+    services: Dict[str, ServiceSettings] = {}
     secrets_file: Optional[str] = None
-
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        if self.ci_commit_tag is not None:
-            components = self.ci_commit_tag.split("/")
-            self.ci_settings.command = check_literal(components[0], CICommand)  # type: ignore
-            self.ci_settings.service = components[1] if len(components) > 1 else None
-            self.ci_settings.env = components[2] if len(components) > 2 else None
-            if self.ci_settings.env:
-                self.env = self.ci_settings.env
+    environments: Dict[str, Dict[str, Any]] = {}
+    "Settings overridden in each environment, validated when the environment is selected"
+
+    _views: Dict[str, "UntropySettings"] = PrivateAttr(default_factory=dict)
+    "Settings of the other environments, shared by all the views"
+    _base: Optional["UntropySettings"] = PrivateAttr(None)
+    "Settings without environment overrides, the views are derived from"
+    _derived: Dict[str, Any] = PrivateAttr(default_factory=dict)
+    "Environment specific values computed on first use"
+    _frozen: Optional[Dict[str, str]] = PrivateAttr(None)
+    "Values of the variables frozen by a snapshot, used instead of resolving them again"
 
     @validator("env")
     def env_should_be_splittable(cls, v):
-        if "_" not in v or len(v.split("_")) != 2:
-            raise ValueError(f"Environment name [{v}] is not in the form <platform>_<tier>, i.e. devops_dev.")
-        return v
+        return check_env_name(v)
+
+    @root_validator(skip_on_failure=True)
+    def ci_commit_tag_settings(cls, values):
+        if values.get("ci_commit_tag") is None:
+            return values
+        components = values["ci_commit_tag"].split("/")
+        ci_settings = values["ci_settings"].copy(
+            update={
+                "command": check_literal(components[0], CICommand),
+                "service": components[1] if len(components) > 1 else None,
+                "env": components[2] if len(components) > 2 else None,
+            }
+        )
+        values["ci_settings"] = ci_settings
+        if ci_settings.env:
+            values["env"] = check_env_name(ci_settings.env)
+        return values
+
+    def for_environment(self, env: str) -> "UntropySettings":
+        """Return the settings of env.
+
+        The returned view shares the data of these settings without copying
+        nor validating it again. Views are cached and compute their
+        environment specific values lazily.
+
+        Raises UntropyConfigurationError if env isn't an environment of the project.
+        """
+        if env == self.env:
+            return self
+        view = self._views.get(env)
+        if view is None:
+            if env not in self.environment_names:
+                raise UntropyConfigurationError(
+                    f"Unknown environment {env}, possible environments: {', '.join(self.environment_names)}"
+                )
+            self._views.setdefault(self.env, self)
+            view = self._views.setdefault(env, (self._base or self).environment_view(env))
+        return view
+
+    def environment_view(self, env: str) -> "UntropySettings":
+        """Return the settings of env, these settings being the base ones, without caching it.
+
+        Without `[environments.<env>]` overrides, the view is a shallow copy.
+        Otherwise the overrides are merged over these settings and validated.
+
+        Raises UntropyConfigurationError if env or its overrides are invalid.
+        """
+        try:
+            check_env_name(env)
+        except ValueError as error:
+            raise UntropyConfigurationError(str(error)) from error
+        overrides = self.environments.get(env)
+        if overrides is None:
+            view = self.copy(update={"env": env})  # shallow, private attributes are shared
+            object.__setattr__(view, "_derived", {})
+        else:
+            with trace.span("validation", env=env):
+                base = self.dict(exclude={"environments", "ci_commit_tag"})
+                values = merge_settings(base, {key: value for key, value in overrides.items() if key != "environments"})
+                try:
+                    # explicit values take precedence over the environment variables, CI_COMMIT_TAG would change env
+                    view = type(self)(None, None, **{**values, "env": env, "ci_commit_tag": None})
+                except ValidationError as error:
+                    raise UntropyConfigurationError(f"Invalid settings of environment {env}: {error}") from error
+                view = view.copy(update={"ci_commit_tag": self.ci_commit_tag, "environments": self.environments})
+            object.__setattr__(view, "_views", self._views)
+        object.__setattr__(view, "_base", self)
+        return view
+
+    def _cached(self, name: str, compute: Callable[[], Any]) -> Any:
+        value = self._derived.get(name)
+        if value is None:
+            value = self._derived.setdefault(name, compute())
+        return value
 
     @property
     def untropy_env(self) -> UntropyEnvironment:
-        return UntropyEnvironment(self.env)
+        return self._cached("untropy_env", lambda: UntropyEnvironment(self.env))
 
     @property
     def shell_environment(self) -> Dict[str, str]:
+        return dict(self.resolved_shell_environment.values)
+
+    @property
+    def resolved_shell_environment(self) -> ResolvedVariables:
+        """Shell environment and the expiry of its provided values, resolved again once one of them expires.
+
+        The values of the providers without TTL are resolved once per settings.
+        """
+        resolved: ResolvedVariables = self._cached("shell_environment", self._shell_environment)
+        if resolved.refresh_time <= time.time():
+            resolved = self._derived["shell_environment"] = self._shell_environment()
+            self._derived.pop("redactor", None)  # masks the new values
+        return resolved
+
+    def _shell_environment(self) -> ResolvedVariables:
         result = {
             "OBJC_DISABLE_INITIALIZE_FORK_SAFETY": "YES",
             "UNTROPY_ENV": self.env,
@@ -210,11 +465,34 @@ class UntropySettings(BaseSettings):
             "UNTROPY_WORKSPACE": str(self.workspace),
             "DOCKER_IMAGE_TAG": self.env.split("_")[-1],
         }
-        if self.variables:
+        expires: Dict[str, Optional[float]] = {}
+        variables = self.variables or {}
+        if self._frozen is not None:
+            result.update(self._frozen)
+            variables = {name: value for name, value in variables.items() if name not in self._frozen}
+        if variables:
             # TODO: should template variables
-            result.update(self.variables)
+            try:
+                variables, expires = resolve_variables(variables, self)
+            except ValueError as error:
+                raise UntropyConfigurationError(str(error)) from error
+            result.update(variables)
+
+        return ResolvedVariables(result, expires)
 
-        return result
+    @property
+    def secrets(self) -> List[str]:
+        """Values of the secret looking variables and of the secrets file, masked in the outputs."""
+        values = secret_values(self.shell_environment)
+        if self.secrets_file and (path := self.home / self.secrets_file).is_file():
+            values += [value for value in dotenv_values(path).values() if value]
+        if self.registry.password is not None:
+            values.append(self.registry.password.get_secret_value())
+        return values
+
+    @property
+    def redactor(self) -> Redactor:
+        return self._cached("redactor", lambda: Redactor(self.secrets))
 
     @property
     def is_fish_shell(self) -> bool:
@@ -227,17 +505,25 @@ class UntropySettings(BaseSettings):
     @property
     def internal_vars(self) -> Mapping[str, Any]:
         # FIXME: better output
-        return self.dict(exclude_none=True)
+        return self.dict(exclude_none=True, exclude={"registry": {"password"}})
 
     @property
     def environment_names(self) -> List[str]:
-        # FIXME: Where do I get those ?
-        return [self.env]
+        """Current environment and the ones with overrides."""
+        return [self.env] + [name for name in self.environments if name != self.env]
 
     @property
     def ssh_private_key_file(self) -> Optional[str]:
         return str(Path(f"~/.ssh/{self.credentials.ssh}").expanduser()) if self.credentials.ssh else None
 
+    @property
+    def artifacts_directory(self) -> Path:
+        return self.cache.directory or self.workspace / "artifacts"
+
+    @property
+    def stages_directory(self) -> Path:
+        return self.cache.stages or self.workspace / "stages"
+
     @property
     def env_file(self) -> Path:
         return self.home / ".untropy"
@@ -254,3 +540,4 @@ class UntropySettings(BaseSettings):
     class Config:
         env_prefix = "untropy_"
         env_file = ".untropy"
+        allow_mutation = False
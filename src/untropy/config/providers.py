@@ -0,0 +1,196 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Variable providers, resolving variable values from external sources.
+
+A variable whose value is `@<provider>:<reference>` is resolved by a
+provider when the shell environment is built:
+
+- `@file:path`: content of a file, relative to the project home;
+- `@cmd:command`: output of a shell command run in the project home;
+- `@http:url`: body of a GET request (a key-value endpoint), or the `key`
+  field of its JSON body with `url#key`;
+- `@secret:NAME`: value of NAME in the secrets file.
+
+Values to fetch are resolved concurrently. Each provider has a TTL: values
+are kept in a cache file of the workspace (only readable by the user), so
+repeated invocations don't fetch them again, and are resolved again once
+expired, also by long-lived settings (see `UntropySettings.shell_environment`).
+"""
+
+import hashlib
+import json
+import logging
+import re
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from dotenv import dotenv_values
+
+from ..utils import trace
+from ..utils.files import atomic_write_text
+
+if TYPE_CHECKING:
+    from .model import UntropySettings
+
+logger = logging.getLogger("untropy")
+
+REFERENCE_REGEX = re.compile(r"@(?P<provider>[a-z]+):(?P<reference>.+)", re.S)
+
+Provider = Callable[[str, "UntropySettings"], str]
+"Return the value of a reference, raise an exception if it can't be resolved"
+
+PROVIDERS: Dict[str, Provider] = {}
+
+
+class ResolvedVariables(NamedTuple):
+    values: Dict[str, str]
+    expires: Dict[str, Optional[float]]
+    "Expiry time of the values resolved by a provider, None for the ones without TTL"
+
+    @property
+    def refresh_time(self) -> float:
+        """Time at which a value with a TTL expires, infinite if there is none."""
+        return min((expires for expires in self.expires.values() if expires is not None), default=float("inf"))
+
+
+def provider(name: str) -> Callable[[Provider], Provider]:
+    """Register the decorated function as the provider name."""
+
+    def register(function: Provider) -> Provider:
+        PROVIDERS[name] = function
+        return function
+
+    return register
+
+
+@provider("file")
+def file_provider(reference: str, settings: "UntropySettings") -> str:
+    return (settings.home / Path(reference).expanduser()).read_text().rstrip("\n")
+
+
+@provider("cmd")
+def command_provider(reference: str, settings: "UntropySettings") -> str:
+    process = subprocess.run(
+        reference,
+        shell=True,
+        cwd=settings.home,
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        text=True,
+        timeout=settings.providers.timeout,
+    )
+    if process.returncode != 0:
+        raise ValueError(f"command failed with code {process.returncode}: {process.stderr.strip()}")
+    return process.stdout.rstrip("\n")
+
+
+@provider("http")
+def http_provider(reference: str, settings: "UntropySettings") -> str:
+    import urllib.request  # only imported when needed, to keep the startup fast
+
+    url, _, key = reference.partition("#")
+    with urllib.request.urlopen(url, timeout=settings.providers.timeout) as response:
+        body = response.read().decode()
+    if not key:
+        return body.rstrip("\n")
+    value = json.loads(body)[key]
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+@provider("secret")
+def secret_provider(reference: str, settings: "UntropySettings") -> str:
+    if not settings.secrets_file:
+        raise ValueError("no secrets_file configured")
+    value = dotenv_values(settings.home / settings.secrets_file).get(reference)
+    if value is None:
+        raise ValueError(f"{reference} is not in {settings.secrets_file}")
+    return value
+
+
+def cache_path(settings: "UntropySettings") -> Path:
+    """Return the file caching the provided variables of the project."""
+    key = hashlib.sha1(str(settings.home.resolve()).encode()).hexdigest()
+    return settings.workspace / "cache" / "variables" / f"{key}.json"
+
+
+def resolve_variables(variables: Mapping[str, str], settings: "UntropySettings") -> ResolvedVariables:
+    """Return variables with the provider references replaced by their values, and when they expire.
+
+    Raises ValueError if a reference can't be resolved.
+    """
+    references: Dict[str, Tuple[str, str]] = {}
+    for name, value in variables.items():
+        if (match := REFERENCE_REGEX.fullmatch(value)) is None:
+            continue
+        if match["provider"] not in PROVIDERS:
+            raise ValueError(f"Unknown provider {match['provider']} for variable {name}")
+        references[name] = (match["provider"], match["reference"])
+    if not references:
+        return ResolvedVariables(dict(variables), {})
+
+    path = cache_path(settings)
+    now = time.time()
+    try:
+        cache: Dict[str, List[Any]] = json.loads(path.read_text())
+    except (OSError, ValueError):
+        cache = {}
+    values: Dict[str, str] = {}
+    expires: Dict[str, Optional[float]] = {}
+    missing: Dict[str, Tuple[str, str]] = {}
+    for name, (provider_name, reference) in references.items():
+        entry = cache.get(f"{provider_name}:{reference}")
+        if entry is not None and entry[0] > now:
+            values[name], expires[name] = entry[1], entry[0]
+        else:
+            missing[name] = (provider_name, reference)
+
+    def fetch(item: Tuple[str, Tuple[str, str]]) -> Tuple[str, str]:
+        name, (provider_name, reference) = item
+        with trace.span("provider", provider=provider_name, variable=name):
+            try:
+                return name, PROVIDERS[provider_name](reference, settings)
+            except Exception as error:
+                raise ValueError(f"Unable to resolve {name} with the {provider_name} provider: {error}") from error
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(settings.providers.jobs, len(missing))) as executor:
+            values.update(executor.map(fetch, missing.items()))
+        changed = False
+        for name, (provider_name, reference) in missing.items():
+            ttl = settings.providers.ttl.get(provider_name, 0)
+            expires[name] = now + ttl if ttl > 0 else None
+            if ttl > 0:
+                cache[f"{provider_name}:{reference}"] = [now + ttl, values[name]]
+                changed = True
+        if changed:
+            cache = {key: entry for key, entry in cache.items() if entry[0] > now}
+            try:
+                atomic_write_text(path, json.dumps(cache), mode=0o600)
+            except OSError as error:
+                logger.debug(f"Unable to save the variables cache: {error}")
+
+    return ResolvedVariables({name: values.get(name, value) for name, value in variables.items()}, expires)
@@ -0,0 +1,170 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Frozen snapshots of resolved settings, for CI jobs.
+
+A snapshot holds the validated settings of one or more environments. It has
+two lines: a JSON header with the format version and the sha256 checksum of
+the second line, the JSON payload. Loading a snapshot checks the checksum
+and builds the settings with `construct`, without walking the directories,
+reading the environment variables nor validating, so the jobs of a pipeline
+start quickly and use exactly the settings of the job that froze them.
+
+The variables are frozen resolved, so the jobs don't run the `cmd`, `http`
+and `file` providers again. The secrets are not frozen: the secret fields
+(`SecretStr`, like the registry password) are read again from their
+environment variables, and the `@secret:` variables from the secrets file of
+the job.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Type, TypeVar, Union
+
+from pydantic import BaseModel, BaseSettings, SecretStr
+from pydantic.fields import SHAPE_DICT, SHAPE_LIST, SHAPE_MAPPING, SHAPE_SINGLETON
+from pydantic.json import pydantic_encoder
+
+from ..utils.files import atomic_write_text
+from .model import UntropyConfigurationError, UntropySettings
+from .providers import REFERENCE_REGEX
+
+SNAPSHOT_FORMAT = 2
+
+SNAPSHOT_ENV = "UNTROPY_SNAPSHOT"
+
+M = TypeVar("M", bound=BaseModel)
+
+
+def secret_fields(model: Type[BaseModel]) -> Dict[Union[int, str], Any]:
+    """Return the secret fields of model and of its nested models, in the `exclude` form of `dict`."""
+    fields: Dict[Union[int, str], Any] = {}
+    for name, field in model.__fields__.items():
+        kind = field.type_
+        if kind is SecretStr:
+            fields[name] = True
+        elif isinstance(kind, type) and issubclass(kind, BaseModel) and (nested := secret_fields(kind)):
+            if field.shape == SHAPE_SINGLETON:
+                fields[name] = nested
+            elif field.shape in (SHAPE_DICT, SHAPE_MAPPING, SHAPE_LIST):
+                fields[name] = {"__all__": nested}
+    return fields
+
+
+def environment_secret(model: Type[BaseModel], name: str) -> Optional[SecretStr]:
+    """Return the value of the secret field name of model read from its environment variables."""
+    if not issubclass(model, BaseSettings):
+        return None
+    case_sensitive = model.__config__.case_sensitive
+    environ = os.environ if case_sensitive else {key.lower(): value for key, value in os.environ.items()}
+    for env_name in model.__fields__[name].field_info.extra.get("env_names", ()):
+        if (value := environ.get(env_name)) is not None:
+            return SecretStr(value)
+    return None
+
+
+def frozen_variables(settings: UntropySettings) -> Dict[str, str]:
+    """Return the resolved values of the variables of settings, except the `@secret:` ones."""
+    environment = settings.shell_environment
+    return {
+        name: environment[name]
+        for name, value in (settings.variables or {}).items()
+        if not ((match := REFERENCE_REGEX.fullmatch(value)) and match["provider"] == "secret")
+    }
+
+
+def freeze_settings(settings: UntropySettings, environments: Iterable[str] = ()) -> str:
+    """Return the snapshot of settings and of the views of environments, with their resolved variables.
+
+    Raises UntropyConfigurationError if an environment doesn't exist or a variable can't be resolved.
+    """
+    names = [settings.env] + [name for name in environments if name != settings.env]
+    views = {name: settings.for_environment(name) for name in names}
+    payload = json.dumps(
+        {
+            "env": settings.env,
+            "environments": {name: view.dict(exclude=secret_fields(UntropySettings)) for name, view in views.items()},
+            "variables": {name: frozen_variables(view) for name, view in views.items()},
+        },
+        default=pydantic_encoder,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    header = {"format": SNAPSHOT_FORMAT, "sha256": hashlib.sha256(payload.encode()).hexdigest()}
+    return f"{json.dumps(header)}\n{payload}\n"
+
+
+def write_snapshot(path: Path, settings: UntropySettings, environments: Iterable[str] = ()):
+    """Write the snapshot of settings to path, only readable by the user as the variables may hold credentials."""
+    atomic_write_text(path, freeze_settings(settings, environments), mode=0o600)
+
+
+def construct_model(model: Type[M], values: Dict[str, Any]) -> M:
+    """Build model from trusted values, like `model.construct` but with the nested models and paths.
+
+    The secret fields missing from values are read from their environment variables.
+    """
+    fields: Dict[str, Any] = {
+        name: secret
+        for name, field in model.__fields__.items()
+        if field.type_ is SecretStr and name not in values and (secret := environment_secret(model, name))
+    }
+    for name, value in values.items():
+        field = model.__fields__.get(name)
+        if field is not None and value is not None:
+            kind = field.type_
+            if isinstance(kind, type) and issubclass(kind, BaseModel):
+                if field.shape == SHAPE_SINGLETON:
+                    value = construct_model(kind, value)
+                elif field.shape in (SHAPE_DICT, SHAPE_MAPPING):
+                    value = {key: construct_model(kind, item) for key, item in value.items()}
+                elif field.shape == SHAPE_LIST:
+                    value = [construct_model(kind, item) for item in value]
+            elif kind is Path and field.shape == SHAPE_SINGLETON:
+                value = Path(value)
+        fields[name] = value
+    return model.construct(**fields)
+
+
+def load_snapshot(path: Path) -> UntropySettings:
+    """Return the settings of the snapshot path, the views of its other environments being cached.
+
+    Raises UntropyConfigurationError if the snapshot can't be read, is corrupted or has another format.
+    """
+    try:
+        header_line, payload = path.read_text().split("\n", 2)[:2]
+        header: Dict[str, Any] = json.loads(header_line)
+    except (OSError, ValueError) as error:
+        raise UntropyConfigurationError(f"Unable to read the settings snapshot {path}: {error}") from error
+    if header.get("format") != SNAPSHOT_FORMAT:
+        raise UntropyConfigurationError(f"Unsupported settings snapshot format {header.get('format')} in {path}")
+    if hashlib.sha256(payload.encode()).hexdigest() != header.get("sha256"):
+        raise UntropyConfigurationError(f"The settings snapshot {path} is corrupted (checksum mismatch)")
+
+    content = json.loads(payload)
+    views: Dict[str, UntropySettings] = {}
+    settings: Optional[UntropySettings] = None
+    for name, values in content["environments"].items():
+        view = construct_model(UntropySettings, values)
+        object.__setattr__(view, "_views", views)
+        object.__setattr__(view, "_frozen", content["variables"][name])
+        views[name] = view
+        if name == content["env"]:
+            settings = view
+    assert settings is not None
+    for view in views.values():
+        if view is not settings:
+            object.__setattr__(view, "_base", settings)
+    return settings
@@ -0,0 +1,147 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Untropy session, to use untropy as a library.
+
+    >>> from untropy.session import Untropy
+    >>> session = Untropy("/path/to/project")
+    >>> session.shell_environment("devops_prod")["UNTROPY_TIER"]
+    'prod'
+
+A session loads the project configuration once, the settings of each
+environment being cached views of it (see `UntropySettings.for_environment`).
+It checks, at most every `check_interval` seconds,
+whether the configuration files changed and reloads them if so, the values
+of the variable providers being resolved again once their TTL expires. All the
+methods are thread safe and return data instead of printing it.
+"""
+
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Union
+
+from .config.cache import files_stamps
+from .config.load import (
+    find_configuration_file,
+    load_project_configuration,
+    merged_settings,
+)
+from .config.model import UntropyConfigurationError, UntropySettings
+from .utils.artifacts import ArtifactStore
+from .utils.cookies import cookie_names, find_cookies_dir, generate_cookie
+
+
+class Untropy:
+    """Thread safe session on the configuration of a project.
+
+    Args:
+        directory: Directory of the project or one of its subdirectories,
+            the current directory by default.
+        check_interval: Minimum delay in seconds between two checks of the
+            configuration files.
+        cookies_dir: Directory of the cookies, the installed ones by default.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, "os.PathLike[str]", None] = None,
+        check_interval: float = 1.0,
+        cookies_dir: Optional[Path] = None,
+    ):
+        path = find_configuration_file(Path(directory or "."))
+        if path is None:
+            raise UntropyConfigurationError(f"No untropy.toml file in {directory or '.'} or its parents")
+        self.path = path.resolve()
+        self.check_interval = check_interval
+        self.cookies_dir = cookies_dir or find_cookies_dir()
+        self._lock = threading.RLock()
+        self._settings: Optional[UntropySettings] = None
+        self._stamps: List[List[Any]] = []
+        self._checked = 0.0
+
+    @property
+    def files(self) -> List[Path]:
+        """Files the settings depend on."""
+        return merged_settings(self.path).dependencies + [self.path.parent / ".untropy"]
+
+    def _current(self) -> UntropySettings:
+        """Return the settings, reloaded if a configuration file changed. Must be called with the lock held."""
+        now = time.monotonic()
+        if self._settings is not None and now - self._checked < self.check_interval:
+            return self._settings
+        self._checked = now
+        if self._settings is not None and files_stamps(self.files) == self._stamps:
+            return self._settings
+
+        self._settings = load_project_configuration(self.path)
+        self._stamps = files_stamps(self.files)
+        return self._settings
+
+    def reload(self):
+        """Reload the configuration files at the next call, even if they didn't change."""
+        with self._lock:
+            self._settings = None
+
+    def settings(self, env: Optional[str] = None) -> UntropySettings:
+        """Return the settings of env, the default environment if None.
+
+        Raises UntropyConfigurationError if env doesn't exist.
+        """
+        with self._lock:
+            settings = self._current()
+        return settings if env is None else settings.for_environment(env)
+
+    @property
+    def env(self) -> str:
+        """Default environment."""
+        return self.settings().env
+
+    def environments(self) -> List[str]:
+        return list(self.settings().environment_names)
+
+    def shell_environment(self, env: Optional[str] = None) -> Dict[str, str]:
+        """Return the environment variables of env."""
+        return self.settings(env).shell_environment
+
+    def internal_vars(self, env: Optional[str] = None) -> Mapping[str, Any]:
+        return self.settings(env).internal_vars
+
+    def cookies(self) -> List[str]:
+        return cookie_names(self.cookies_dir)
+
+    def generate_cookie(
+        self,
+        cookie: str,
+        output_dir: Union[str, "os.PathLike[str]"] = ".",
+        env: Optional[str] = None,
+        extra_context: Optional[Dict[str, str]] = None,
+        overwrite: bool = False,
+    ) -> Path:
+        """Generate cookie in output_dir, without prompting, and return the generated directory.
+
+        Args:
+            cookie: Name of the cookie.
+            output_dir: Directory where the cookie is generated.
+            env: Environment whose cookiecutter settings are used.
+            extra_context: Values overriding the cookiecutter settings.
+            overwrite: Overwrite existing files.
+        """
+        settings = self.settings(env)
+        context = dict(settings.cookiecutter or {})
+        context.update(extra_context or {})
+        store = ArtifactStore(settings.artifacts_directory, settings.cache.max_size)
+        return generate_cookie(
+            self.cookies_dir, cookie, str(output_dir), context, overwrite=overwrite, no_input=True, store=store
+        )
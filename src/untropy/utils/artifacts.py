@@ -0,0 +1,238 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Content addressed artifact store.
+
+Artifacts (providers, charts, modules, ...) are stored once as read only blobs
+named after their sha256 digest, and materialized into projects by reflink
+or copy (not by hard link, a project could then change the blob). The store
+index (known URLs, last use of each blob and hit statistics) is protected by
+a lock file so several processes can share the store. Least recently used
+blobs are evicted when the store exceeds its size.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional
+
+from . import metrics
+from .files import atomic_write_text, file_lock
+
+logger = logging.getLogger("untropy")
+
+CHUNK_SIZE = 1024 * 1024
+
+FICLONE = 0x40049409  # linux ioctl, copy on write clone of a file
+
+
+class ArtifactStats(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    blobs: int
+    size: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def _reflink(source: Path, destination: Path) -> bool:
+    try:
+        import fcntl
+    except ImportError:  # pragma: no cover - windows
+        return False
+    try:
+        with open(source, "rb") as input, open(destination, "wb") as output:
+            fcntl.ioctl(output.fileno(), FICLONE, input.fileno())
+        return True
+    except OSError:
+        destination.unlink(missing_ok=True)
+        return False
+
+
+class ArtifactStore:
+    """Content addressed store of artifacts.
+
+    Args:
+        root: Directory of the store.
+        max_size: Size of the store in bytes above which blobs are evicted.
+    """
+
+    def __init__(self, root: Path, max_size: int):
+        self.root = root
+        self.max_size = max_size
+        self.blobs = root / "blobs"
+        self.index_file = root / "index.json"
+        self.lock_file = root / "index.lock"
+
+    def blob_path(self, digest: str) -> Path:
+        return self.blobs / digest[:2] / digest
+
+    def read_index(self) -> Dict[str, Any]:
+        try:
+            return json.loads(self.index_file.read_text())
+        except (OSError, ValueError):
+            return {"blobs": {}, "urls": {}, "hits": 0, "misses": 0, "evictions": 0}
+
+    def write_index(self, index: Dict[str, Any]):
+        atomic_write_text(self.index_file, json.dumps(index, separators=(",", ":")))
+
+    def lookup(
+        self, url: Optional[str] = None, digest: Optional[str] = None, destination: Optional[Path] = None
+    ) -> Optional[str]:
+        """Return the digest of the blob matching digest or url and record the hit or the miss.
+
+        On a hit, the blob is materialized to destination under the store lock, before any eviction.
+        """
+        with file_lock(self.lock_file):
+            index = self.read_index()
+            digest = digest or index["urls"].get(url)
+            if digest is not None and digest in index["blobs"] and self.blob_path(digest).exists():
+                index["hits"] += 1
+                index["blobs"][digest]["used"] = time.time()
+                if url is not None:
+                    index["urls"][url] = digest
+                if destination is not None:
+                    self._materialize(digest, destination)
+            else:
+                index["misses"] += 1
+                digest = None
+            self.write_index(index)
+        metrics.increment("untropy_cache_requests_total", cache="artifacts", result="miss" if digest is None else "hit")
+        return digest
+
+    def add(
+        self, stream, url: Optional[str] = None, digest: Optional[str] = None, destination: Optional[Path] = None
+    ) -> str:
+        """Store the content of the binary stream and return its digest.
+
+        The blob is materialized to destination, if any, under the store lock.
+        Raises ValueError if the digest of the content isn't digest.
+        """
+        temporary_directory = self.root / "tmp"
+        temporary_directory.mkdir(parents=True, exist_ok=True)
+        sha256 = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=temporary_directory, delete=False) as temporary:
+            try:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                    sha256.update(chunk)
+                    temporary.write(chunk)
+                    size += len(chunk)
+            except BaseException:
+                os.unlink(temporary.name)
+                raise
+
+        actual = sha256.hexdigest()
+        if digest is not None and actual != digest:
+            os.unlink(temporary.name)
+            raise ValueError(f"Bad sha256 for {url}: {actual} instead of {digest}")
+
+        blob = self.blob_path(actual)
+        with file_lock(self.lock_file):  # an eviction by another process can't delete the new blob
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            os.chmod(temporary.name, 0o444)
+            os.replace(temporary.name, blob)
+            index = self.read_index()
+            index["blobs"][actual] = {"size": size, "used": time.time()}
+            if url is not None:
+                index["urls"][url] = actual
+            self.evict(index, keep=actual)
+            self.write_index(index)
+            if destination is not None:
+                self._materialize(actual, destination)
+        return actual
+
+    def fetch(
+        self, url: str, digest: Optional[str] = None, refresh: bool = False, destination: Optional[Path] = None
+    ) -> str:
+        """Return the digest of the artifact at url, downloading it on a cache miss.
+
+        Args:
+            url: URL of the artifact (file, http, https, ...).
+            digest: Expected sha256 of the artifact. A blob with this digest
+                is used whatever its URL.
+            refresh: Download the artifact even if the URL is known.
+            destination: Materialize the artifact here. Unlike a later call to
+                `materialize`, the blob can't be evicted in between.
+        """
+        cached = self.lookup(url if not refresh else None, digest, destination)
+        if cached is not None:
+            logger.debug(f"Artifact cache hit for {url}: {cached}")
+            return cached
+        logger.debug(f"Artifact cache miss for {url}")
+        with urllib.request.urlopen(url) as response:
+            return self.add(response, url, digest, destination)
+
+    def put(self, path: Path) -> str:
+        """Store the file path and return its digest."""
+        with open(path, "rb") as stream:
+            return self.add(stream)
+
+    def materialize(self, digest: str, destination: Path):
+        """Create destination with the content of the blob, by reflink or copy.
+
+        Raises FileNotFoundError if the blob was evicted, `fetch` with a destination can't fail so.
+        """
+        with file_lock(self.lock_file):
+            self._materialize(digest, destination)
+
+    def _materialize(self, digest: str, destination: Path):
+        blob = self.blob_path(digest)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        if destination.exists() or destination.is_symlink():
+            destination.unlink()
+        if not _reflink(blob, destination):
+            shutil.copyfile(blob, destination)
+
+    def evict(self, index: Dict[str, Any], max_size: Optional[int] = None, keep: Optional[str] = None):
+        """Remove the least recently used blobs of index, but keep, until the store fits in max_size."""
+        max_size = self.max_size if max_size is None else max_size
+        size = sum(blob["size"] for blob in index["blobs"].values())
+        for digest, blob in sorted(index["blobs"].items(), key=lambda item: item[1]["used"]):
+            if size <= max_size:
+                break
+            if digest == keep:
+                continue
+            logger.debug(f"Evicting artifact {digest}")
+            self.blob_path(digest).unlink(missing_ok=True)
+            del index["blobs"][digest]
+            size -= blob["size"]
+            index["evictions"] += 1
+        index["urls"] = {url: digest for url, digest in index["urls"].items() if digest in index["blobs"]}
+
+    def collect(self, max_size: Optional[int] = None):
+        """Evict blobs until the store fits in max_size (the store size by default)."""
+        with file_lock(self.lock_file):
+            index = self.read_index()
+            self.evict(index, max_size)
+            self.write_index(index)
+
+    def stats(self) -> ArtifactStats:
+        index = self.read_index()
+        return ArtifactStats(
+            index["hits"],
+            index["misses"],
+            index["evictions"],
+            len(index["blobs"]),
+            sum(blob["size"] for blob in index["blobs"].values()),
+        )
@@ -0,0 +1,202 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Completion cache read directly by the shell completion scripts.
+
+Python startup is too slow for completion, so each invocation of untropy
+records the subcommands, the cookies and the environments of the current
+project in a tab separated file:
+
+    command<TAB><name>
+    cookie<TAB><name>
+    env<TAB><project home><TAB><name>
+
+The completion scripts walk up from the current directory to the project
+home and read the matching lines. They only run click's completion when the
+cache is missing or has no candidate.
+"""
+
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from .files import atomic_write_text, cache_directory
+
+COMPLETION_ENV = "UNTROPY_COMPLETION_CACHE"
+
+MAX_PROJECTS = 256
+"Number of projects whose environments are kept in the cache"
+
+CONFIGURATION_FILE_NAME = "untropy.toml"
+
+
+def completion_path() -> Path:
+    path = os.getenv(COMPLETION_ENV)
+    return Path(path) if path else cache_directory() / "completion"
+
+
+def completion_lines(
+    current: List[str],
+    commands: Iterable[str],
+    cookies: Iterable[str],
+    home: Optional[Path] = None,
+    environments: Iterable[str] = (),
+) -> List[str]:
+    """Return the lines of the cache current updated with commands, cookies and the environments of home.
+
+    The projects keep their position, so the cache only changes when a project is added or its
+    environments change.
+    """
+    lines = [f"command\t{name}" for name in sorted(commands)]
+    lines += [f"cookie\t{name}" for name in sorted(cookies)]
+    projects: Dict[str, List[str]] = {}
+    for line in current:
+        fields = line.split("\t")
+        if fields[0] == "env" and len(fields) == 3:
+            projects.setdefault(fields[1], []).append(line)
+    if home is not None:
+        projects[str(home)] = [f"env\t{home}\t{name}" for name in environments]
+    for project in list(projects)[-MAX_PROJECTS:]:
+        lines += projects[project]
+    return lines
+
+
+def record_completion(
+    commands: Iterable[str],
+    cookies: Iterable[str],
+    home: Optional[Path] = None,
+    environments: Iterable[str] = (),
+):
+    """Update the completion cache, only written when its content changes."""
+    path = completion_path()
+    try:
+        current = path.read_text().splitlines()
+    except OSError:
+        current = []
+    lines = completion_lines(current, commands, cookies, home, environments)
+    if lines != current:
+        atomic_write_text(path, "\n".join(lines) + "\n")
+
+
+CACHE_LOCATION = '"${UNTROPY_COMPLETION_CACHE:-${XDG_CACHE_HOME:-$HOME/.cache}/untropy/completion}"'
+
+BASH_SCRIPT = r"""
+_untropy_cached_completion() {
+    local cache=%(cache)s
+    local cur="${COMP_WORDS[COMP_CWORD]}" kind=""
+    if [[ $COMP_CWORD -eq 1 ]]; then
+        kind=command
+    elif [[ ${COMP_WORDS[1]} == env || ${COMP_WORDS[1]} == cookie ]]; then
+        kind=${COMP_WORDS[1]}
+    fi
+    if [[ -n $kind && $cur != -* && -r $cache ]]; then
+        local dir=$(pwd -P) candidates=() k a b
+        while [[ $dir != / && ! -f $dir/%(configuration)s ]]; do
+            dir=${dir%%/*}
+            dir=${dir:-/}
+        done
+        while IFS=$'\t' read -r k a b; do
+            if [[ $k == "$kind" && $kind != env ]]; then
+                candidates+=("$a")
+            elif [[ $k == env && $kind == env && $a == "$dir" ]]; then
+                candidates+=("$b")
+            fi
+        done < "$cache"
+        if [[ ${#candidates[@]} -gt 0 ]]; then
+            local IFS=$'\n'
+            COMPREPLY=($(compgen -W "${candidates[*]}" -- "$cur"))
+            return 0
+        fi
+    fi
+    _untropy_completion "$@"
+}
+
+complete -o nosort -F _untropy_cached_completion untropy
+"""
+
+ZSH_SCRIPT = r"""
+_untropy_cached_completion() {
+    local cache=%(cache)s
+    local kind=""
+    if (( CURRENT == 2 )); then
+        kind=command
+    elif [[ $words[2] == env || $words[2] == cookie ]]; then
+        kind=$words[2]
+    fi
+    if [[ -n $kind && $PREFIX != -* && -r $cache ]]; then
+        local dir=${PWD:A} k a b
+        local -a candidates
+        while [[ $dir != / && ! -f $dir/%(configuration)s ]]; do
+            dir=${dir:h}
+        done
+        while IFS=$'\t' read -r k a b; do
+            if [[ $k == "$kind" && $kind != env ]]; then
+                candidates+=("$a")
+            elif [[ $k == env && $kind == env && $a == "$dir" ]]; then
+                candidates+=("$b")
+            fi
+        done < "$cache"
+        if (( ${#candidates} )); then
+            compadd -a candidates
+            return
+        fi
+    fi
+    _untropy_completion "$@"
+}
+
+compdef _untropy_cached_completion untropy
+"""
+
+FISH_SCRIPT = r"""
+function _untropy_cached_completion
+    set -l cache %(cache)s
+    set -l words (commandline -opc)
+    set -l current (commandline -ct)
+    set -l kind
+    if test (count $words) -eq 1
+        set kind command
+    else if contains -- $words[2] env cookie
+        set kind $words[2]
+    end
+    if test -n "$kind"; and not string match -q -- '-*' $current; and test -r $cache
+        set -l dir (pwd -P)
+        while test "$dir" != /; and not test -f $dir/%(configuration)s
+            set dir (string replace -r '/[^/]*$' '' -- $dir)
+            test -z "$dir"; and set dir /
+        end
+        set -l candidates
+        while read --delimiter \t k a b
+            if test "$k" = "$kind"; and test "$kind" != env
+                set -a candidates $a
+            else if test "$k" = env; and test "$kind" = env; and test "$a" = "$dir"
+                set -a candidates $b
+            end
+        end < $cache
+        if test (count $candidates) -gt 0
+            printf '%%s\n' $candidates
+            return
+        end
+    end
+    _untropy_completion
+end
+
+complete --erase --command untropy
+complete --no-files --command untropy --arguments "(_untropy_cached_completion)"
+"""
+
+SCRIPTS = {"bash": BASH_SCRIPT, "zsh": ZSH_SCRIPT, "fish": FISH_SCRIPT}
+
+
+def cached_completion_script(shell: str) -> str:
+    """Return the part of the completion script of shell reading the cache, calling `_untropy_completion` otherwise."""
+    return SCRIPTS[shell] % {"cache": CACHE_LOCATION, "configuration": CONFIGURATION_FILE_NAME}
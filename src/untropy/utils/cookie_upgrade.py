@@ -0,0 +1,239 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Upgrade of generated projects to the current version of their cookie.
+
+A project generated with a store has a record of its cookie, of the digest
+of the template archive (kept in the artifact store) and of its context.
+To upgrade it, the old and the current templates are generated again with
+the recorded context and each file is merged:
+
+- files the template didn't change are left as is;
+- files the project didn't change are replaced (or removed) by the new ones;
+- files changed on both sides are merged with `git merge-file`, the
+  conflicts being marked in the file and listed in a report.
+
+Only the files whose content changes are written. Projects are upgraded
+concurrently by a pool of processes, cookiecutter being neither thread
+safe nor fast.
+"""
+
+import fnmatch
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Literal,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from .artifacts import ArtifactStore
+from .cookies import RECORD_NAME, generate_cookie, template_archive
+from .files import atomic_write_text
+
+REPORT_NAME = ".untropy-cookie-conflicts.txt"
+
+IGNORED_NAMES = (RECORD_NAME, REPORT_NAME)
+
+UpgradeStatus = Literal["upgraded", "up-to-date", "conflicts", "failed"]
+
+
+class UpgradeResult(NamedTuple):
+    project: Path
+    status: UpgradeStatus
+    changed: List[str] = []
+    "Files written or removed, relative to the project"
+    conflicts: List[str] = []
+    "Files with conflicts, relative to the project"
+    message: str = ""
+
+
+def tree_files(root: Path) -> Set[str]:
+    return {
+        str(path.relative_to(root))
+        for path in root.rglob("*")
+        if (path.is_file() or path.is_symlink()) and path.name not in IGNORED_NAMES and ".git" not in path.parts
+    }
+
+
+def read(path: Path) -> Optional[bytes]:
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def write(target: Path, content: bytes, source: Path):
+    """Write content to target with the file mode of source, the generated file."""
+    target.write_bytes(content)
+    shutil.copymode(source, target)
+
+
+def merge_file(ours: bytes, base: bytes, theirs: bytes) -> Tuple[Optional[bytes], bool]:
+    """Return the three-way merge of ours and theirs from base and whether it has conflicts.
+
+    The merge is None if the files can't be merged (binary files).
+    """
+    with tempfile.TemporaryDirectory(prefix="untropy-merge-") as directory:
+        paths = [Path(directory) / name for name in ("ours", "base", "theirs")]
+        for path, content in zip(paths, (ours, base, theirs)):
+            path.write_bytes(content)
+        process = subprocess.run(
+            ["git", "merge-file", "-p", "-L", "project", "-L", "previous template", "-L", "template"]
+            + [str(path) for path in paths],
+            capture_output=True,
+        )
+    if process.returncode < 0 or process.returncode > 127:  # binary files or error
+        return None, True
+    return process.stdout, process.returncode > 0
+
+
+def merge_trees(project: Path, old: Path, new: Path) -> UpgradeResult:
+    """Apply the changes from the old to the new generated tree to project."""
+    changed: List[str] = []
+    conflicts: List[str] = []
+    for name in sorted(tree_files(old) | tree_files(new)):
+        base, theirs, ours = read(old / name), read(new / name), read(project / name)
+        if base == theirs or ours == theirs:
+            continue
+        target = project / name
+        if ours is None and base is not None:
+            continue  # removed from the project
+        if ours == base:
+            if theirs is None:
+                target.unlink()
+            else:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                write(target, theirs, new / name)
+            changed.append(name)
+            continue
+        if theirs is None:
+            conflicts.append(name)  # changed in the project, removed from the template
+            continue
+        assert ours is not None
+        merged, conflicted = merge_file(ours, base or b"", theirs)
+        if merged is not None and merged != ours:
+            write(target, merged, new / name)
+            changed.append(name)
+        if conflicted:
+            conflicts.append(name)
+    status: UpgradeStatus = "conflicts" if conflicts else "upgraded"
+    return UpgradeResult(project, status, changed, conflicts)
+
+
+def generate(cookies_dir: Path, cookie: str, context: Dict[str, str], output: Path, config_file: Path) -> Path:
+    output.mkdir(parents=True)
+    return generate_cookie(cookies_dir, cookie, str(output), context, no_input=True, config_file=str(config_file))
+
+
+def extract(archive: tarfile.TarFile, destination: Path):
+    """Extract archive to destination, refusing the members outside of it (absolute paths, links, devices)."""
+    if hasattr(tarfile, "data_filter"):
+        archive.extractall(destination, filter="data")
+        return
+    root = destination.resolve()
+    for member in archive.getmembers():
+        path = (root / member.name).resolve()
+        inside = path == root or root in path.parents
+        if not inside or not (member.isfile() or member.isdir()):
+            raise tarfile.TarError(f"unsafe member {member.name!r} in the template archive")
+    archive.extractall(destination)
+
+
+def upgrade_project(project: Path, cookies_dir: Path, store_root: Path, max_size: int) -> UpgradeResult:
+    """Upgrade project to the current template of its cookie, in cookies_dir."""
+    try:
+        record = json.loads((project / RECORD_NAME).read_text())
+        cookie: str = record["cookie"]
+        current = template_archive(cookies_dir, cookie)
+        if hashlib.sha256(current).hexdigest() == record["template"]:
+            return UpgradeResult(project, "up-to-date")
+        store = ArtifactStore(store_root, max_size)
+        if store.lookup(digest=record["template"]) is None:
+            return UpgradeResult(project, "failed", message=f"previous template {record['template']} not in the store")
+        new_digest = store.add(io.BytesIO(current))
+
+        with tempfile.TemporaryDirectory(prefix="untropy-upgrade-") as directory:
+            work = Path(directory)
+            config = work / "config.yaml"  # keep the user replays
+            config.write_text(f"replay_dir: {work / 'replay'}\ncookiecutters_dir: {work / 'cache'}\n")
+            with tarfile.open(store.blob_path(record["template"])) as archive:
+                extract(archive, work / "templates")
+            old = generate(work / "templates", cookie, record["context"], work / "old", config)
+            new = generate(cookies_dir, cookie, record["context"], work / "new", config)
+            result = merge_trees(project, old, new)
+    except (OSError, ValueError, KeyError, tarfile.TarError) as error:
+        return UpgradeResult(project, "failed", message=str(error))
+    except Exception as error:  # cookiecutter errors
+        return UpgradeResult(project, "failed", message=f"{type(error).__name__}: {error}")
+
+    content = json.dumps({**record, "template": new_digest}, indent=2, sort_keys=True) + "\n"
+    atomic_write_text(project / RECORD_NAME, content, mode=0o644)
+    report = project / REPORT_NAME
+    if result.conflicts:
+        lines = [f"Conflicts of the upgrade of {cookie} to {new_digest}:"] + result.conflicts
+        atomic_write_text(report, "\n".join(lines) + "\n", mode=0o644)
+    else:
+        report.unlink(missing_ok=True)
+    return result
+
+
+def find_projects(paths: Iterable[Path], prune: Iterable[str] = (".*", "node_modules")) -> List[Path]:
+    """Return the generated projects (with a generation record) in paths and their subdirectories."""
+    patterns = list(prune)
+    projects: List[Path] = []
+    for path in paths:
+        for root, directories, files in os.walk(path):
+            directories[:] = sorted(
+                name for name in directories if not any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+            )
+            if RECORD_NAME in files:
+                projects.append(Path(root).resolve())
+                directories.clear()
+    return projects
+
+
+def upgrade_projects(
+    projects: Iterable[Path],
+    cookies_dir: Path,
+    store: ArtifactStore,
+    jobs: int,
+    on_result: Optional[Callable[[UpgradeResult], None]] = None,
+) -> List[UpgradeResult]:
+    """Upgrade projects concurrently in a pool of jobs processes and return their results in the same order."""
+    projects = list(projects)
+    results: Dict[Path, UpgradeResult] = {}
+    with ProcessPoolExecutor(max_workers=max(1, min(jobs, len(projects)))) as executor:
+        futures = [
+            executor.submit(upgrade_project, project, cookies_dir, store.root, store.max_size) for project in projects
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result.project] = result
+            if on_result is not None:
+                on_result(result)
+    return [results[project] for project in projects]
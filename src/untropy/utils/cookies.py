@@ -0,0 +1,130 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import site
+import sys
+import tarfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from . import trace
+from .artifacts import ArtifactStore
+from .files import atomic_write_text
+
+COOKIES_DIR_NAME = "cookies"
+
+COOKIES_DIR_PATH_ELEMENTS = (
+    "share",
+    "untropy",
+    "cookies",
+)
+
+
+def cookies_dir_possible_paths():
+    return (
+        Path(__file__).parents[3].joinpath(COOKIES_DIR_NAME),  # development
+        Path(sys.prefix).joinpath(*COOKIES_DIR_PATH_ELEMENTS),  # standard (venv or base)
+        Path(site.getuserbase()).joinpath(*COOKIES_DIR_PATH_ELEMENTS),  # user installation (pip --user)
+    )
+
+
+def find_cookies_dir() -> Path:
+    possible_paths = cookies_dir_possible_paths()
+    return next((path for path in possible_paths if path.exists()), possible_paths[1])
+
+
+RECORD_NAME = ".untropy-cookie.json"
+"Generation record of a project: cookie, digest of the template archive and context"
+
+_generation_lock = threading.Lock()
+
+
+def cookie_names(cookies_dir: Path) -> List[str]:
+    """Return the names of the cookies of cookies_dir."""
+    return sorted({str(item.name) for item in cookies_dir.iterdir() if item.is_dir() and not item.name[0] in "_."})
+
+
+def generate_cookie(
+    cookies_dir: Path,
+    cookie: str,
+    output_dir: str = ".",
+    extra_context: Optional[Dict[str, str]] = None,
+    replay: bool = False,
+    overwrite: bool = False,
+    no_input: bool = False,
+    store: Optional[ArtifactStore] = None,
+    config_file: Optional[str] = None,
+) -> Path:
+    """Generate the cookie of cookies_dir in output_dir and return the generated directory.
+
+    Generations are serialized: cookiecutter changes the current directory of the process.
+    With a store, the template is archived in it and the generation is recorded in the
+    project, so it can be upgraded to the next versions of the template (see `cookie_upgrade`).
+    A config_file replaces the cookiecutter user configuration (replay and cache directories).
+    """
+    from cookiecutter.main import cookiecutter
+
+    with _generation_lock, trace.span("cookie", cookie=cookie):
+        project = Path(
+            cookiecutter(
+                str(cookies_dir),
+                directory=cookie,
+                output_dir=output_dir,
+                extra_context=extra_context if not replay else None,
+                replay=replay,
+                overwrite_if_exists=overwrite,
+                no_input=no_input,
+                config_file=config_file,
+            )
+        )
+        if store is not None:
+            record_generation(project, cookies_dir, cookie, store)
+        return project
+
+
+def template_archive(cookies_dir: Path, cookie: str) -> bytes:
+    """Return a reproducible tar archive of the template of cookie, its digest identifies the template version."""
+    buffer = io.BytesIO()
+    root = cookies_dir / cookie
+    with tarfile.open(fileobj=buffer, mode="w", format=tarfile.PAX_FORMAT) as archive:
+        for path in sorted([root, *root.rglob("*")]):
+            if "__pycache__" in path.parts:
+                continue
+            info = archive.gettarinfo(str(path), str(Path(cookie) / path.relative_to(root)))
+            info.mtime = info.uid = info.gid = 0
+            info.uname = info.gname = ""
+            if info.isfile():
+                with path.open("rb") as content:
+                    archive.addfile(info, content)
+            else:
+                archive.addfile(info)
+    return buffer.getvalue()
+
+
+def record_generation(project: Path, cookies_dir: Path, cookie: str, store: ArtifactStore):
+    """Archive the template of cookie in store and record the generation of project from it."""
+    from cookiecutter.config import get_user_config
+    from cookiecutter.replay import load
+
+    digest = store.add(io.BytesIO(template_archive(cookies_dir, cookie)))
+    context = load(get_user_config()["replay_dir"], cookie)["cookiecutter"]
+    record: Dict[str, Any] = {
+        "cookie": cookie,
+        "template": digest,
+        "context": {key: value for key, value in context.items() if key not in ("_template", "_output_dir")},
+    }
+    atomic_write_text(project / RECORD_NAME, json.dumps(record, indent=2, sort_keys=True) + "\n", mode=0o644)
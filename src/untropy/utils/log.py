@@ -27,9 +27,8 @@ def fail(message: str):
 
 
 def progress(message: str, **kwargs):
-    click.secho("\r➤➤➤ ", fg="green", bold=True, nl=False)
-    click.secho(message, nl=False, **kwargs)
-    click.echo("\033[K", nl=False)
+    """Rewrite the current line with message, in a single write (see utils.progress for concurrent tasks)."""
+    click.echo(click.style("\r➤➤➤ ", fg="green", bold=True) + click.style(message, **kwargs) + "\033[K", nl=False)
 
 
 def redacted_url(mqtt_url: str) -> str:
@@ -3,7 +3,8 @@ import logging.config
 import os
 
 import click
-import toml
+
+from . import toml_backend
 
 DEFAULT_CONFIGURATION = """
 version = 1
@@ -49,7 +50,7 @@ def setup_logging(default_path="log_config.toml", env_key="LOG_CONFIG"):
     if os.path.exists(path):
         with open(path, "rt") as f:
             try:
-                config = toml.load(f)
+                config = toml_backend.load(f)
                 logging.config.dictConfig(config)
                 configured = True
             except Exception as error:
@@ -59,4 +60,4 @@ def setup_logging(default_path="log_config.toml", env_key="LOG_CONFIG"):
                     bold=True,
                 )
     if not configured:
-        logging.config.dictConfig(toml.loads(DEFAULT_CONFIGURATION))
+        logging.config.dictConfig(toml_backend.loads(DEFAULT_CONFIGURATION, toml_backend.default_backend()))
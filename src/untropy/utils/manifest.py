@@ -0,0 +1,136 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Startup manifest.
+
+Scanning the distribution metadata and probing the data directories at each
+run is costly. The results are stored in a small JSON file, written on first
+run in the user cache directory (or at the path given by `UNTROPY_MANIFEST`
+for installation time generation), and reused as long as its stamp (the
+installation directories modification times) is unchanged.
+
+The command table (the module of each command) is recorded by the first run
+importing all the command modules, the next runs only import the module of
+the invoked command.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import sys
+import sysconfig
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List
+
+from pydantic import BaseModel, ValidationError
+
+from .. import __version__
+from .cookies import find_cookies_dir
+from .files import atomic_write_text, cache_directory
+
+logger = logging.getLogger("untropy")
+
+MANIFEST_FORMAT = 3
+
+DEV_VERSION_REGEX = re.compile(r"\.dev\d+$")
+
+PACKAGE_INIT = str(Path(__file__).parents[1] / "__init__.py")
+
+COMMANDS_PACKAGE = str(Path(__file__).parents[1] / "cli")
+
+
+class StartupManifest(BaseModel):
+    format: int = MANIFEST_FORMAT
+    stamp: List[str]
+    version: str
+    cookies_dir: Path
+    commands: Dict[str, str] = {}
+    "Module of each command, in the `untropy.cli` package"
+
+
+def manifest_path() -> Path:
+    path = os.getenv("UNTROPY_MANIFEST")
+    if path:
+        return Path(path)
+    key = hashlib.sha1(PACKAGE_INIT.encode()).hexdigest()[:12]
+    return cache_directory() / f"manifest-{key}.json"
+
+
+def _mtime(path: str) -> str:
+    try:
+        return str(os.stat(path).st_mtime_ns)
+    except OSError:
+        return "-"
+
+
+def manifest_stamp() -> List[str]:
+    """Return the values that invalidate the manifest when changed (a few stat calls)."""
+    purelib = sysconfig.get_paths()["purelib"]
+    return [
+        str(MANIFEST_FORMAT),
+        sys.version,
+        sys.prefix,
+        PACKAGE_INIT,
+        _mtime(PACKAGE_INIT),
+        _mtime(COMMANDS_PACKAGE),
+        purelib,
+        _mtime(purelib),
+    ]
+
+
+def distribution_version() -> str:
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return DEV_VERSION_REGEX.sub("", version("untropy"))
+    except PackageNotFoundError:
+        return __version__
+
+
+def build_manifest(stamp: List[str]) -> StartupManifest:
+    logger.debug("Building startup manifest")
+    return StartupManifest(stamp=stamp, version=distribution_version(), cookies_dir=find_cookies_dir())
+
+
+def write_manifest(manifest: StartupManifest):
+    try:
+        atomic_write_text(manifest_path(), manifest.json(indent=2))
+    except OSError as error:
+        logger.debug(f"Unable to write startup manifest: {error}")
+
+
+@lru_cache(maxsize=None)
+def startup_manifest() -> StartupManifest:
+    """Return the startup manifest, rebuilding it if it is missing or stale."""
+    stamp = manifest_stamp()
+    path = manifest_path()
+    try:
+        manifest = StartupManifest.parse_file(path)
+        if manifest.stamp == stamp:
+            return manifest
+    except (OSError, ValueError, ValidationError):
+        pass
+
+    manifest = build_manifest(stamp)
+    write_manifest(manifest)
+    return manifest
+
+
+def record_commands(commands: Dict[str, str]):
+    """Store the module of each command in the manifest, if it changed."""
+    manifest = startup_manifest()
+    if manifest.commands != commands:
+        manifest.commands = commands
+        write_manifest(manifest)
@@ -0,0 +1,248 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Opt-in command metrics.
+
+Set `UNTROPY_METRICS` to enable them:
+
+- `textfile:///var/lib/node_exporter`: cumulative counters and histograms in
+  `untropy.prom`, for the Prometheus node exporter textfile collector.
+- `statsd://localhost:8125`: counters and timers sent over UDP.
+
+Metrics are buffered in memory (thread safe, they are recorded by the stage
+scheduler threads) and flushed once at exit. The flush never
+waits: the statsd address is resolved in the background when the sink is
+configured (the metrics are dropped if it isn't resolved in time), UDP
+sockets are non-blocking and, when another process holds the textfile lock,
+the metrics are spooled for the next flush to merge them.
+"""
+
+import atexit
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import uuid
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from .files import atomic_write_text, file_lock
+
+logger = logging.getLogger("untropy")
+
+METRICS_ENV = "UNTROPY_METRICS"
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+"Upper bounds in seconds of the duration histogram buckets"
+
+TEXTFILE_NAME = "untropy.prom"
+STATE_NAME = ".untropy-metrics.json"
+SPOOL_PREFIX = ".untropy-metrics-spool-"
+
+MAX_DATAGRAM = 1400
+
+RESOLVE_TIMEOUT = 0.1
+"Seconds the flush waits for the statsd address still being resolved"
+
+Labels = Tuple[Tuple[str, str], ...]
+Key = Tuple[str, Labels]
+
+_sink: Optional[str] = None
+_counters: Dict[Key, float] = {}
+_histograms: Dict[Key, List[float]] = {}
+_lock = threading.Lock()
+_statsd_address: "Optional[Future[Tuple[str, int]]]" = None
+
+
+def _resolve_statsd(future: "Future[Tuple[str, int]]", host: str, port: int):
+    try:
+        future.set_result(statsd_address(host, port))
+    except OSError as error:
+        future.set_exception(error)
+
+
+def configure(url: Optional[str]):
+    """Enable the metrics sink url (textfile:// or statsd://), disable the metrics if None."""
+    global _sink, _statsd_address
+    if url:
+        parsed = urlparse(url)
+        if parsed.scheme not in ("textfile", "statsd"):
+            logger.warning(f"Unsupported metrics sink {url}, metrics are disabled")
+            return
+        if parsed.scheme == "statsd":
+            _statsd_address = Future()
+            arguments = (_statsd_address, parsed.hostname or "localhost", parsed.port or 8125)
+            threading.Thread(target=_resolve_statsd, args=arguments, daemon=True).start()
+        if _sink is None:
+            atexit.register(flush)
+    _sink = url or None
+
+
+def enabled() -> bool:
+    return _sink is not None
+
+
+def _key(name: str, labels: Dict[str, str]) -> Key:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def increment(name: str, value: float = 1, **labels: str):
+    """Increment the counter name."""
+    if _sink is None:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels: str):
+    """Add the observation value (in seconds) to the histogram name."""
+    if _sink is None:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _histograms.setdefault(key, []).append(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _series(name: str, labels: Labels) -> str:
+    if not labels:
+        return name
+    content = ",".join(f'{label}="{_escape(value)}"' for label, value in labels)
+    return f"{name}{{{content}}}"
+
+
+def prometheus_samples(
+    counters: Dict[Key, float], histograms: Dict[Key, List[float]]
+) -> Tuple[Dict[str, float], Dict[str, str]]:
+    """Return the metrics as Prometheus samples and the types of their families."""
+    samples: Dict[str, float] = {}
+    types: Dict[str, str] = {}
+    for (name, labels), value in counters.items():
+        types[name] = "counter"
+        samples[_series(name, labels)] = value
+    for (name, labels), values in histograms.items():
+        types[name] = "histogram"
+        for bound in [*DEFAULT_BUCKETS, float("inf")]:
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            samples[_series(f"{name}_bucket", labels + (("le", le),))] = sum(1 for value in values if value <= bound)
+        samples[_series(f"{name}_sum", labels)] = sum(values)
+        samples[_series(f"{name}_count", labels)] = len(values)
+    return samples, types
+
+
+def _merge(state: Dict[str, Dict[str, Any]], samples: Dict[str, float], types: Dict[str, str]):
+    state.setdefault("types", {}).update(types)
+    totals = state.setdefault("samples", {})
+    for series, value in samples.items():
+        totals[series] = totals.get(series, 0) + value
+
+
+def render_textfile(state: Dict[str, Dict[str, Any]]) -> str:
+    lines = []
+    samples = state.get("samples", {})
+    for family, kind in sorted(state.get("types", {}).items()):
+        lines.append(f"# TYPE {family} {kind}")
+        prefixes = [family] if kind == "counter" else [f"{family}_bucket", f"{family}_sum", f"{family}_count"]
+        for series in sorted(samples):
+            if re.match(rf"({'|'.join(prefixes)})(\{{|$)", series):
+                lines.append(f"{series} {samples[series]:g}")
+    return "\n".join(lines) + "\n"
+
+
+def flush_textfile(directory: Path, samples: Dict[str, float], types: Dict[str, str]):
+    directory.mkdir(parents=True, exist_ok=True)
+    try:
+        with file_lock(directory / ".untropy-metrics.lock", blocking=False):
+            state_path = directory / STATE_NAME
+            try:
+                state = json.loads(state_path.read_text())
+            except (OSError, ValueError):
+                state = {}
+            _merge(state, samples, types)
+            for spool in directory.glob(f"{SPOOL_PREFIX}*.json"):
+                try:
+                    spooled = json.loads(spool.read_text())
+                    _merge(state, spooled["samples"], spooled["types"])
+                except (OSError, ValueError, KeyError):
+                    pass
+                spool.unlink(missing_ok=True)
+            atomic_write_text(state_path, json.dumps(state))
+            atomic_write_text(directory / TEXTFILE_NAME, render_textfile(state))
+    except BlockingIOError:
+        spool = directory / f"{SPOOL_PREFIX}{uuid.uuid4().hex}.json"
+        atomic_write_text(spool, json.dumps({"samples": samples, "types": types}))
+
+
+def statsd_lines(counters: Dict[Key, float], histograms: Dict[Key, List[float]]) -> List[str]:
+    """Return the metrics as statsd lines, label values being appended to the names."""
+
+    def metric(name: str, labels: Labels) -> str:
+        return ".".join([name] + [re.sub(r"[^\w-]", "_", value) for _, value in labels])
+
+    lines = [f"{metric(name, labels)}:{value:g}|c" for (name, labels), value in counters.items()]
+    for (name, labels), values in histograms.items():
+        lines.extend(f"{metric(name, labels)}:{value * 1000:.3f}|ms" for value in values)
+    return lines
+
+
+def statsd_address(host: str, port: int) -> Tuple[str, int]:
+    """Return the IPv4 address of the statsd server."""
+    address = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_DGRAM)[0][4]
+    return str(address[0]), int(address[1])
+
+
+def flush_statsd(address: Tuple[str, int], lines: List[str]):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp:
+        udp.setblocking(False)
+        packet = ""
+        for line in lines + [""]:
+            if packet and (not line or len(packet) + len(line) + 1 > MAX_DATAGRAM):
+                try:
+                    udp.sendto(packet.encode(), address)
+                except OSError:
+                    pass
+                packet = ""
+            packet = f"{packet}\n{line}" if packet else line
+
+
+def flush():
+    """Send the buffered metrics to the sink and clear them."""
+    if _sink is None:
+        return
+    with _lock:
+        counters, histograms = dict(_counters), dict(_histograms)
+        _counters.clear()
+        _histograms.clear()
+    if not (counters or histograms):
+        return
+    url = urlparse(_sink)
+    try:
+        if url.scheme == "textfile":
+            samples, types = prometheus_samples(counters, histograms)
+            flush_textfile(Path(url.netloc + url.path).expanduser(), samples, types)
+        elif _statsd_address is not None:
+            flush_statsd(_statsd_address.result(timeout=RESOLVE_TIMEOUT), statsd_lines(counters, histograms))
+    except (OSError, FutureTimeoutError) as error:
+        logger.debug(f"Unable to flush the metrics to {_sink}: {error}")
+
+
+configure(os.getenv(METRICS_ENV))
@@ -0,0 +1,146 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Progress of concurrent tasks, rendered at a capped frequency.
+
+Updates only record the last message of each task, so they can be called
+from tight loops, threads or asyncio tasks without writing anything. A
+renderer thread writes the state at most every `interval` seconds:
+
+- on a terminal, one live line per running task, redrawn in place with a
+  single write;
+- otherwise (CI logs), a plain summary of the running tasks every
+  `summary_interval` seconds, only if something changed.
+
+Lines printed with `Progress.echo` are written above the live lines.
+"""
+
+import shutil
+import sys
+import threading
+import time
+from typing import IO, Dict, List, Optional
+
+import click
+
+PREFIX = "➤➤➤ "
+
+
+class Progress:
+    """Live progress of concurrent tasks.
+
+    Args:
+        file: Output stream, stdout by default.
+        interval: Minimum delay in seconds between two renderings on a terminal.
+        summary_interval: Delay in seconds between two summaries when file isn't a terminal.
+        live: Redraw the task lines in place, by default if file is a terminal.
+    """
+
+    def __init__(
+        self,
+        file: Optional[IO[str]] = None,
+        interval: float = 0.1,
+        summary_interval: float = 30.0,
+        live: Optional[bool] = None,
+    ):
+        self.file = file or sys.stdout
+        self.live = self.file.isatty() if live is None else live
+        self.interval = interval if self.live else summary_interval
+        self._tasks: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._rendered = 0
+        "Number of live lines currently displayed"
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "Progress":
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="untropy-progress", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the renderer, clearing the live lines."""
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._write(self._clear())
+
+    def update(self, task: str, message: str = ""):
+        """Set the message of task, added to the running tasks if new."""
+        with self._lock:
+            if self._tasks.get(task) != message:
+                self._tasks[task] = message
+                self._dirty = True
+
+    def finish(self, task: str):
+        """Remove task from the running tasks."""
+        with self._lock:
+            if self._tasks.pop(task, None) is not None:
+                self._dirty = True
+
+    def echo(self, message: str, nl: bool = True):
+        """Print message above the live lines."""
+        with self._lock:
+            output = self._clear() + message + ("\n" if nl else "")
+            if self.live and (not output or output.endswith("\n")):
+                output += self._lines()
+            self._write(output)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.render()
+
+    def render(self):
+        """Write the state of the tasks if it changed since the last rendering."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            self._write(self._clear() + self._lines() if self.live else self._summary())
+
+    def _clear(self) -> str:
+        if not self._rendered:
+            return ""
+        count, self._rendered = self._rendered, 0
+        return f"\033[{count}F\033[J"
+
+    def _lines(self) -> str:
+        width = shutil.get_terminal_size().columns
+        lines: List[str] = []
+        for task, message in self._tasks.items():
+            line = f"{task} {message}"[: max(width - len(PREFIX) - 1, 1)]
+            lines.append(click.style(PREFIX, fg="green", bold=True) + line + "\n")
+        self._rendered = len(lines)
+        return "".join(lines)
+
+    def _summary(self) -> str:
+        if not self._tasks:
+            return ""
+        running = ", ".join(f"{task} ({message})" if message else task for task, message in self._tasks.items())
+        return f"{PREFIX}{time.strftime('%H:%M:%S')} {len(self._tasks)} running: {running}\n"
+
+    def _write(self, output: str):
+        if output:
+            click.echo(output, file=self.file, nl=False, color=self.live or None)
+            self.file.flush()
@@ -12,8 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import logging
+import math
 import random
-from typing import List
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+from .files import atomic_write_text, file_lock
+
+logger = logging.getLogger("untropy")
+
+NEARLY_EXHAUSTED_RATIO = 0.9
 
 ADJECTIVES = [
     "baggy",
@@ -465,3 +475,127 @@ def generate_name(repeat_parts=False, separator="-", lists=(ADJECTIVES, ANIMALS)
             part = random.choice(lyst)
         name.append(part)
     return separator.join(name)
+
+
+def name_space_size(lists=(ADJECTIVES, ANIMALS)) -> int:
+    """Return the number of names that can be built from lists."""
+    return math.prod(len(lyst) for lyst in lists)
+
+
+def name_parts_at(index: int, lists=(ADJECTIVES, ANIMALS)) -> List[str]:
+    """Return the parts of the name at index in the product of lists.
+
+    :type index: int
+    :param index: Index of the name, between 0 and `name_space_size(lists)`.
+    """
+    name: List[str] = []
+    for lyst in reversed(lists):
+        index, position = divmod(index, len(lyst))
+        name.append(lyst[position])
+    name.reverse()
+    return name
+
+
+def name_at(index: int, separator="-", lists=(ADJECTIVES, ANIMALS)) -> str:
+    """Return the name at index in the product of lists."""
+    return separator.join(name_parts_at(index, lists))
+
+
+class NameAllocator:
+    """Allocate names that are unique across calls and processes.
+
+    Names are taken in the order of a seeded affine permutation of the
+    product of the lists, so each allocation is a cursor increment instead of
+    a rejection sampling. The seed and the cursor are stored in a state file
+    protected by a lock file. Once the product space is exhausted, names get
+    a numeric suffix (`-2`, `-3`, ...) and stay unique.
+
+    :type state_file: Path
+    :param state_file: Path of the JSON file storing the allocation state.
+    :type seed: int
+    :param seed: Seed of the permutation, used when the state file is
+                 created. A random one is used if not set.
+    :type repeat_parts: bool
+    :param repeat_parts: If set, do not ensure that each part of the name
+                         is unique to the name itself.
+    :type separator: str
+    :param separator: The string that is used to join each part of the name.
+    :type lists: list of lists
+    :param lists: The lists of words of each part of the name.
+    """
+
+    def __init__(
+        self,
+        state_file: Path,
+        seed: Optional[int] = None,
+        repeat_parts=False,
+        separator="-",
+        lists: Sequence[Sequence[str]] = (ADJECTIVES, ANIMALS),
+    ):
+        self.state_file = state_file
+        self.lock_file = state_file.with_suffix(".lock")
+        self.seed = seed
+        self.repeat_parts = repeat_parts
+        self.separator = separator
+        self.lists = lists
+        self.size = name_space_size(lists)
+
+    @classmethod
+    def for_workspace(cls, workspace: Path, namespace: str = "default", **kwargs) -> "NameAllocator":
+        """Return the allocator of namespace stored in the untropy workspace."""
+        return cls(workspace / "names" / f"{namespace}.json", **kwargs)
+
+    def permutation(self, seed: int) -> Tuple[int, int]:
+        """Return the (multiplier, offset) of the permutation `index -> (multiplier * index + offset) % size`."""
+        generator = random.Random(seed)
+        if self.size == 1:
+            return 1, 0
+        multiplier = generator.randrange(1, self.size)
+        while math.gcd(multiplier, self.size) != 1:
+            multiplier = generator.randrange(1, self.size)
+        return multiplier, generator.randrange(self.size)
+
+    def read_state(self) -> Tuple[int, int]:
+        try:
+            state = json.loads(self.state_file.read_text())
+            return state["seed"], state["cursor"]
+        except FileNotFoundError:
+            seed = self.seed if self.seed is not None else random.SystemRandom().randrange(2**32)
+            return seed, 0
+
+    def allocate(self, count: int = 1) -> List[str]:
+        """Allocate count new names.
+
+        :type count: int
+        :param count: Number of names to allocate.
+        :raises ValueError: If the lists can't build any name, without repeated
+                            parts unless repeat_parts is set.
+        """
+        names: List[str] = []
+        with file_lock(self.lock_file):
+            seed, cursor = self.read_state()
+            multiplier, offset = self.permutation(seed) if self.size else (1, 0)
+            start = cursor
+            rejected = 0
+            while len(names) < count:
+                if rejected >= self.size:  # a whole cycle without a name
+                    raise ValueError(
+                        f"No name can be built from the lists of {self.state_file.stem}"
+                        + ("" if self.repeat_parts else " without repeating a part, set repeat_parts")
+                    )
+                cycle, index = divmod(cursor, self.size)
+                cursor += 1
+                parts = name_parts_at((multiplier * index + offset) % self.size, self.lists)
+                if not self.repeat_parts and len(set(parts)) != len(parts):
+                    rejected += 1
+                    continue
+                rejected = 0
+                if cycle > 0:
+                    parts.append(str(cycle + 1))
+                names.append(self.separator.join(parts))
+            atomic_write_text(self.state_file, json.dumps({"seed": seed, "cursor": cursor}))
+
+        threshold = int(self.size * NEARLY_EXHAUSTED_RATIO)
+        if start < threshold <= cursor:
+            logger.warning(f"Name space of {self.state_file.stem} is nearly exhausted, suffixes will be added soon")
+        return names
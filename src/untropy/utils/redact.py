@@ -0,0 +1,221 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Redaction of secret values and URL credentials.
+
+Most of the output contains no secret: a chunk is first checked with
+`bytes.__contains__` (a C substring search running at several GB/s) for
+each secret and for `://`. Only the chunks with a candidate are rewritten:
+URL passwords by a regular expression starting with the literal `://`, and
+secrets by a single compiled regular expression whose alternatives are
+factored as a trie (`ab(?:c|d)` instead of `abc|abd`), so the regex engine
+walks each position once per shared prefix, like an Aho-Corasick automaton,
+instead of once per secret. Longer secrets are tried first so a secret
+containing another one is fully masked.
+"""
+
+import logging
+import re
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Pattern,
+    Union,
+)
+
+MASK = b"***"
+
+MIN_SECRET_LENGTH = 4
+"Shorter values would mask too much unrelated output"
+
+URL_CREDENTIALS = rb"(?P<prefix>://[^/\s:@]{1,256}:)[^/\s@]{1,256}(?=@)"
+"Password of an URL, the literal prefix makes the regex engine search it quickly"
+
+URL_MAX_LENGTH = 3 + 256 + 1 + 256
+
+SECRET_NAME_REGEX = re.compile(r"PASSWORD|PASSWD|SECRET|TOKEN|API_?KEY|PRIVATE_?KEY|CREDENTIAL", re.I)
+
+
+def secret_values(variables: Mapping[str, str]) -> List[str]:
+    """Return the values of the variables whose name looks like a secret."""
+    return [value for name, value in variables.items() if SECRET_NAME_REGEX.search(name)]
+
+
+Trie = Dict[Optional[int], "Trie"]
+"Bytes of the secrets, None marking the end of a secret"
+
+
+def _trie_pattern(trie: Trie) -> bytes:
+    alternatives = [re.escape(bytes([byte])) + _trie_pattern(child) for byte, child in trie.items() if byte is not None]
+    if not alternatives:
+        return b""
+    group = alternatives[0] if len(alternatives) == 1 else b"(?:" + b"|".join(alternatives) + b")"
+    if None in trie:  # a secret ends here, the longer ones are tried first
+        return b"(?:" + group + b")?"
+    return group
+
+
+def secrets_pattern(secrets: Iterable[bytes]) -> bytes:
+    """Return a regular expression matching any of secrets, factored as a trie."""
+    trie: Trie = {}
+    for secret in secrets:
+        node = trie
+        for byte in secret:
+            node = node.setdefault(byte, {})
+        node[None] = {}
+    return _trie_pattern(trie)
+
+
+class Redactor:
+    """Mask secret values and URL passwords.
+
+    Args:
+        secrets: Secret values, the ones shorter than MIN_SECRET_LENGTH are ignored.
+        urls: Also mask the passwords of URLs (`scheme://user:password@`).
+    """
+
+    def __init__(self, secrets: Iterable[str] = (), urls: bool = True):
+        values = {secret.encode() for secret in secrets if len(secret) >= MIN_SECRET_LENGTH and "\n" not in secret}
+        self.secrets = sorted(values, key=len, reverse=True)
+        self.urls = urls
+        secrets_regex = secrets_pattern(values) if values else None
+        self._url_pattern = re.compile(URL_CREDENTIALS) if urls else None
+        self._secrets_pattern = re.compile(secrets_regex) if secrets_regex else None
+        self._both_pattern = re.compile(URL_CREDENTIALS + b"|" + secrets_regex) if urls and secrets_regex else None
+        self.max_length = max([len(value) for value in values] + [URL_MAX_LENGTH if urls else 0])
+
+    @property
+    def enabled(self) -> bool:
+        return self.urls or bool(self.secrets)
+
+    def pattern(self, data: bytes) -> Optional[Pattern[bytes]]:
+        """Return the pattern to apply to data, None if data contains nothing to mask."""
+        secrets = any(secret in data for secret in self.secrets)
+        urls = self.urls and b"://" in data and b"@" in data
+        if secrets and urls:
+            return self._both_pattern
+        return self._secrets_pattern if secrets else self._url_pattern if urls else None
+
+    def _replace(self, match: "re.Match[bytes]") -> bytes:
+        prefix = match.groupdict().get("prefix")
+        return prefix + MASK if prefix is not None else MASK
+
+    def redact(self, data: bytes) -> bytes:
+        pattern = self.pattern(data)
+        return data if pattern is None else pattern.sub(self._replace, data)
+
+    def redact_text(self, text: str) -> str:
+        if not self.enabled:
+            return text
+        return self.redact(text.encode(errors="surrogateescape")).decode(errors="surrogateescape")
+
+    def stream(self) -> "StreamRedactor":
+        return StreamRedactor(self)
+
+
+class StreamRedactor:
+    """Redact a stream fed by chunks, masking the secrets split across chunks.
+
+    The end of a chunk that could be the beginning of a secret is kept until
+    the next chunk. Secrets and URLs never contain a newline, so complete
+    lines are never delayed.
+    """
+
+    def __init__(self, redactor: Redactor):
+        self.redactor = redactor
+        self.carry = b""
+
+    def feed(self, chunk: bytes) -> bytes:
+        """Return the redacted part of the stream that can't be changed by the next chunks."""
+        if not self.redactor.enabled:
+            return chunk
+        data = self.carry + chunk
+        limit = max(len(data) - self.redactor.max_length + 1, data.rfind(b"\n") + 1)
+        pattern = self.redactor.pattern(data)
+        if pattern is None:
+            self.carry = data[limit:]
+            return data[:limit]
+        output = []
+        position = 0
+        for match in pattern.finditer(data):
+            if match.start() >= limit:
+                break
+            output.append(data[position : match.start()])
+            output.append(self.redactor._replace(match))
+            position = match.end()
+        end = max(position, limit)
+        output.append(data[position:end])
+        self.carry = data[end:]
+        return b"".join(output)
+
+    def flush(self) -> bytes:
+        """Return the redacted end of the stream."""
+        data, self.carry = self.carry, b""
+        return self.redactor.redact(data)
+
+
+def redacted_lines(redactor: Redactor, chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Yield the redacted lines of chunks (the lines of a process output) as soon as they are complete."""
+    stream = redactor.stream()
+    for chunk in chunks:
+        yield from stream.feed(chunk).splitlines(keepends=True)
+    yield from stream.flush().splitlines(keepends=True)
+
+
+class RedactingFilter(logging.Filter):
+    """Logging filter redacting the messages of the records.
+
+    Args:
+        redactor: Redactor, or function returning it, called at the first
+            record (the secrets may be costly to resolve).
+    """
+
+    def __init__(self, redactor: Union[Redactor, Callable[[], Redactor]]):
+        super().__init__()
+        self._redactor = redactor
+
+    @property
+    def redactor(self) -> Redactor:
+        if not isinstance(self._redactor, Redactor):
+            factory, self._redactor = self._redactor, Redactor()  # for the records logged while resolving
+            try:
+                self._redactor = factory()
+            except Exception:  # the command reports the configuration errors, not the logging
+                pass
+        return self._redactor
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        redacted = self.redactor.redact_text(message)
+        if redacted != message:
+            record.msg = redacted
+            record.args = ()
+        return True
+
+
+def install_log_filter(redactor: Union[Redactor, Callable[[], Redactor]], logger: Optional[logging.Logger] = None):
+    """Redact the records of all the handlers of logger, of all the configured loggers by default."""
+    if logger is not None:
+        loggers = [logger]
+    else:
+        configured = logging.Logger.manager.loggerDict.values()
+        loggers = [logging.getLogger()] + [item for item in configured if isinstance(item, logging.Logger)]
+    for handler in {handler for item in loggers for handler in item.handlers}:
+        for existing in [item for item in handler.filters if isinstance(item, RedactingFilter)]:
+            handler.removeFilter(existing)
+        handler.addFilter(RedactingFilter(redactor))
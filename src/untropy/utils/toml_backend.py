@@ -0,0 +1,119 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""TOML parsing backends.
+
+The fastest available parser is used: `tomli` (compiled wheels are much
+faster than the standard library), then `tomllib` (python >= 3.11), then the
+pure python `toml` package. `UNTROPY_TOML_BACKEND` forces
+one of them. The backend is selected when the first document is parsed, so a
+bad `UNTROPY_TOML_BACKEND` is reported as a configuration error. All backends
+return plain dicts and lists, and timezone aware datetimes use
+`datetime.timezone`.
+"""
+
+import datetime
+import functools
+import importlib
+import os
+from pathlib import Path
+from typing import IO, Any, Callable, Dict, List, MutableMapping, Optional, Union, cast
+
+BACKEND_NAMES = ["tomli", "tomllib", "toml"]
+
+TomlDecodeError = ValueError
+"Base class of the errors raised by all the backends"
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    elif isinstance(value, list):
+        return [_normalize(item) for item in value]
+    elif isinstance(value, (datetime.datetime, datetime.time)) and value.tzinfo is not None:
+        offset = value.utcoffset()
+        return value if offset is None else value.replace(tzinfo=datetime.timezone(offset))
+    return value
+
+
+def _toml_loads(text: str) -> MutableMapping[str, Any]:
+    import toml
+
+    return _normalize(toml.loads(text))
+
+
+@functools.lru_cache(maxsize=None)
+def backend_loads(name: str) -> Callable[[str], MutableMapping[str, Any]]:
+    """Return the loads function of backend name, raise ImportError if it isn't installed."""
+    if name == "toml":
+        importlib.import_module("toml")
+        return _toml_loads
+    return importlib.import_module(name).loads
+
+
+def available_backends() -> List[str]:
+    result = []
+    for name in BACKEND_NAMES:
+        try:
+            backend_loads(name)
+            result.append(name)
+        except ImportError:
+            pass
+    return result
+
+
+@functools.lru_cache(maxsize=None)
+def selected_backend() -> str:
+    """Return the name of the backend used to parse the documents.
+
+    Raises UntropyConfigurationError if `UNTROPY_TOML_BACKEND` is unknown or not installed.
+    """
+    from ..config.model import UntropyConfigurationError
+
+    forced = os.getenv("UNTROPY_TOML_BACKEND")
+    if forced:
+        if forced not in BACKEND_NAMES:
+            raise UntropyConfigurationError(
+                f"Unknown UNTROPY_TOML_BACKEND {forced}. Possible values: {', '.join(BACKEND_NAMES)}"
+            )
+        try:
+            backend_loads(forced)
+        except ImportError as error:
+            raise UntropyConfigurationError(f"UNTROPY_TOML_BACKEND {forced} is not installed: {error}") from error
+        return forced
+    return default_backend()
+
+
+def default_backend() -> str:
+    """Return the name of the fastest installed backend, whatever `UNTROPY_TOML_BACKEND` is."""
+    for name in BACKEND_NAMES:
+        try:
+            backend_loads(name)
+            return name
+        except ImportError:
+            pass
+    raise ImportError("No TOML parser available, install tomli or toml")
+
+
+def loads(text: str, backend: Optional[str] = None) -> Dict[str, Any]:
+    """Parse a TOML document, with backend or the selected one."""
+    return cast(Dict[str, Any], backend_loads(backend or selected_backend())(text))
+
+
+def load(source: Union[str, Path, IO[str], IO[bytes]]) -> Dict[str, Any]:
+    """Parse a TOML document from a path or an opened file (text or binary)."""
+    if isinstance(source, (str, Path)):
+        with open(source, "rb") as file:
+            return loads(file.read().decode("utf-8"))
+    content = source.read()
+    return loads(content.decode("utf-8") if isinstance(content, bytes) else content)
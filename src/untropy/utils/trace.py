@@ -0,0 +1,96 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Spans of the untropy phases, written as a Chrome trace file.
+
+The trace is viewable in https://ui.perfetto.dev or chrome://tracing. When
+tracing is disabled, `span` returns a shared null context manager. Startup
+phases (imports, logging setup) happen before the command line is parsed:
+they are always recorded with `record` and only written if tracing is enabled
+afterwards.
+"""
+
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, ContextManager, Dict, Iterator, List, Optional
+
+IMPORT_START = time.perf_counter_ns()
+"Time of the first untropy import, when this module is imported"
+
+_events: List[Dict[str, Any]] = []
+_path: Optional[Path] = None
+_null_span: ContextManager[None] = contextlib.nullcontext()
+
+
+def enabled() -> bool:
+    return _path is not None
+
+
+def record(name: str, start: int, end: Optional[int] = None, **args: Any):
+    """Record a span from start to end (now by default), in `time.perf_counter_ns` nanoseconds."""
+    end = time.perf_counter_ns() if end is None else end
+    event = {
+        "name": name,
+        "ph": "X",
+        "ts": start / 1000,
+        "dur": (end - start) / 1000,
+        "pid": os.getpid(),
+        "tid": threading.get_ident(),
+    }
+    if args:
+        event["args"] = {key: str(value) for key, value in args.items()}
+    _events.append(event)  # atomic, spans can end in several threads
+
+
+@contextlib.contextmanager
+def _span(name: str, args: Dict[str, Any]) -> Iterator[None]:
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        record(name, start, **args)
+
+
+def span(name: str, **args: Any) -> ContextManager[None]:
+    """Return a context manager recording a span named name if tracing is enabled."""
+    if _path is None:
+        return _null_span
+    return _span(name, args)
+
+
+def enable(path: Path):
+    """Enable tracing, the trace is written to path at exit or by `flush`."""
+    global _path
+    if _path is None:
+        atexit.register(flush)
+    _path = path
+
+
+def flush():
+    """Write the trace file, before the process exits or is replaced."""
+    if _path is None:
+        return
+    names = [
+        {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread.ident, "args": {"name": thread.name}}
+        for thread in threading.enumerate()
+    ]
+    content = {"traceEvents": names + sorted(_events, key=lambda event: event["ts"]), "displayTimeUnit": "ms"}
+    try:
+        _path.write_text(json.dumps(content))
+    except OSError:
+        pass
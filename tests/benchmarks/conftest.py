@@ -0,0 +1,124 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark fixtures.
+
+Benchmarks run with the rest of the test suite (`-m "not benchmark"` skips them).
+Results are written as JSON with `--benchmark-json=FILE` and compared with a
+previous run with `--benchmark-baseline=FILE`: a benchmark fails when its
+median is more than `--benchmark-threshold` times the baseline one.
+"""
+
+import json
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import pytest
+
+RESULTS: Dict[str, Dict[str, Any]] = {}
+
+
+class Benchmark:
+    def __init__(self, baseline: Dict[str, Any], threshold: float):
+        self.baseline = baseline
+        self.threshold = threshold
+
+    def __call__(self, name: str, function: Callable[[], Any], rounds: int = 5, warmup: int = 1) -> Any:
+        """Time rounds calls of function, record the result under name and return the last result."""
+        result = None
+        for _ in range(warmup):
+            result = function()
+
+        timings: List[float] = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            result = function()
+            timings.append(time.perf_counter() - start)
+
+        median = statistics.median(timings)
+        RESULTS[name] = {"median": median, "min": min(timings), "max": max(timings), "rounds": rounds}
+
+        reference = self.baseline.get(name)
+        if reference is not None and median > reference["median"] * self.threshold:
+            pytest.fail(
+                f"Benchmark {name} regressed: median {median * 1000:.2f}ms"
+                f" > {self.threshold} x baseline {reference['median'] * 1000:.2f}ms"
+            )
+        return result
+
+
+@pytest.fixture(scope="session")
+def benchmark(request) -> Benchmark:
+    baseline_path = request.config.getoption("benchmark_baseline")
+    baseline = json.loads(Path(baseline_path).read_text())["results"] if baseline_path else {}
+    return Benchmark(baseline, request.config.getoption("benchmark_threshold"))
+
+
+def pytest_sessionfinish(session):
+    path = session.config.getoption("benchmark_json")
+    if path and RESULTS:
+        document = {
+            "python": sys.version,
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "results": RESULTS,
+        }
+        Path(path).write_text(json.dumps(document, indent=2, sort_keys=True))
+
+
+def write_configuration(directory: Path, variables: int = 0, **settings: str) -> Path:
+    """Write an untropy.toml file with the given number of variables."""
+    lines = [f'{key} = "{value}"' for key, value in settings.items()]
+    if variables:
+        lines.append("[variables]")
+        lines.extend(f'VARIABLE_{index} = "value-{index}"' for index in range(variables))
+    path = directory / "untropy.toml"
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+
+@pytest.fixture(scope="session")
+def deep_tree(tmp_path_factory) -> Path:
+    """Project whose configuration is 40 directories above the returned one."""
+    root = tmp_path_factory.mktemp("deep")
+    write_configuration(root, env="deep_dev")
+    leaf = root.joinpath(*(f"level{index}" for index in range(40)))
+    leaf.mkdir(parents=True)
+    return leaf
+
+
+@pytest.fixture(scope="session")
+def large_project(tmp_path_factory) -> Path:
+    """Project with 5000 variables."""
+    root = tmp_path_factory.mktemp("large")
+    write_configuration(root, variables=5000, env="large_dev")
+    return root
+
+
+@pytest.fixture(scope="session")
+def large_cookie(tmp_path_factory) -> Path:
+    """Cookie template with 200 templated files."""
+    root = tmp_path_factory.mktemp("cookies")
+    cookie = root / "large"
+    template = cookie / "{{ cookiecutter.project_slug }}"
+    template.mkdir(parents=True)
+    (cookie / "cookiecutter.json").write_text(json.dumps({"project_slug": "large", "env": "large_dev"}))
+    for index in range(200):
+        (template / f"file_{index}.txt").write_text(
+            "{% for i in range(20) %}{{ cookiecutter.project_slug }}-{{ cookiecutter.env }}-{{ i }}\n{% endfor %}"
+        )
+    return cookie
@@ -0,0 +1,37 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytestmark = pytest.mark.benchmark
+
+
+def run_untropy(*args: str, cwd=None):
+    environment = dict(os.environ)
+    environment.pop("UNTROPY_HOME", None)
+    subprocess.run([sys.executable, "-m", "untropy", *args], cwd=cwd, env=environment, check=True, capture_output=True)
+
+
+def test_cold_version(benchmark):
+    benchmark("cli.cold.version", lambda: run_untropy("--version"), rounds=3)
+
+
+def test_cold_env_show(benchmark, large_project):
+    benchmark(
+        "cli.cold.env_show", lambda: run_untropy("env", "--show", "--format", "json", cwd=large_project), rounds=3
+    )
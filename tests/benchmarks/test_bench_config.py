@@ -0,0 +1,47 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import yaml
+
+from untropy.cli.env import to_json
+from untropy.config import load_configuration
+
+pytestmark = pytest.mark.benchmark
+
+
+def test_load_deep_tree(benchmark, deep_tree):
+    settings = benchmark("config.load.deep_tree", lambda: load_configuration(deep_tree), rounds=20)
+    assert settings.env == "deep_dev"
+
+
+def test_load_large_configuration(benchmark, large_project):
+    settings = benchmark("config.load.large", lambda: load_configuration(large_project))
+    assert settings.variables is not None and len(settings.variables) == 5000
+
+
+def test_shell_environment(benchmark, large_project):
+    settings = load_configuration(large_project)
+    environment = benchmark("config.shell_environment.large", lambda: settings.shell_environment, rounds=20)
+    assert environment["UNTROPY_ENV"] == "large_dev"
+
+
+def test_to_json(benchmark, large_project):
+    settings = load_configuration(large_project)
+    benchmark("env.to_json.large", lambda: to_json(settings.internal_vars))
+
+
+def test_yaml_dump(benchmark, large_project):
+    settings = load_configuration(large_project)
+    benchmark("env.yaml_dump.large", lambda: yaml.dump(settings.internal_vars), rounds=3)
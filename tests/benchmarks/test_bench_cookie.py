@@ -0,0 +1,36 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+from cookiecutter.main import cookiecutter
+
+pytestmark = pytest.mark.benchmark
+
+
+def test_cookie_generation(benchmark, large_cookie, tmp_path):
+    config_file = tmp_path / "cookiecutter.yaml"
+    config_file.write_text(f"replay_dir: {tmp_path / 'replay'}\ncookiecutters_dir: {tmp_path / 'cookiecutters'}\n")
+    output_dir = tmp_path / "output"
+
+    def generate():
+        return cookiecutter(
+            str(large_cookie),
+            no_input=True,
+            output_dir=str(output_dir),
+            overwrite_if_exists=True,
+            config_file=str(config_file),
+        )
+
+    benchmark("cookie.generate.large", generate, rounds=3)
+    assert len(list((output_dir / "large").iterdir())) == 200
@@ -0,0 +1,27 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from untropy.utils.toml_backend import available_backends, backend_loads
+
+pytestmark = pytest.mark.benchmark
+
+
+@pytest.mark.parametrize("backend", available_backends())
+def test_parse_large_configuration(benchmark, large_project, backend):
+    loads = backend_loads(backend)
+    text = (large_project / "untropy.toml").read_text()
+    settings = benchmark(f"toml.loads.large.{backend}", lambda: loads(text))
+    assert len(settings["variables"]) == 5000
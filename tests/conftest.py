@@ -11,3 +11,37 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("untropy benchmarks")
+    group.addoption(
+        "--benchmark-json",
+        default=os.getenv("UNTROPY_BENCHMARK_JSON"),
+        help="Write benchmark results to this JSON file",
+    )
+    group.addoption(
+        "--benchmark-baseline",
+        default=os.getenv("UNTROPY_BENCHMARK_BASELINE"),
+        help="Compare benchmark results with this JSON file",
+    )
+    group.addoption(
+        "--benchmark-threshold",
+        type=float,
+        default=float(os.getenv("UNTROPY_BENCHMARK_THRESHOLD", "1.5")),
+        help="Maximum ratio between a benchmark median and its baseline (default: 1.5)",
+    )
+
+
+def pytest_configure(config):
+    # the manifest, completion and hook caches must not be written to the user cache directory
+    config.untropy_cache_home = tempfile.mkdtemp(prefix="untropy-cache-")
+    os.environ["XDG_CACHE_HOME"] = config.untropy_cache_home
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(config.untropy_cache_home, ignore_errors=True)
@@ -0,0 +1,62 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+
+from untropy.utils.artifacts import ArtifactStore
+
+
+def test_fetch_and_materialize(tmp_path):
+    source = tmp_path / "provider.zip"
+    source.write_bytes(b"provider" * 100)
+    store = ArtifactStore(tmp_path / "store", max_size=10**6)
+
+    digest = store.fetch(source.as_uri())
+    assert digest == hashlib.sha256(source.read_bytes()).hexdigest()
+    assert store.fetch(source.as_uri()) == digest
+
+    destination = tmp_path / "project" / ".terraform" / "provider.zip"
+    store.materialize(digest, destination)
+    assert destination.read_bytes() == source.read_bytes()
+    assert not destination.samefile(store.blob_path(digest))
+
+    stats = store.stats()
+    assert (stats.hits, stats.misses, stats.blobs) == (1, 1, 1)
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    store = ArtifactStore(tmp_path / "store", max_size=250)
+    digests = []
+    for name in "abc":
+        path = tmp_path / name
+        path.write_bytes(name.encode() * 100)
+        digests.append(store.fetch(path.as_uri()))
+        if name == "b":
+            store.lookup(digest=digests[0])
+
+    assert not store.blob_path(digests[1]).exists()
+    assert store.blob_path(digests[0]).exists() and store.blob_path(digests[2]).exists()
+    assert store.stats().evictions == 1
+
+
+def test_fetch_materializes_before_eviction(tmp_path):
+    store = ArtifactStore(tmp_path / "store", max_size=150)
+    for name in "ab":
+        path = tmp_path / name
+        path.write_bytes(name.encode() * 100)
+        store.fetch(path.as_uri(), destination=tmp_path / "project" / name)
+
+    assert store.stats().evictions == 1
+    assert (tmp_path / "project" / "a").read_bytes() == b"a" * 100
+    assert (tmp_path / "project" / "b").read_bytes() == b"b" * 100
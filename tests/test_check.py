@@ -0,0 +1,59 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from click.testing import CliRunner
+
+from untropy.cli import cli
+from untropy.config.check import check_projects
+from untropy.config.index import ProjectIndex
+
+
+def test_check_projects(tmp_path):
+    for name, env in [("valid", "valid_dev"), ("unsplittable", "invalid"), ("tier", "tier_unknown")]:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "untropy.toml").write_text(f'env = "{env}"\n')
+    (tmp_path / "overrides").mkdir()
+    (tmp_path / "overrides" / "untropy.toml").write_text(
+        'env = "valid_dev"\n[environments.valid_prod]\n[environments.other_dev.cache]\nmax_size = "big"\n'
+    )
+    (tmp_path / ".hidden").mkdir()
+    (tmp_path / ".hidden" / "untropy.toml").write_text('env = "hidden"\n')
+
+    projects = ProjectIndex(tmp_path, path=tmp_path / "index.json").update()
+    assert [project.path.name for project in projects] == ["overrides", "tier", "unsplittable", "valid"]
+    paths = [project.path / "untropy.toml" for project in projects]
+
+    results = {result.path: result for result in check_projects(paths, jobs=2)}
+    assert results[str(tmp_path / "valid" / "untropy.toml")].ok
+    assert "env: Environment name" in results[str(tmp_path / "unsplittable" / "untropy.toml")].errors[0]
+    assert "Bad value for: unknown" in results[str(tmp_path / "tier" / "untropy.toml")].errors[0]
+    errors = results[str(tmp_path / "overrides" / "untropy.toml")].errors
+    assert len(errors) == 1
+    assert errors[0].startswith("environments.other_dev: Invalid settings of environment other_dev")
+
+
+def test_check_command_with_invalid_configuration(tmp_path, monkeypatch):
+    monkeypatch.setenv("UNTROPY_WORKSPACE", str(tmp_path / "workspace"))
+    (tmp_path / "untropy.toml").write_text('env = "invalid"\n[projects]\nprune = ["ignored"]\n')
+    for name in ["valid", "ignored"]:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "untropy.toml").write_text('env = "valid_dev"\n')
+    monkeypatch.chdir(tmp_path)
+
+    result = CliRunner().invoke(cli, ["check", "."])
+    assert result.exit_code == 1, result.output
+    assert "✘ untropy.toml" in result.output
+    assert "✔ valid/untropy.toml" in result.output
+    assert "ignored" not in result.output
+    assert "2 project(s) checked, 1 failed" in result.output
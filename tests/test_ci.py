@@ -0,0 +1,165 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import subprocess
+
+import pytest
+
+from untropy.ci.affected import PathTrie, affected_services
+from untropy.ci.scheduler import StageScheduler
+from untropy.ci.stage_cache import FileHasher, LocalDirectoryBackend, StageCache
+from untropy.config.model import UntropyConfigurationError, UntropySettings
+
+
+def make_settings(tmp_path, services):
+    return UntropySettings(home=tmp_path, env="ci_dev", services=services)
+
+
+def test_stages_respect_dependencies(tmp_path):
+    log = tmp_path / "log"
+    services = {
+        name: {
+            "depends_on": depends_on,
+            "package": f"echo {name}:package >> {log}",
+            "deploy": f"echo {name}:deploy >> {log}",
+        }
+        for name, depends_on in [("lib", []), ("api", ["lib"]), ("web", ["api"])]
+    }
+    results = StageScheduler(make_settings(tmp_path, services), ["web", "api", "lib"], ["package", "deploy"]).run()
+
+    assert all(result.status == "success" for result in results)
+    lines = log.read_text().split()
+    for first, second in [("lib", "api"), ("api", "web")]:
+        for stage in ["package", "deploy"]:
+            assert lines.index(f"{first}:{stage}") < lines.index(f"{second}:{stage}")
+        assert lines.index(f"{first}:package") < lines.index(f"{first}:deploy")
+
+
+def test_failure_skips_dependents(tmp_path):
+    services = {"lib": {"build": "exit 1"}, "api": {"depends_on": ["lib"], "build": "true"}, "web": {"build": "true"}}
+    scheduler = StageScheduler(make_settings(tmp_path, services), ["lib", "api", "web"], ["build"], fail_fast=False)
+    statuses = {result.service: result.status for result in scheduler.run()}
+    assert statuses == {"lib": "failed", "api": "skipped", "web": "success"}
+
+
+def test_task_error_skips_only_dependents(tmp_path, monkeypatch):
+    services = {
+        "lib": {"build": "true", "cache": {"build": {"inputs": ["*"]}}},
+        "api": {"depends_on": ["lib"], "build": "true"},
+        "web": {"build": "true"},
+    }
+    cache = StageCache(LocalDirectoryBackend(tmp_path / "stages"), FileHasher(tmp_path / "digests.json"))
+
+    def restore(*args):
+        raise OSError("stage cache unavailable")
+
+    monkeypatch.setattr(cache, "restore", restore)
+    settings = make_settings(tmp_path, services)
+    scheduler = StageScheduler(settings, ["lib", "api", "web"], ["build"], fail_fast=False, cache=cache)
+    statuses = {result.service: result.status for result in scheduler.run()}
+    assert statuses == {"lib": "failed", "api": "skipped", "web": "success"}
+
+
+def test_circular_dependencies(tmp_path):
+    services = {"a": {"depends_on": ["b"]}, "b": {"depends_on": ["a"]}}
+    with pytest.raises(UntropyConfigurationError):
+        StageScheduler(make_settings(tmp_path, services), ["a", "b"], ["build"])
+
+
+def test_path_trie_longest_prefix():
+    trie = PathTrie()
+    trie.insert("services/api", "api")
+    trie.insert("services/api/plugins", "plugins")
+    assert trie.owner("services/api/main.py") == "api"
+    assert trie.owner("services/api/plugins/x/y.py") == "plugins"
+    assert trie.owner("services/apis/main.py") is None
+    assert trie.owner("README.md") is None
+
+
+def test_affected_services(tmp_path):
+    def git(*args):
+        subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@test", *args], cwd=tmp_path, check=True)
+
+    for name in ["lib", "api", "web", "docs"]:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "main.txt").write_text(name)
+    (tmp_path / "untropy.toml").write_text("")
+    git("init", "-q")
+    git("add", ".")
+    git("commit", "-q", "-m", "base")
+    services = {
+        "lib": {"path": "lib"},
+        "api": {"path": "api", "depends_on": ["lib"]},
+        "web": {"path": "web", "depends_on": ["api"]},
+        "docs": {"path": "docs"},
+    }
+    settings = make_settings(tmp_path, services)
+
+    assert affected_services(settings, "HEAD") == set()
+    (tmp_path / "api" / "main.txt").write_text("changed")
+    assert affected_services(settings, "HEAD") == {"api", "web"}
+    git("commit", "-q", "-am", "api")
+    (tmp_path / "lib" / "main.txt").write_text("changed")
+    assert affected_services(settings, "HEAD~1") == {"lib", "api", "web"}
+    (tmp_path / "untropy.toml").write_text("# changed")
+    assert affected_services(settings, "HEAD") == {"lib", "api", "web", "docs"}
+
+
+def test_stage_cache(tmp_path):
+    project = tmp_path / "project"
+    (project / "src").mkdir(parents=True)
+    (project / "src" / "main.txt").write_text("v1")
+    counter = tmp_path / "counter"
+    services = {
+        "api": {
+            "build": f"echo run >> {counter}; mkdir -p dist; cat src/main.txt > dist/out.txt; echo built",
+            "cache": {"build": {"inputs": ["src/**/*.txt"], "outputs": ["dist"], "environment": ["PATH"]}},
+        }
+    }
+    settings = make_settings(project, services)
+    cache = StageCache(LocalDirectoryBackend(tmp_path / "stages"), FileHasher(tmp_path / "digests.json"))
+
+    def run():
+        return StageScheduler(settings, ["api"], ["build"], cache=cache).run()[0].status
+
+    assert run() == "success"
+    assert run() == "cached"
+    (project / "dist").rename(tmp_path / "removed")
+    assert run() == "cached"
+    assert (project / "dist" / "out.txt").read_text() == "v1"
+    (project / "src" / "main.txt").write_text("v2")
+    assert run() == "success"
+    assert counter.read_text().split() == ["run", "run"]
+
+
+def test_stage_cache_keeps_outputs_missing_from_entry(tmp_path):
+    project = tmp_path / "project"
+    project.mkdir()
+    services = {
+        "api": {
+            "build": "mkdir -p dist; echo built > dist/out.txt",
+            "cache": {"build": {"outputs": ["dist", "report.txt"], "environment": ["PATH"]}},
+        }
+    }
+    settings = make_settings(project, services)
+    cache = StageCache(LocalDirectoryBackend(tmp_path / "stages"), FileHasher(tmp_path / "digests.json"))
+
+    def run():
+        return StageScheduler(settings, ["api"], ["build"], cache=cache).run()[0].status
+
+    assert run() == "success"
+    (project / "report.txt").write_text("local")
+    assert run() == "cached"
+    assert (project / "report.txt").read_text() == "local"
+    assert (project / "dist" / "out.txt").read_text() == "built\n"
@@ -0,0 +1,65 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+
+from untropy.cli import cli
+from untropy.utils.completion import completion_lines
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    path = tmp_path / "completion"
+    monkeypatch.setenv("UNTROPY_COMPLETION_CACHE", str(path))
+    monkeypatch.setenv("UNTROPY_WORKSPACE", str(tmp_path / "workspace"))
+    project = tmp_path / "project"
+    (project / "sub").mkdir(parents=True)
+    (project / "untropy.toml").write_text('env = "api_dev"\n')
+    monkeypatch.chdir(project)
+    return path
+
+
+def test_completion_lines_keep_other_projects():
+    current = ["command\told", "env\t/a\ta_dev", "env\t/b\tb_dev", "env\t/b\tb_prod"]
+    lines = completion_lines(current, ["env", "ci"], ["service"], Path("/b"), ["b_test"])
+    assert lines == ["command\tci", "command\tenv", "cookie\tservice", "env\t/a\ta_dev", "env\t/b\tb_test"]
+    assert completion_lines(lines, ["env", "ci"], ["service"], Path("/a"), ["a_dev"]) == lines
+
+
+def test_invocation_records_completion(cache, tmp_path):
+    result = CliRunner().invoke(cli, ["env", "-l"])
+    assert result.exit_code == 0
+    lines = cache.read_text().splitlines()
+    assert "command\tcompletion" in lines
+    assert f"env\t{(tmp_path / 'project').resolve()}\tapi_dev" in lines
+
+
+@pytest.mark.skipif(shutil.which("bash") is None, reason="bash is not installed")
+def test_bash_completion_reads_cache(cache, tmp_path):
+    CliRunner().invoke(cli, ["env", "-l"])
+    script = CliRunner().invoke(cli, ["completion", "bash"]).output
+    completions = {}
+    for words, index in [("untropy en", 1), ("untropy env ", 2)]:
+        test = f'COMP_WORDS=({words}); COMP_CWORD={index}; _untropy_cached_completion untropy; echo "${{COMPREPLY[@]}}"'
+        process = subprocess.run(
+            ["bash", "-c", script + "\n" + test], cwd=tmp_path / "project" / "sub", capture_output=True, text=True
+        )
+        completions[words] = process.stdout.split()
+    assert completions["untropy en"] == ["env"]
+    assert completions["untropy env "] == ["api_dev"]
@@ -12,9 +12,119 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from untropy.config import UntropySettings
+import click
+import pytest
+
+from untropy.config import UntropySettings, load, load_configuration
+from untropy.config.load import merged_settings
+from untropy.config.model import UntropyConfigurationError
 
 
 def test_dummy():
     settings = UntropySettings()
     assert settings.settings_filename == "untropy.toml"
+
+
+def test_extended_configuration(tmp_path, monkeypatch):
+    monkeypatch.setenv("UNTROPY_WORKSPACE", str(tmp_path / "workspace"))
+    (tmp_path / "untropy.toml").write_text(
+        'env = "root_dev"\n[domain]\nsuffix = "root.dev"\n[variables]\nA = "root"\nB = "root"\n'
+    )
+    project = tmp_path / "services" / "api"
+    project.mkdir(parents=True)
+    (project / "untropy.toml").write_text('extends = true\nenv = "api_dev"\n[variables]\nB = "api"\n')
+
+    settings = load_configuration(project)
+    assert settings.home == project
+    assert settings.env == "api_dev"
+    assert settings.domain.suffix == "root.dev"
+    assert settings.variables == {"A": "root", "B": "api"}
+    assert merged_settings(project / "untropy.toml").files == [tmp_path / "untropy.toml", project / "untropy.toml"]
+
+    (tmp_path / "untropy.toml").write_text('env = "root_dev"\n[variables]\nA = "changed"\n')
+    assert load_configuration(project).variables == {"A": "changed", "B": "api"}
+
+
+def test_extended_configuration_with_new_intermediate_file(tmp_path, monkeypatch):
+    monkeypatch.setenv("UNTROPY_WORKSPACE", str(tmp_path / "workspace"))
+    (tmp_path / "untropy.toml").write_text('[variables]\nA = "root"\n')
+    project = tmp_path / "a" / "b"
+    project.mkdir(parents=True)
+    (project / "untropy.toml").write_text("extends = true\n")
+    assert load_configuration(project).variables == {"A": "root"}
+
+    load._merged_settings.clear()
+    intermediate = tmp_path / "a" / "untropy.toml"
+    intermediate.write_text('extends = true\n[variables]\nA = "a"\n')
+    assert load_configuration(project).variables == {"A": "a"}  # workspace cache
+    intermediate.unlink()
+    assert load_configuration(project).variables == {"A": "root"}
+    intermediate.write_text('extends = true\n[variables]\nA = "a"\n')
+    assert load_configuration(project).variables == {"A": "a"}  # in-process cache
+
+
+def test_extended_configuration_not_found(tmp_path):
+    (tmp_path / "untropy.toml").write_text('extends = "missing/untropy.toml"\n')
+    with pytest.raises(click.ClickException):
+        load_configuration(tmp_path)
+
+
+def test_settings_are_immutable():
+    settings = UntropySettings(env="api_dev")
+    with pytest.raises(TypeError):
+        settings.env = "api_prod"
+    with pytest.raises(TypeError):
+        settings.ci_settings.command = "build"
+
+
+def test_registry_password_is_secret(monkeypatch):
+    monkeypatch.setenv("TWINE_PASSWORD", "s3cr3t-password")
+    settings = UntropySettings()
+    assert "password" not in settings.internal_vars["registry"]
+    assert "s3cr3t-password" in settings.secrets
+
+
+def test_ci_commit_tag(monkeypatch):
+    monkeypatch.setenv("CI_COMMIT_TAG", "deploy/api/api_prod")
+    settings = UntropySettings()
+    assert (settings.ci_settings.command, settings.ci_settings.service) == ("deploy", "api")
+    assert settings.env == "api_prod"
+
+
+def test_environment_views(monkeypatch):
+    monkeypatch.setattr(UntropySettings, "environment_names", property(lambda self: ["api_dev", "api_prod", "bad"]))
+    settings = UntropySettings(env="api_dev", variables={"A": "1"})
+    view = settings.for_environment("api_prod")
+    assert view is settings.for_environment("api_prod")
+    assert view.for_environment("api_dev") is settings
+    assert view.variables is settings.variables
+    assert view.shell_environment["DOCKER_IMAGE_TAG"] == "prod"
+    assert settings.shell_environment["DOCKER_IMAGE_TAG"] == "dev"
+    with pytest.raises(UntropyConfigurationError):
+        settings.for_environment("api_test")
+    with pytest.raises(UntropyConfigurationError, match="not in the form"):
+        settings.for_environment("bad")
+
+
+def test_environment_overrides(tmp_path, monkeypatch):
+    monkeypatch.setenv("UNTROPY_WORKSPACE", str(tmp_path / "workspace"))
+    monkeypatch.delenv("UNTROPY_ENV", raising=False)
+    (tmp_path / "untropy.toml").write_text(
+        'env = "api_dev"\n'
+        '[variables]\nA = "base"\nB = "base"\n'
+        '[environments.api_dev.variables]\nB = "dev"\n'
+        '[environments.api_prod]\nsuffix = ".json"\n[environments.api_prod.variables]\nA = "prod"\n'
+        '[environments.api_broken]\nservices = "not a table"\n'
+    )
+    settings = load_configuration(tmp_path)
+    assert settings.environment_names == ["api_dev", "api_prod", "api_broken"]
+    assert settings.variables == {"A": "base", "B": "dev"}
+
+    prod = settings.for_environment("api_prod")
+    assert prod is settings.for_environment("api_prod")
+    assert (prod.env, prod.suffix, prod.variables) == ("api_prod", ".json", {"A": "prod", "B": "base"})
+    assert prod.for_environment("api_dev") is settings
+    assert prod.for_environment("api_prod") is prod
+
+    with pytest.raises(UntropyConfigurationError, match="api_broken"):  # only validated when selected
+        settings.for_environment("api_broken")
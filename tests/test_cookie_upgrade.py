@@ -0,0 +1,118 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import importlib
+import json
+import os
+import shutil
+
+import pytest
+from click.testing import CliRunner
+
+from untropy.cli import cli
+from untropy.utils.artifacts import ArtifactStore
+from untropy.utils.cookie_upgrade import REPORT_NAME, upgrade_project, upgrade_projects
+from untropy.utils.cookies import RECORD_NAME, generate_cookie
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+
+
+def write_template(cookies_dir, files):
+    template = cookies_dir / "service"
+    shutil.rmtree(template, ignore_errors=True)
+    (template / "{{cookiecutter.name}}").mkdir(parents=True)
+    (template / "cookiecutter.json").write_text(json.dumps({"name": "demo"}))
+    for name, content in files.items():
+        (template / "{{cookiecutter.name}}" / name).write_text(content)
+
+
+@pytest.fixture
+def generated(tmp_path, monkeypatch):
+    (tmp_path / "cookiecutter.yaml").write_text(f"replay_dir: {tmp_path / 'replay'}\n")
+    monkeypatch.setenv("COOKIECUTTER_CONFIG", str(tmp_path / "cookiecutter.yaml"))
+    cookies_dir = tmp_path / "cookies"
+    write_template(
+        cookies_dir,
+        {
+            "README.md": "Hello {{cookiecutter.name}}\nline 2\nline 3\n",
+            "config.txt": "a=1\n",
+            "static.txt": "static\n",
+            "old.txt": "old\n",
+        },
+    )
+    store = ArtifactStore(tmp_path / "store", 10**9)
+    services = tmp_path / "services"
+    for name in ("first", "second"):
+        generate_cookie(cookies_dir, "service", str(services), {"name": name}, no_input=True, store=store)
+    return cookies_dir, store, services
+
+
+def test_upgrade_merges_template_changes(generated):
+    cookies_dir, store, services = generated
+    first, second = services / "first", services / "second"
+    assert json.loads((first / RECORD_NAME).read_text())["context"] == {"name": "first"}
+    (first / "README.md").write_text("Hello first\nline 2\nline 3 customized\n")
+    (second / "config.txt").write_text("a=2\n")
+    static_mtime = (first / "static.txt").stat().st_mtime_ns
+
+    write_template(
+        cookies_dir,
+        {
+            "README.md": "Hello {{cookiecutter.name}}!\nline 2\nline 3\n",
+            "config.txt": "a=3\n",
+            "static.txt": "static\n",
+            "new.txt": "new {{cookiecutter.name}}\n",
+        },
+    )
+    results = upgrade_projects([first, second], cookies_dir, store, jobs=2)
+
+    assert [result.status for result in results] == ["upgraded", "conflicts"]
+    assert results[0].changed == ["README.md", "config.txt", "new.txt", "old.txt"]
+    assert (first / "README.md").read_text() == "Hello first!\nline 2\nline 3 customized\n"
+    assert (first / "config.txt").read_text() == "a=3\n"
+    assert (first / "new.txt").read_text() == "new first\n"
+    assert not (first / "old.txt").exists()
+    assert (first / "static.txt").stat().st_mtime_ns == static_mtime
+    assert not (first / REPORT_NAME).exists()
+
+    assert results[1].conflicts == ["config.txt"]
+    assert "<<<<<<< project\na=2\n=======\na=3\n>>>>>>> template\n" in (second / "config.txt").read_text()
+    assert "config.txt" in (second / REPORT_NAME).read_text()
+
+    assert [result.status for result in upgrade_projects([first, second], cookies_dir, store, 2)] == ["up-to-date"] * 2
+
+
+def test_upgrade_keeps_template_modes(generated):
+    cookies_dir, store, services = generated
+    config = os.environ["COOKIECUTTER_CONFIG"]
+    write_template(cookies_dir, {"README.md": "Hello\n", "run.sh": "#!/bin/sh\n"})
+    (cookies_dir / "service" / "{{cookiecutter.name}}" / "run.sh").chmod(0o755)
+
+    result = upgrade_project(services / "first", cookies_dir, store.root, store.max_size)
+    assert result.status == "upgraded", result.message
+    assert (services / "first" / "run.sh").stat().st_mode & 0o777 == 0o755
+    assert os.environ["COOKIECUTTER_CONFIG"] == config
+
+
+def test_cookie_upgrade_command(generated, monkeypatch):
+    cookies_dir, store, services = generated
+    module = importlib.import_module("untropy.cli.cookie")  # the package attribute is the command
+    monkeypatch.setattr(module, "LOCAL_COOKIES_DIR", cookies_dir)
+    monkeypatch.setattr(module, "artifact_store", lambda settings: store)
+    write_template(cookies_dir, {"README.md": "Hello {{cookiecutter.name}}\n"})
+
+    result = CliRunner().invoke(cli, ["cookie-upgrade", "-j", "2", str(services)])
+    assert result.exit_code == 0, result.output
+    assert f"{services / 'first'} upgraded" in result.output
+    assert (services / "second" / "README.md").read_text() == "Hello second\n"
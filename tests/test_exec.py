@@ -0,0 +1,53 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import sys
+
+from click.testing import CliRunner
+
+from untropy.cli import cli
+
+
+def test_exec_each_runs_in_environment():
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        ["exec", "--each", "devops_dev", "--", sys.executable, "-c", "import os; print(os.environ['UNTROPY_TIER'])"],
+    )
+    assert result.exit_code == 0
+    assert "[devops_dev] dev" in result.output
+
+
+def test_exec_each_returns_failure_code():
+    runner = CliRunner()
+    result = runner.invoke(cli, ["exec", "--each", "devops_dev", "--", sys.executable, "-c", "exit(3)"])
+    assert result.exit_code == 3
+
+
+def test_exec_each_unknown_environment():
+    runner = CliRunner()
+    result = runner.invoke(cli, ["exec", "--each", "unknown_dev", "--", "true"])
+    assert result.exit_code == 1
+
+
+def test_exec_redacts_secrets(tmp_path, monkeypatch):
+    monkeypatch.setenv("UNTROPY_WORKSPACE", str(tmp_path / "workspace"))
+    (tmp_path / "untropy.toml").write_text('env = "api_dev"\n[variables]\nAPI_TOKEN = "s3cr3t-token"\n')
+    monkeypatch.chdir(tmp_path)
+    script = "import os, sys; print(os.environ['API_TOKEN']); sys.exit(2)"
+    result = CliRunner().invoke(cli, ["exec", "--redact", "--", sys.executable, "-c", script])
+    assert result.exit_code == 2
+    assert "s3cr3t-token" not in result.output
+    assert "***" in result.output
@@ -0,0 +1,74 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import subprocess
+
+import pytest
+from click.testing import CliRunner
+
+from untropy.cli import cli
+
+
+@pytest.mark.skipif(shutil.which("bash") is None, reason="bash is not installed")
+def test_bash_hook_switches_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("UNTROPY_HOOK_CACHE", str(tmp_path / "hook"))
+    monkeypatch.setenv("UNTROPY_WORKSPACE", str(tmp_path / "workspace"))
+    project = tmp_path / "project"
+    (project / "sub").mkdir(parents=True)
+    (project / "untropy.toml").write_text('[variables]\nGREETING = "hello world"\n')
+    (project / ".untropy").write_text("UNTROPY_ENV=api_prod\n")
+    script = CliRunner().invoke(cli, ["hook", "bash"]).output
+
+    def run(commands):
+        process = subprocess.run(["bash", "-c", script + commands], cwd=tmp_path, capture_output=True, text=True)
+        return process.stdout.splitlines()
+
+    show = '; echo "${UNTROPY_ENV:-none}|${GREETING:-none}"'
+    step = "; _untropy_hook" + show
+    assert run(f"cd {project}/sub{step}; cd {tmp_path}{step}") == ["api_prod|hello world", "none|none"]
+    cache = tmp_path / "hook" / (str(project).replace("/", "%") + ".sh")
+    assert cache.exists()
+
+    # a cache newer than the configuration is used as is, without running python
+    cache.write_text(cache.read_text().replace("hello world", "from cache"))
+    assert run(f"cd {project}{step}") == ["api_prod|from cache"]
+    (project / "untropy.toml").write_text("")
+    assert run(f"cd {project}{step}") == ["api_prod|none"]
+
+
+@pytest.mark.skipif(shutil.which("bash") is None, reason="bash is not installed")
+def test_bash_hook_resolves_provided_values_again(tmp_path, monkeypatch):
+    monkeypatch.setenv("UNTROPY_HOOK_CACHE", str(tmp_path / "hook"))
+    monkeypatch.setenv("UNTROPY_WORKSPACE", str(tmp_path / "workspace"))
+    project = tmp_path / "project"
+    project.mkdir()
+    (project / "untropy.toml").write_text(
+        'secrets_file = ".env"\n[variables]\nVERSION = "@file:version.txt"\nTOKEN = "@secret:TOKEN"\n'
+    )
+    (project / "version.txt").write_text("1\n")
+    (project / ".env").write_text("TOKEN=s3cr3t-value\n")
+    script = CliRunner().invoke(cli, ["hook", "bash"]).output
+
+    def run(commands):
+        process = subprocess.run(["bash", "-c", script + commands], cwd=tmp_path, capture_output=True, text=True)
+        return process.stdout.splitlines()
+
+    step = '; _untropy_hook; echo "${VERSION:-none}|${TOKEN:-none}"'
+    assert run(f"cd {project}{step}") == ["1|s3cr3t-value"]
+    (project / "version.txt").write_text("2\n")  # the file provider has no TTL, its value is not reused
+    assert run(f"cd {project}{step}") == ["2|s3cr3t-value"]
+    cache = (tmp_path / "hook" / (str(project).replace("/", "%") + ".sh")).read_text()
+    assert "s3cr3t-value" not in cache and "VERSION=" not in cache
+    assert run(f"cd {project}{step}; cd {tmp_path}{step}")[-1] == "none|none"
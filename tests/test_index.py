@@ -0,0 +1,40 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from untropy.config.index import ProjectIndex
+
+
+def write_project(directory, env):
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / "untropy.toml").write_text(f'env = "{env}"\n')
+
+
+def test_index_is_updated_incrementally(tmp_path):
+    root = tmp_path / "root"
+    write_project(root / "services" / "api", "api_dev")
+    write_project(root / "node_modules" / "lib", "lib_dev")
+    write_project(root / "generated" / "out", "out_dev")
+    (root / ".gitignore").write_text("# generated files\ngenerated/\n")
+    index_file = tmp_path / "index.json"
+
+    projects = ProjectIndex(root, path=index_file).update()
+    assert [(project.path, project.environments) for project in projects] == [(root / "services" / "api", ["api_dev"])]
+
+    write_project(root / "services" / "web", "web_prod")
+    (root / "services" / "api" / "untropy.toml").write_text('env = "api_test"\n')
+    projects = ProjectIndex(root, path=index_file).update()
+    assert [(project.path.name, project.environments) for project in projects] == [
+        ("api", ["api_test"]),
+        ("web", ["web_prod"]),
+    ]
@@ -0,0 +1,60 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import subprocess
+import sys
+
+from untropy import __version__
+from untropy.utils.manifest import startup_manifest
+
+
+def test_manifest_is_written_and_reused(tmp_path, monkeypatch):
+    path = tmp_path / "manifest.json"
+    monkeypatch.setenv("UNTROPY_MANIFEST", str(path))
+    startup_manifest.cache_clear()
+
+    manifest = startup_manifest()
+    assert manifest.version == __version__
+    assert path.exists()
+
+    content = json.loads(path.read_text())
+    content["version"] = "cached"
+    path.write_text(json.dumps(content))
+    startup_manifest.cache_clear()
+    assert startup_manifest().version == "cached"
+
+    content["stamp"] = ["stale"]
+    path.write_text(json.dumps(content))
+    startup_manifest.cache_clear()
+    assert startup_manifest().version == __version__
+    startup_manifest.cache_clear()
+
+
+def test_commands_are_imported_on_demand(tmp_path):
+    environment = {**os.environ, "UNTROPY_MANIFEST": str(tmp_path / "manifest.json")}
+    script = (
+        "import sys; from untropy.cli import cli; cli.main(['hook', 'bash'], standalone_mode=False);"
+        "print(' '.join(sorted(name for name in sys.modules if name.startswith('untropy.cli.'))), file=sys.stderr)"
+    )
+
+    def modules():
+        process = subprocess.run([sys.executable, "-c", script], env=environment, capture_output=True, text=True)
+        assert process.returncode == 0, process.stderr
+        return process.stderr.split()
+
+    assert "untropy.cli.publish" in modules()  # the first run records the command table
+    assert json.loads((tmp_path / "manifest.json").read_text())["commands"]["cookie-upgrade"] == "cookie"
+    assert modules() == ["untropy.cli.cli", "untropy.cli.hook"]
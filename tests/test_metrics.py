@@ -0,0 +1,121 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import socket
+import sys
+import threading
+import time
+
+import pytest
+from click.testing import CliRunner
+
+from untropy.cli import cli
+from untropy.utils import metrics
+from untropy.utils.files import file_lock
+
+
+@pytest.fixture
+def sink(monkeypatch):
+    monkeypatch.setattr(metrics, "_counters", {})
+    monkeypatch.setattr(metrics, "_histograms", {})
+    monkeypatch.setattr(atexit, "register", lambda function: None)
+
+    def configure(url):
+        monkeypatch.setattr(metrics, "_sink", None)
+        metrics.configure(url)
+
+    yield configure
+    metrics.configure(None)
+
+
+def test_disabled_records_nothing(sink):
+    sink(None)
+    metrics.increment("untropy_test_total")
+    assert not metrics._counters
+
+
+def test_concurrent_increments(sink, tmp_path):
+    sink(f"textfile://{tmp_path}")
+
+    def increment():
+        for _ in range(1000):
+            metrics.increment("untropy_test_total")
+
+    threads = [threading.Thread(target=increment) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert metrics._counters[("untropy_test_total", ())] == 8000
+
+
+def test_textfile_accumulates_commands(sink, tmp_path):
+    sink(f"textfile://{tmp_path}")
+    runner = CliRunner()
+    for code in [0, 0, 3]:
+        result = runner.invoke(cli, ["exec", "--each", "devops_dev", "--", sys.executable, "-c", f"exit({code})"])
+        assert result.exit_code == code
+        metrics.flush()
+
+    content = (tmp_path / "untropy.prom").read_text()
+    assert "# TYPE untropy_commands_total counter" in content
+    assert 'untropy_commands_total{command="exec",env="devops_dev",status="0"} 2' in content
+    assert 'untropy_commands_total{command="exec",env="devops_dev",status="3"} 1' in content
+    assert 'untropy_command_duration_seconds_count{command="exec",env="devops_dev"} 3' in content
+    assert 'untropy_command_duration_seconds_bucket{command="exec",env="devops_dev",le="+Inf"} 3' in content
+
+
+def test_textfile_spools_when_locked(sink, tmp_path):
+    sink(f"textfile://{tmp_path}")
+    with file_lock(tmp_path / ".untropy-metrics.lock"):
+        metrics.increment("untropy_test_total", env="a")
+        metrics.flush()
+    assert not (tmp_path / "untropy.prom").exists()
+    metrics.increment("untropy_test_total", env="a")
+    metrics.flush()
+    assert 'untropy_test_total{env="a"} 2' in (tmp_path / "untropy.prom").read_text()
+
+
+def test_statsd(sink):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.settimeout(5)
+        sink(f"statsd://127.0.0.1:{listener.getsockname()[1]}")
+        metrics.increment("untropy_cache_requests_total", cache="artifacts", result="hit")
+        metrics.observe("untropy_command_duration_seconds", 0.5, command="env", env="devops_dev")
+        metrics.flush()
+        lines = listener.recv(65536).decode().splitlines()
+    assert lines == [
+        "untropy_cache_requests_total.artifacts.hit:1|c",
+        "untropy_command_duration_seconds.env.devops_dev:500.000|ms",
+    ]
+
+
+def test_statsd_flush_does_not_wait_for_the_resolution(sink, monkeypatch):
+    resolved = threading.Event()
+    monkeypatch.setattr(metrics, "statsd_address", lambda host, port: resolved.wait(5) and ("127.0.0.1", port))
+    sink("statsd://slow.invalid:8125")
+    metrics.increment("untropy_test_total")
+    start = time.perf_counter()
+    metrics.flush()
+    assert time.perf_counter() - start < 1
+    resolved.set()
+
+
+def test_textfile_escapes_label_values(sink, tmp_path):
+    sink(f"textfile://{tmp_path}")
+    metrics.increment("untropy_test_total", env='a\\b"c\nd')
+    metrics.flush()
+    assert 'untropy_test_total{env="a\\\\b\\"c\\nd"} 1' in (tmp_path / "untropy.prom").read_text()
@@ -0,0 +1,71 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import threading
+
+from untropy.utils.progress import Progress
+
+
+def test_live_progress_coalesces_updates():
+    output = io.StringIO()
+    progress = Progress(output, live=True)
+    for index in range(1000):
+        progress.update("api:build", f"step {index}")
+    progress.update("web:build", "compiling")
+    progress.render()
+    progress.render()  # nothing changed
+    rendered = output.getvalue()
+    assert rendered.count("\n") == 2
+    assert "api:build step 999" in rendered and "step 998" not in rendered
+
+    progress.finish("api:build")
+    progress.echo("done")
+    assert output.getvalue()[len(rendered) :].startswith("\033[2F\033[Jdone\n")
+    assert output.getvalue().endswith("web:build compiling\n")
+    progress.stop()
+    assert output.getvalue().endswith("\033[1F\033[J")
+
+
+def test_plain_progress_writes_summaries():
+    output = io.StringIO()
+    progress = Progress(output, live=False)
+    progress.update("api:build", "compiling")
+    progress.update("web:build")
+    progress.echo("output line")
+    progress.render()
+    progress.render()
+    progress.stop()
+    lines = output.getvalue().splitlines()
+    assert lines[0] == "output line"
+    assert lines[1].endswith("2 running: api:build (compiling), web:build")
+    assert len(lines) == 2
+    assert "\033" not in output.getvalue()
+
+
+def test_progress_updates_from_threads():
+    output = io.StringIO()
+    with Progress(output, interval=0.001, live=True) as progress:
+
+        def work(name):
+            for index in range(500):
+                progress.update(name, str(index))
+            progress.finish(name)
+
+        threads = [threading.Thread(target=work, args=(f"task{index}",)) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert output.getvalue().count("\n") < 8 * 500
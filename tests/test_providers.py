@@ -0,0 +1,108 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import stat
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from untropy.config.model import UntropyConfigurationError, UntropySettings
+from untropy.config.providers import cache_path
+
+
+def project_settings(tmp_path, variables):
+    return UntropySettings(
+        home=tmp_path, workspace=tmp_path / "workspace", secrets_file="secrets.env", variables=variables
+    )
+
+
+def test_file_command_and_secret_providers(tmp_path):
+    (tmp_path / "version.txt").write_text("1.2.3\n")
+    (tmp_path / "secrets.env").write_text("DB_PASSWORD=s3cr3t\n")
+    variables = {
+        "VERSION": "@file:version.txt",
+        "BRANCH": "@cmd:echo main",
+        "DATABASE_PASSWORD": "@secret:DB_PASSWORD",
+        "LITERAL": "value",
+    }
+    environment = project_settings(tmp_path, variables).shell_environment
+    assert {name: environment[name] for name in variables} == {
+        "VERSION": "1.2.3",
+        "BRANCH": "main",
+        "DATABASE_PASSWORD": "s3cr3t",
+        "LITERAL": "value",
+    }
+
+
+def test_provided_values_are_cached(tmp_path):
+    variables = {"COUNT": "@cmd:echo run >> runs.txt && wc -l < runs.txt"}
+    assert project_settings(tmp_path, variables).shell_environment["COUNT"].strip() == "1"
+    assert project_settings(tmp_path, variables).shell_environment["COUNT"].strip() == "1"
+    path = cache_path(project_settings(tmp_path, variables))
+    assert stat.S_IMODE(path.stat().st_mode) == 0o600
+
+    path.write_text(json.dumps({key: [0, value] for key, (_, value) in json.loads(path.read_text()).items()}))
+    assert project_settings(tmp_path, variables).shell_environment["COUNT"].strip() == "2"
+
+
+def test_expired_values_are_resolved_again_in_process(tmp_path, monkeypatch):
+    settings = project_settings(tmp_path, {"COUNT": "@cmd:echo run >> runs.txt && wc -l < runs.txt"})
+    assert settings.shell_environment["COUNT"].strip() == "1"
+    assert settings.shell_environment["COUNT"].strip() == "1"
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 301)  # cmd TTL is 300 seconds
+    assert settings.shell_environment["COUNT"].strip() == "2"
+
+
+def test_provider_errors(tmp_path):
+    with pytest.raises(UntropyConfigurationError, match="Unknown provider"):
+        project_settings(tmp_path, {"A": "@vault:a"}).shell_environment
+    with pytest.raises(UntropyConfigurationError, match="Unable to resolve B with the cmd provider"):
+        project_settings(tmp_path, {"B": "@cmd:exit 3"}).shell_environment
+
+
+class KeyValueHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(0.3)
+        self.server.requests += 1  # type: ignore
+        body = json.dumps({"value": self.path.strip("/")}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_http_provider_fetches_concurrently(tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeyValueHandler)
+    server.requests = 0  # type: ignore
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        variables = {f"KEY{index}": f"@http:{url}/key{index}#value" for index in range(4)}
+        start = time.perf_counter()
+        environment = project_settings(tmp_path, variables).shell_environment
+        assert time.perf_counter() - start < 1.0
+        assert [environment[f"KEY{index}"] for index in range(4)] == ["key0", "key1", "key2", "key3"]
+
+        assert project_settings(tmp_path, variables).shell_environment["KEY0"] == "key0"
+        assert server.requests == 4  # type: ignore
+    finally:
+        server.shutdown()
+        server.server_close()
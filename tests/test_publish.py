@@ -0,0 +1,140 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import re
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from click.testing import CliRunner
+
+from untropy.ci.publish import Publisher
+from untropy.cli import cli
+from untropy.config.model import RegistrySettings
+
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    """Minimal registry: legacy upload API on /legacy/ and simple index on /simple/."""
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status: int, body: bytes = b""):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        registry = self.server.registry  # type: ignore
+        registry["connections"].add(self.client_address)
+        name = self.path.strip("/").split("/")[-1]
+        files = {file: digest for file, (project, digest) in registry["files"].items() if project == name}
+        if not files:
+            return self.reply(404)
+        links = "".join(f'<a href="/packages/{file}#sha256={digest}">{file}</a>' for file, digest in files.items())
+        self.reply(200, f"<html><body>{links}</body></html>".encode())
+
+    def do_POST(self):
+        registry = self.server.registry  # type: ignore
+        registry["connections"].add(self.client_address)
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+
+        def field(name: str) -> str:
+            match = re.search(rb'name="' + name.encode() + rb'"\r\n\r\n([^\r]*)', body)
+            assert match is not None
+            return match[1].decode()
+
+        match = re.search(rb'filename="([^"]+)"', body)
+        assert match is not None
+        file = match[1].decode()
+        with registry["lock"]:
+            if file in registry["unavailable"]:
+                registry["unavailable"].remove(file)
+                return self.reply(503)
+            if file in registry["files"]:
+                return self.reply(400, b"File already exists")
+            registry["files"][file] = (field("name").replace("_", "-"), field("sha256_digest"))
+        self.reply(200)
+
+
+@pytest.fixture
+def registry():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RegistryHandler)
+    state = {"files": {}, "unavailable": set(), "connections": set(), "lock": threading.Lock()}
+    server.registry = state  # type: ignore
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    settings = RegistrySettings(url=f"{url}/legacy/", retries=2)
+    yield settings, state
+    server.shutdown()
+    server.server_close()
+
+
+def make_wheel(directory, name, version):
+    path = directory / f"{name}-{version}-py3-none-any.whl"
+    with zipfile.ZipFile(path, "w") as wheel:
+        wheel.writestr(
+            f"{name}-{version}.dist-info/METADATA", f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n"
+        )
+        wheel.writestr(f"{name}-{version}.dist-info/WHEEL", "Wheel-Version: 1.0\nRoot-Is-Purelib: true\n")
+    return path
+
+
+def test_publish_skips_published_files_and_retries(tmp_path, registry):
+    settings, state = registry
+    wheels = [make_wheel(tmp_path, "my_lib", f"1.0.{index}") for index in range(6)]
+    state["files"][wheels[0].name] = ("my-lib", hashlib.sha256(wheels[0].read_bytes()).hexdigest())
+    state["unavailable"].add(wheels[1].name)
+
+    with Publisher(settings, jobs=3) as publisher:
+        results = publisher.publish(wheels)
+
+    assert [result.status for result in results] == ["skipped"] + ["uploaded"] * 5
+    assert len(state["files"]) == 6
+    assert len(state["connections"]) <= 4  # the connections are reused by the requests (1 GET and 6 POST)
+
+
+def test_publish_command(tmp_path, registry, monkeypatch):
+    settings, state = registry
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "dist").mkdir()
+    make_wheel(tmp_path / "dist", "other", "2.0")
+    arguments = ["publish", "--repository-url", settings.url]
+
+    result = CliRunner().invoke(cli, arguments)
+    assert result.exit_code == 0, result.output
+    assert "other-2.0-py3-none-any.whl uploaded" in result.output
+    assert "1 uploaded, 0 skipped, 0 failed" in result.output
+
+    result = CliRunner().invoke(cli, arguments)
+    assert "0 uploaded, 1 skipped, 0 failed" in result.output
+
+
+def test_registry_settings():
+    assert RegistrySettings().simple_index_url == "https://pypi.org/simple/"
+    assert RegistrySettings(url="https://test.pypi.org/legacy/").simple_index_url == "https://test.pypi.org/simple/"
+    assert RegistrySettings(url="https://host/pypi/", index_url="https://host/index/").simple_index_url == (
+        "https://host/index/"
+    )
+
+    registry = RegistrySettings(username="user", password="s3cr3t-password")
+    assert "s3cr3t-password" not in repr(registry)
+    with Publisher(registry) as publisher:
+        assert publisher.session.auth == ("user", "s3cr3t-password")
@@ -0,0 +1,46 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from untropy.utils.random_name import NameAllocator, name_space_size
+
+
+def test_allocator_names_are_unique(tmp_path):
+    allocator = NameAllocator.for_workspace(tmp_path, seed=42)
+    names = allocator.allocate(500) + NameAllocator.for_workspace(tmp_path).allocate(500)
+    assert len(set(names)) == 1000
+
+
+def test_allocator_is_seeded(tmp_path):
+    first = NameAllocator(tmp_path / "first.json", seed=1).allocate(10)
+    second = NameAllocator(tmp_path / "second.json", seed=1).allocate(10)
+    assert first == second
+
+
+def test_allocator_adds_suffix_when_exhausted(tmp_path):
+    lists = (["a", "b"], ["c", "d", "e"])
+    allocator = NameAllocator(tmp_path / "small.json", seed=0, lists=lists)
+    names = allocator.allocate(name_space_size(lists) * 2)
+    assert len(set(names)) == 12
+    assert sum(name.endswith("-2") for name in names) == 6
+
+
+def test_allocator_fails_without_valid_names(tmp_path):
+    allocator = NameAllocator(tmp_path / "same.json", seed=0, lists=(["a"], ["a"]))
+    with pytest.raises(ValueError, match="set repeat_parts"):
+        allocator.allocate()
+    assert NameAllocator(tmp_path / "same.json", repeat_parts=True, lists=(["a"], ["a"])).allocate() == ["a-a"]
+    with pytest.raises(ValueError, match="No name"):
+        NameAllocator(tmp_path / "empty.json", lists=(["a"], [])).allocate()
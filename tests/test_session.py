@@ -0,0 +1,84 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import threading
+import time
+
+import pytest
+
+from untropy.config.model import UntropyConfigurationError
+from untropy.session import Untropy
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    monkeypatch.setenv("UNTROPY_WORKSPACE", str(tmp_path / "workspace"))
+    project = tmp_path / "project"
+    project.mkdir()
+    (project / "untropy.toml").write_text('env = "api_dev"\n[variables]\nA = "1"\n[cookiecutter]\nname = "api"\n')
+    return project
+
+
+def test_session_caches_and_reloads(project):
+    session = Untropy(project, check_interval=0)
+    environment = session.shell_environment()
+    assert environment["A"] == "1" and environment["UNTROPY_TIER"] == "dev"
+    settings = session.settings()
+    assert session.settings() is settings
+    assert session.environments() == ["api_dev"]
+    with pytest.raises(UntropyConfigurationError):
+        session.settings("api_prod")
+
+    (project / "untropy.toml").write_text('env = "api_dev"\n[variables]\nA = "22"\n')
+    assert session.shell_environment()["A"] == "22"
+    assert session.settings() is not settings
+
+
+def test_session_resolves_expired_values(project, monkeypatch):
+    (project / "untropy.toml").write_text('env = "api_dev"\n[variables]\nRUNS = "@cmd:echo >> runs && wc -l < runs"\n')
+    session = Untropy(project)
+    assert session.shell_environment()["RUNS"].strip() == "1"
+    assert session.shell_environment()["RUNS"].strip() == "1"
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 301)  # the configuration is unchanged, the cmd TTL expired
+    assert session.shell_environment()["RUNS"].strip() == "2"
+
+
+def test_session_concurrent_access(project):
+    session = Untropy(project)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(session.shell_environment()["A"])) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["1"] * 16
+
+
+def test_session_generates_cookie(project, tmp_path, monkeypatch):
+    (tmp_path / "cookiecutter.yaml").write_text(f"replay_dir: {tmp_path / 'replay'}\n")
+    monkeypatch.setenv("COOKIECUTTER_CONFIG", str(tmp_path / "cookiecutter.yaml"))
+    cookies_dir = tmp_path / "cookies"
+    template = cookies_dir / "service" / "{{cookiecutter.name}}"
+    template.mkdir(parents=True)
+    (cookies_dir / "service" / "cookiecutter.json").write_text(json.dumps({"name": "default"}))
+    (template / "README").write_text("{{cookiecutter.name}}")
+
+    session = Untropy(project, cookies_dir=cookies_dir)
+    assert session.cookies() == ["service"]
+    generated = session.generate_cookie("service", tmp_path / "output")
+    assert generated == tmp_path / "output" / "api"
+    assert (generated / "README").read_text() == "api"
+    assert (tmp_path / "replay" / "service.json").exists()
@@ -0,0 +1,121 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import stat
+import sys
+
+import pytest
+from click.testing import CliRunner
+
+from untropy.cli import cli
+from untropy.config import load_configuration
+from untropy.config.model import UntropyConfigurationError
+from untropy.config.snapshot import load_snapshot, write_snapshot
+
+CONFIGURATION = """\
+env = "api_dev"
+[variables]
+GREETING = "hello"
+[services.api]
+path = "api"
+build = "make"
+[environments.api_prod.variables]
+GREETING = "bonjour"
+"""
+
+
+def test_snapshot_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setenv("UNTROPY_WORKSPACE", str(tmp_path / "workspace"))
+    (tmp_path / "untropy.toml").write_text(CONFIGURATION)
+    settings = load_configuration(tmp_path)
+    path = tmp_path / "settings.snapshot"
+    write_snapshot(path, settings, ["api_prod"])
+    assert stat.S_IMODE(path.stat().st_mode) == 0o600
+
+    frozen = load_snapshot(path)
+    assert frozen.dict() == settings.dict()
+    assert frozen.services["api"].stage_command("build") == "make"
+    assert frozen.home == tmp_path
+    prod = frozen.for_environment("api_prod")
+    assert prod.dict() == settings.for_environment("api_prod").dict()
+    assert prod.for_environment("api_dev") is frozen
+
+
+def test_snapshot_without_secrets(tmp_path, monkeypatch):
+    monkeypatch.setenv("UNTROPY_WORKSPACE", str(tmp_path / "workspace"))
+    monkeypatch.setenv("TWINE_PASSWORD", "s3cr3t-password")
+    (tmp_path / "untropy.toml").write_text(CONFIGURATION)
+    path = tmp_path / "settings.snapshot"
+    write_snapshot(path, load_configuration(tmp_path), ["api_prod"])
+    assert "s3cr3t-password" not in path.read_text()
+    assert '"password"' not in path.read_text()
+
+    frozen = load_snapshot(path)
+    assert frozen.registry.password is not None
+    assert frozen.registry.password.get_secret_value() == "s3cr3t-password"
+    monkeypatch.delenv("TWINE_PASSWORD")
+    assert load_snapshot(path).registry.password is None
+
+
+def test_snapshot_freezes_provided_variables(tmp_path, monkeypatch):
+    monkeypatch.setenv("UNTROPY_WORKSPACE", str(tmp_path / "workspace"))
+    (tmp_path / "secrets.env").write_text("TOKEN=s3cr3t-token\n")
+    (tmp_path / "untropy.toml").write_text(
+        'env = "api_dev"\nsecrets_file = "secrets.env"\n'
+        '[variables]\nRUNS = "@cmd:echo >> runs && wc -l < runs"\nTOKEN = "@secret:TOKEN"\n'
+    )
+    path = tmp_path / "settings.snapshot"
+    write_snapshot(path, load_configuration(tmp_path))
+    assert "s3cr3t-token" not in path.read_text()
+    shutil.rmtree(tmp_path / "workspace")  # a job on another runner, without the providers cache
+
+    frozen = load_snapshot(path)
+    assert frozen.shell_environment["RUNS"].strip() == "1"
+    assert frozen.shell_environment["TOKEN"] == "s3cr3t-token"
+    assert (tmp_path / "runs").read_text() == "\n"  # the command ran once, when freezing
+
+
+def test_corrupted_snapshot(tmp_path):
+    path = tmp_path / "settings.snapshot"
+    with pytest.raises(UntropyConfigurationError, match="Unable to read"):
+        load_snapshot(path)
+    write_snapshot(path, load_configuration(tmp_path))
+    header, payload = path.read_text().splitlines()
+    path.write_text(f"{header}\n{payload.replace('devops', 'devips')}\n")
+    with pytest.raises(UntropyConfigurationError, match="checksum"):
+        load_snapshot(path)
+    path.write_text(f'{{"format": 0}}\n{payload}\n')
+    with pytest.raises(UntropyConfigurationError, match="format"):
+        load_snapshot(path)
+
+
+def test_freeze_and_use_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setenv("UNTROPY_WORKSPACE", str(tmp_path / "workspace"))
+    project = tmp_path / "project"
+    project.mkdir()
+    (project / "untropy.toml").write_text(CONFIGURATION)
+    monkeypatch.chdir(project)
+    runner = CliRunner()
+    result = runner.invoke(cli, ["env", "--freeze", str(tmp_path / "snapshot"), "--freeze-env", "api_prod"])
+    assert result.exit_code == 0, result.output
+    assert "api_dev, api_prod frozen" in result.output
+
+    monkeypatch.chdir(tmp_path)  # no configuration file
+    monkeypatch.setenv("UNTROPY_SNAPSHOT", str(tmp_path / "snapshot"))
+    script = "import os; print(os.environ['GREETING'])"
+    result = runner.invoke(cli, ["exec", "--each", "api_dev,api_prod", "--", sys.executable, "-c", script])
+    assert result.exit_code == 0, result.output
+    assert "[api_dev] hello" in result.output
+    assert "[api_prod] bonjour" in result.output
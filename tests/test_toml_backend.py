@@ -0,0 +1,52 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+import pytest
+
+from untropy.config.model import UntropyConfigurationError
+from untropy.utils.toml_backend import (
+    available_backends,
+    backend_loads,
+    loads,
+    selected_backend,
+)
+
+DOCUMENT = """
+env = "untropy_dev"
+date = 1979-05-27T07:32:00-08:00
+inline = { a = 1, b = [1, 2] }
+
+[variables]
+NAME = "value"
+"""
+
+
+@pytest.mark.parametrize("backend", available_backends())
+def test_backends_return_same_types(backend):
+    result = backend_loads(backend)(DOCUMENT)
+    assert result == backend_loads(available_backends()[0])(DOCUMENT)
+    assert type(result["inline"]) is dict
+    assert result["date"].tzinfo == datetime.timezone(datetime.timedelta(hours=-8))
+
+
+def test_unknown_backend(monkeypatch):
+    monkeypatch.setenv("UNTROPY_TOML_BACKEND", "yaml")
+    selected_backend.cache_clear()
+    try:
+        with pytest.raises(UntropyConfigurationError, match="Possible values: tomli, tomllib, toml"):
+            loads(DOCUMENT)
+    finally:
+        selected_backend.cache_clear()
@@ -0,0 +1,45 @@
+# Copyright 2022 Antoine Martin
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import json
+import sys
+
+from click.testing import CliRunner
+
+from untropy.cli import cli
+from untropy.utils import trace
+
+
+def test_span_disabled_is_shared(monkeypatch):
+    monkeypatch.setattr(trace, "_path", None)
+    assert trace.span("a") is trace.span("b")
+
+
+def test_trace_option_writes_chrome_trace(tmp_path, monkeypatch):
+    monkeypatch.setattr(trace, "_events", list(trace._events))
+    monkeypatch.setattr(trace, "_path", None)
+    monkeypatch.setattr(atexit, "register", lambda function: None)
+    path = tmp_path / "trace.json"
+    runner = CliRunner()
+    result = runner.invoke(cli, ["--trace", str(path), "exec", "--each", "devops_dev", "--", sys.executable, "-V"])
+    assert result.exit_code == 0
+    trace.flush()
+
+    events = json.loads(path.read_text())["traceEvents"]
+    names = {event["name"] for event in events if event["ph"] == "X"}
+    assert {"import", "setup_logging", "untropy", "load_configuration", "untropy exec", "subprocess"} <= names
+    spans = {event["name"]: event for event in events if event["ph"] == "X"}
+    command, subprocess = spans["untropy exec"], spans["subprocess"]
+    assert command["ts"] <= subprocess["ts"] and subprocess["ts"] + subprocess["dur"] <= command["ts"] + command["dur"]